@@ -0,0 +1,261 @@
+"""Population analytics over all sessions in the session database.
+
+All sessions are loaded into arrays with the shape session x ear x frequency, so aggregates
+per frequency and ear are computed without a loop over the sessions. The arrays are cached
+next to the database and only the new sessions are read on the next run.
+
+Run from the repository root:
+    python -m app.analytics results
+"""
+import os
+import argparse
+import warnings
+import numpy as np
+from .audiogram_data import NOT_HEARD, MISSING, parse_value
+from .config import SESSION_STORE_FILENAME
+from .session_store import SessionStore
+
+
+frequencies = [125, 250, 500, 1000, 2000, 4000, 8000]
+sides = ['l', 'r']
+age_buckets = [0, 20, 30, 40, 50, 60, 70, 80] # lower bounds of the age groups in years
+cache_filename = "analytics_cache.npz"
+session_columns = ['session_id', 'subject_id', 'date', 'program', 'headphone', 'age', 'gender']
+threshold_columns = ['levels', 'status']
+
+def parse_age(value:str)->float:
+    """Converts the age from the database into a number.
+
+    Args:
+        value (str): age in years, may be empty
+
+    Returns:
+        float: age in years, NaN if it is no number
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def read_sessions(store:SessionStore, session_ids:np.ndarray)->dict:
+    """Reads sessions from the database into arrays.
+
+    Args:
+        store (SessionStore): database of the sessions
+        session_ids (np.ndarray): ids of the sessions to be read, ascending
+
+    Returns:
+        dict of str:np.ndarray : 'session_id', 'subject_id', 'date', 'program', 'headphone', 'age' and 'gender' with one value per session,
+            'levels' (dB HL, NaN unless heard) and 'status' (HEARD, NOT_HEARD or MISSING of audiogram_data) with the shape session x ear x frequency
+    """
+    n = len(session_ids)
+    data = {'session_id': np.asarray(session_ids, dtype=np.int64),
+            'levels': np.full((n, len(sides), len(frequencies)), np.nan, dtype=np.float32),
+            'status': np.full((n, len(sides), len(frequencies)), MISSING, dtype=np.uint8)}
+    if n == 0:
+        for column in ['subject_id', 'date', 'program', 'headphone', 'gender']:
+            data[column] = np.array([], dtype=str)
+        data['age'] = np.array([], dtype=np.float64)
+        return data
+
+    first = int(session_ids[0])
+    with store.lock:
+        sessions = store.connection.execute(
+            "SELECT id, subject_id, date, program, headphone, age, gender FROM sessions WHERE id >= ? ORDER BY id", (first,)).fetchall()
+        thresholds = store.connection.execute(
+            "SELECT session_id, side, frequency, value FROM thresholds WHERE session_id >= ?", (first,)).fetchall()
+
+    wanted = set(data['session_id'].tolist())
+    sessions = [row for row in sessions if row[0] in wanted]
+    data['subject_id'] = np.array([row[1] for row in sessions], dtype=str)
+    data['date'] = np.array([row[2] for row in sessions], dtype=str)
+    data['program'] = np.array([row[3] or "" for row in sessions], dtype=str)
+    data['headphone'] = np.array([row[4] or "" for row in sessions], dtype=str)
+    data['age'] = np.array([parse_age(row[5]) for row in sessions], dtype=np.float64)
+    data['gender'] = np.array([row[6] or "" for row in sessions], dtype=str)
+
+    if thresholds:
+        ids, side, frequency, value = (np.array(column) for column in zip(*thresholds))
+        index = np.searchsorted(data['session_id'], ids.astype(np.int64))
+        valid = (index < n) & np.isin(side, sides) & np.isin(frequency.astype(np.int64), frequencies)
+        valid[valid] &= data['session_id'][index[valid]] == ids[valid].astype(np.int64)
+        index, side, value = index[valid], side[valid], value[valid]
+        i = (side == 'r').astype(np.intp)
+        j = np.searchsorted(frequencies, frequency[valid].astype(np.int64))
+        levels, status = zip(*(parse_value(v) for v in value.tolist())) if len(value) else ((), ())
+        data['levels'][index, i, j] = np.array(levels, dtype=np.float32)
+        data['status'][index, i, j] = np.array(status, dtype=np.uint8)
+    return data
+
+def concatenate(first:dict, second:dict)->dict:
+    """Appends the sessions of the second to the first arrays.
+
+    Args:
+        first (dict): arrays from read_sessions()
+        second (dict): arrays from read_sessions()
+
+    Returns:
+        dict: arrays of both
+    """
+    return {key: np.concatenate([first[key], second[key]]) for key in first}
+
+def select(data:dict, mask:np.ndarray)->dict:
+    """Selects sessions.
+
+    Args:
+        data (dict): arrays from load_sessions()
+        mask (np.ndarray): boolean mask or indices of the sessions
+
+    Returns:
+        dict: arrays of the selected sessions
+    """
+    return {key: value[mask] for key, value in data.items()}
+
+def load_sessions(save_path:str, database:str=None, use_cache:bool=True)->dict:
+    """Loads all sessions of the database. The arrays are cached in the save path,
+    only sessions that were added since the last call are read from the database
+    and sessions that were removed are dropped from the cache.
+    The cache stores the path of its database and is rebuilt when another database is loaded.
+
+    Args:
+        save_path (str): folder of the results
+        database (str, optional): name of the database file. SESSION_STORE_FILENAME in the save path if None. Defaults to None.
+        use_cache (bool, optional): Read and update the cache file. Defaults to True.
+
+    Returns:
+        dict of str:np.ndarray : see read_sessions()
+    """
+    database = os.path.abspath(database or os.path.join(save_path, SESSION_STORE_FILENAME))
+    store = SessionStore(database)
+    try:
+        with store.lock:
+            session_ids = np.array([row[0] for row in store.connection.execute("SELECT id FROM sessions ORDER BY id")], dtype=np.int64)
+
+        cache_file = os.path.join(save_path, cache_filename)
+        data = None
+        if use_cache and os.path.exists(cache_file):
+            try:
+                with np.load(cache_file) as cache:
+                    if str(cache['database']) == database: # ids of another database would give the wrong sessions
+                        data = {key: cache[key] for key in session_columns + threshold_columns}
+            except (OSError, KeyError, ValueError) as e:
+                print(f"Cache {cache_file} is not readable and will be rebuilt: {e}")
+
+        if data is None:
+            data = read_sessions(store, session_ids)
+        else:
+            data = select(data, np.isin(data['session_id'], session_ids))
+            new_ids = session_ids[~np.isin(session_ids, data['session_id'])]
+            if len(new_ids) == 0 and len(data['session_id']) == len(session_ids):
+                return data
+            data = concatenate(data, read_sessions(store, new_ids))
+            data = select(data, np.argsort(data['session_id'], kind='stable'))
+    finally:
+        store.close()
+
+    if use_cache:
+        np.savez(cache_file, database=np.array(database), **data)
+    return data
+
+def get_age_groups(data:dict, buckets:list=None)->np.ndarray:
+    """Assigns each session to an age group.
+
+    Args:
+        data (dict): arrays from load_sessions()
+        buckets (list of int, optional): lower bounds of the age groups in years. Defaults to age_buckets.
+
+    Returns:
+        np.ndarray: label like '20-29' or '80+' for each session, '' if the age is missing
+    """
+    buckets = age_buckets if buckets is None else buckets
+    labels = [f"{low}-{high - 1}" for low, high in zip(buckets, buckets[1:])] + [f"{buckets[-1]}+"]
+    index = np.searchsorted(buckets, data['age'], side='right') - 1
+    groups = np.array(labels + [""], dtype=str)[np.where(np.isnan(data['age']) | (index < 0), len(labels), index)]
+    return groups
+
+def grouped_percentiles(data:dict, groups:np.ndarray, percentiles:list=(10, 50, 90))->dict:
+    """Calculates percentiles of the thresholds per group, ear and frequency.
+    Values that are 'NH' or 'NaN' are left out.
+
+    Args:
+        data (dict): arrays from load_sessions()
+        groups (np.ndarray): label of the group of each session, e.g. from get_age_groups() or data['gender']
+        percentiles (list of float, optional): percentiles to be calculated. Defaults to (10, 50, 90).
+
+    Returns:
+        dict of str:dict : 'percentiles' in dB HL with the shape percentile x ear x frequency
+            and 'n' (number of values) with the shape ear x frequency for each group
+    """
+    result = {}
+    for group in np.unique(groups):
+        levels = data['levels'][groups == group]
+        count = np.count_nonzero(~np.isnan(levels), axis=0)
+        with warnings.catch_warnings(): # frequencies without values give NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            values = np.nanpercentile(levels, percentiles, axis=0) if len(levels) else np.full((len(percentiles),) + levels.shape[1:], np.nan)
+        values[:, count == 0] = np.nan
+        result[str(group)] = {'percentiles': values, 'n': count}
+    return result
+
+def grouped_medians(data:dict, groups:np.ndarray)->dict:
+    """Calculates the median thresholds per group, ear and frequency.
+
+    Args:
+        data (dict): arrays from load_sessions()
+        groups (np.ndarray): label of the group of each session
+
+    Returns:
+        dict of str:np.ndarray : median in dB HL with the shape ear x frequency for each group
+    """
+    return {group: values['percentiles'][0] for group, values in grouped_percentiles(data, groups, [50]).items()}
+
+def screening_fail_rates(data:dict, groups:np.ndarray=None, program:str="ScreeningProcedure")->dict:
+    """Calculates the share of screenings that were not passed per group, ear and frequency.
+
+    Args:
+        data (dict): arrays from load_sessions()
+        groups (np.ndarray, optional): label of the group of each session. All sessions form one group 'all' if None. Defaults to None.
+        program (str, optional): procedure of the screenings. Defaults to "ScreeningProcedure".
+
+    Returns:
+        dict of str:np.ndarray : fail rate with the shape ear x frequency for each group, NaN without screenings
+    """
+    groups = np.full(len(data['session_id']), "all") if groups is None else groups
+    screening = data['program'] == program
+    result = {}
+    for group in np.unique(groups[screening]):
+        mask = screening & (groups == group)
+        tested = np.count_nonzero(data['status'][mask] != MISSING, axis=0)
+        failed = np.count_nonzero(data['status'][mask] == NOT_HEARD, axis=0)
+        with np.errstate(all='ignore'):
+            result[str(group)] = np.where(tested > 0, failed / tested, np.nan)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('save_path', help='folder of the results')
+    parser.add_argument('--database', default=None, help=f'database file (default: {SESSION_STORE_FILENAME} in the save path)')
+    parser.add_argument('--group-by', choices=['age', 'gender'], default='age', help='grouping of the sessions (default: %(default)s)')
+    parser.add_argument('--no-cache', action='store_true', help='read all sessions from the database')
+    args = parser.parse_args()
+
+    data = load_sessions(args.save_path, args.database, use_cache=not args.no_cache)
+    groups = get_age_groups(data) if args.group_by == 'age' else data['gender']
+    print(f"{len(data['session_id'])} Sitzungen")
+
+    print("Median in dB HL")
+    print(f"{'Gruppe':>8} {'Ohr':>3} " + " ".join(f"{f:>6}" for f in frequencies))
+    for group, values in grouped_medians(data, groups).items():
+        for i, side in enumerate(sides):
+            print(f"{group or '-':>8} {side:>3} " + " ".join(f"{v:>6.1f}" for v in values[i]))
+
+    fail_rates = screening_fail_rates(data, groups)
+    if fail_rates:
+        print("Nicht bestandene Screenings")
+        for group, values in fail_rates.items():
+            for i, side in enumerate(sides):
+                print(f"{group or '-':>8} {side:>3} " + " ".join(f"{v:>6.1%}" for v in values[i]))
+
+
+if __name__ == "__main__":
+    main()
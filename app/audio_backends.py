@@ -0,0 +1,446 @@
+import numpy as np
+import threading
+import time
+import wave
+from .clock import RealClock, real_clock
+
+
+def import_sounddevice():
+    """Imports sounddevice on first use, so the memory and WAV backends also work on machines without PortAudio.
+
+    Returns:
+        module: sounddevice
+    """
+    import sounddevice as sd
+    return sd
+
+def read_all(stimulus, channels:int=2, block_size:int=4096, max_frames:int=None)->np.array:
+    """Reads all remaining frames of a stimulus into one array.
+
+    Args:
+        stimulus (BufferSource or ToneOscillator): stimulus to be read
+        channels (int, optional): number of output channels. Defaults to 2.
+        block_size (int, optional): number of frames read at once. Defaults to 4096.
+        max_frames (int, optional): read at most this many frames. All frames if None. Defaults to None.
+
+    Returns:
+        np.array: frames of shape (n, channels) as float32
+    """
+    blocks = []
+    remaining = max_frames
+    while not stimulus.done and remaining != 0:
+        block = np.empty((block_size if remaining is None else min(block_size, remaining), channels), dtype=np.float32)
+        n = stimulus.read_into(block)
+        blocks.append(block[:n])
+        if remaining is not None:
+            remaining -= n
+    if not blocks:
+        return np.zeros((0, channels), dtype=np.float32)
+    return np.concatenate(blocks)
+
+
+class PlaybackTelemetry:
+
+    def __init__(self):
+        """Collects onset times, output latency and stream errors of one session.
+        All times are in seconds. Onsets are stored both in the clock of the output (DAC time)
+        and converted to time.monotonic(), so they can be compared with key press times.
+        """
+        self.lock = threading.Lock()
+        self.output_latency = None # reported by the output device
+        self.reset()
+
+    def reset(self):
+        """Removes all recorded onsets and counters, e.g. at the start of a new session.
+        """
+        with self.lock:
+            self.onsets = [] # one dict per stimulus
+            self.underflows = 0
+            self.overflows = 0
+            self.blocks = 0 # number of processed audio blocks
+
+    def record_onset(self, dac_time:float, request_time:float, request_monotonic:float):
+        """Records the onset of a stimulus.
+
+        Args:
+            dac_time (float): time the first sample reaches the DAC (clock of the output)
+            request_time (float): time the stimulus was handed to the output (clock of the output)
+            request_monotonic (float): time.monotonic() at the same moment as request_time
+        """
+        with self.lock:
+            self.onsets.append({'dac_time': dac_time,
+                                'delay': dac_time - request_time,
+                                'monotonic': request_monotonic + (dac_time - request_time)})
+
+    def record_block(self, status):
+        """Counts an audio block and its underflow and overflow flags.
+
+        Args:
+            status (sd.CallbackFlags): status flags of the stream
+        """
+        with self.lock:
+            self.blocks += 1
+            if status:
+                self.underflows += int(bool(status.output_underflow))
+                self.overflows += int(bool(status.output_overflow))
+
+    def get_last_onset(self)->dict:
+        """Gets the onset of the last stimulus.
+
+        Returns:
+            dict or None: dac_time, delay and monotonic time of the onset or None if nothing was played yet
+        """
+        with self.lock:
+            return self.onsets[-1] if self.onsets else None
+
+    def get_statistics(self)->dict:
+        """Gets the statistics of the session.
+
+        Returns:
+            dict: number of onsets, mean and max delay between request and onset, output latency,
+                number of audio blocks, underflows and overflows
+        """
+        with self.lock:
+            delays = np.array([onset['delay'] for onset in self.onsets])
+            return {'onsets': len(self.onsets),
+                    'mean_onset_delay': float(delays.mean()) if len(delays) else None,
+                    'max_onset_delay': float(delays.max()) if len(delays) else None,
+                    'output_latency': self.output_latency,
+                    'blocks': self.blocks,
+                    'underflows': self.underflows,
+                    'overflows': self.overflows}
+
+
+class AudioBackend:
+
+    def __init__(self, samplerate:float, channels:int=2):
+        """Base class for the outputs of the AudioPlayer.
+        Subclasses play stimuli (BufferSource or ToneOscillator) that the player hands to them.
+
+        Args:
+            samplerate (float): samplerate in Hz
+            channels (int, optional): number of output channels. Defaults to 2.
+        """
+        self.samplerate = samplerate
+        self.channels = channels
+        self.telemetry = PlaybackTelemetry()
+
+    def play(self, stimulus, channel:str='lr', delay:float=0.0):
+        """Starts playing a stimulus. A stimulus that is still playing is replaced.
+
+        Args:
+            stimulus (BufferSource or ToneOscillator): stimulus to be played
+            channel (str, optional): 'l', 'r' or 'lr' for only left, only right or both channels respectively. Defaults to 'lr'.
+            delay (float, optional): time in seconds from now until the onset. Defaults to 0.0.
+        """
+        raise NotImplementedError
+
+    def stop(self):
+        """Stops the current playback.
+        """
+        raise NotImplementedError
+
+    def is_playing(self)->bool:
+        """Checks whether a stimulus is being played.
+
+        Returns:
+            bool: True while a stimulus is being played
+        """
+        return False
+
+    def close(self):
+        """Stops the current playback and releases the output.
+        """
+        self.stop()
+
+
+class SoundDeviceBackend(AudioBackend):
+
+    def __init__(self, samplerate:float, device=None, persistent_stream:bool=False, channels:int=2):
+        """Plays stimuli on a sound device through PortAudio (sounddevice).
+
+        Args:
+            samplerate (float): samplerate of the device in Hz
+            device (int or str, optional): output device (numeric ID or substring). Defaults to the default device.
+            persistent_stream (bool, optional): Keep one output stream open and mix the stimuli into it through a callback
+                instead of opening a new stream for every stimulus. Defaults to False.
+            channels (int, optional): number of output channels. Defaults to 2.
+        """
+        super().__init__(samplerate, channels)
+        self.sd = import_sounddevice()
+        self.device = device
+        self.persistent_stream = persistent_stream
+        self.stream = None
+        self.lock = threading.Lock() # guards stimulus, which is shared with the audio callback
+        self.stimulus = None # stimulus that is currently mixed into the persistent stream
+        self.playing = False
+        self.onset_pending = False # True until the first block of the current stimulus was written
+        self.request_time = 0 # stream time when the current stimulus should start
+        self.request_monotonic = 0 # time.monotonic() at the same moment
+
+    def play(self, stimulus, channel:str='lr', delay:float=0.0):
+        """Starts playing a stimulus. A stimulus that is still playing is replaced.
+        With a delay the stimulus is armed now and starts after the delay, timed by the clock of the output.
+
+        Args:
+            stimulus (BufferSource or ToneOscillator): stimulus to be played
+            channel (str, optional): 'l', 'r' or 'lr' for only left, only right or both channels respectively. Defaults to 'lr'.
+            delay (float, optional): time in seconds from now until the onset. Defaults to 0.0.
+        """
+        if self.persistent_stream:
+            self.open_stream()
+            with self.lock:
+                self.stimulus = stimulus
+                self.playing = True
+                self.onset_pending = True
+                self.request_time = self.stream.time + delay
+                self.request_monotonic = time.monotonic() + delay
+            return
+
+        frames = stimulus.frames if hasattr(stimulus, 'frames') else read_all(stimulus, self.channels)
+        if channel == 'lr': # same tone on both channels, play as mono
+            frames = np.ascontiguousarray(frames[:, 0]) # the column is a strided view of the frame builder buffer
+        if delay > 0: # the device plays the silence, so the onset is timed by its clock
+            frames = np.concatenate([np.zeros((int(round(delay * self.samplerate)),) + frames.shape[1:], dtype=frames.dtype), frames])
+        self.sd.play(frames, self.samplerate, device=self.device)
+        self.playing = True
+
+        # without the persistent stream the DAC time is unknown, use the time of the request as estimate
+        now = time.monotonic() + delay
+        self.telemetry.record_onset(now, now, now)
+
+    def open_stream(self):
+        """Opens and starts the persistent output stream if it is not running yet.
+        """
+        if self.stream is None:
+            self.stream = self.sd.OutputStream(samplerate=self.samplerate,
+                                               device=self.device,
+                                               channels=self.channels,
+                                               dtype='float32',
+                                               callback=self.stream_callback)
+            self.stream.start()
+            self.telemetry.output_latency = self.stream.latency
+
+    def stream_callback(self, outdata:np.array, frames:int, time_info, status):
+        """Callback of the persistent stream. Writes the next block of the current stimulus into the output buffer
+        and fills the rest with silence. A delayed stimulus starts at the sample of its start time.
+        Records the DAC time of each onset and the status flags.
+
+        Args:
+            outdata (np.array): output buffer of shape (frames, channels)
+            frames (int): number of frames requested
+            time_info: timestamps of the audio block (CData struct with outputBufferDacTime and currentTime)
+            status (sd.CallbackFlags): status flags of the stream
+        """
+        self.telemetry.record_block(status)
+
+        with self.lock:
+            if self.stimulus is None:
+                outdata.fill(0)
+                return
+
+            if self.stimulus.done: # ended or stopped, possibly before its onset, which is then not recorded
+                outdata.fill(0)
+                self.stimulus = None
+                self.onset_pending = False
+                self.playing = False
+                return
+
+            offset = 0 # first frame of the stimulus in this block
+            if self.onset_pending:
+                # some host APIs report 0 as DAC time, the current stream time is the closest estimate then
+                block_time = time_info.outputBufferDacTime or time_info.currentTime
+                offset = max(0, int(round((self.request_time - block_time) * self.samplerate))) if block_time else 0
+                if offset >= frames: # start time not reached yet
+                    outdata.fill(0)
+                    return
+                self.onset_pending = False
+                dac_time = (block_time or self.request_time) + offset / self.samplerate
+                self.telemetry.record_onset(dac_time, self.request_time, self.request_monotonic)
+
+            n = self.stimulus.read_into(outdata[offset:])
+            outdata[:offset] = 0
+            outdata[offset + n:] = 0
+
+            if self.stimulus.done:
+                self.stimulus = None
+                self.playing = False
+
+    def stop(self):
+        """Stops the current playback. In the persistent stream the stimulus is asked to stop,
+        so a ToneOscillator can fade out. A delayed stimulus that has not started yet is dropped.
+        """
+        if self.persistent_stream:
+            with self.lock:
+                if self.stimulus is not None and self.onset_pending: # not started yet, nothing to fade out
+                    self.stimulus = None
+                    self.onset_pending = False
+                    self.playing = False
+                elif self.stimulus is not None:
+                    self.stimulus.request_stop()
+        else:
+            self.sd.stop()
+            self.playing = False
+
+    def is_playing(self)->bool:
+        """Checks whether a stimulus is being played.
+
+        Returns:
+            bool: True while a stimulus is being played
+        """
+        return self.playing
+
+    def close(self):
+        """Stops the current playback and closes the persistent stream, if one is open.
+        """
+        self.stop()
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+class MemoryBackend(AudioBackend):
+
+    def __init__(self, samplerate:float=48000, channels:int=2, record_samples:bool=True, clock:RealClock=None):
+        """Records every stimulus that would have been played instead of playing it. Needs no sound card.
+        Like a device, only the frames between the onset and stop() are recorded.
+
+        Args:
+            samplerate (float, optional): samplerate in Hz. Defaults to 48000.
+            channels (int, optional): number of output channels. Defaults to 2.
+            record_samples (bool, optional): Keep the frames of each stimulus. Defaults to True.
+            clock (RealClock, optional): Clock of the procedure, e.g. a VirtualClock. Real time is used if None. Defaults to None.
+        """
+        super().__init__(samplerate, channels)
+        self.telemetry.output_latency = 0.0
+        self.record_samples = record_samples
+        self.clock = clock if clock is not None else real_clock
+        self.events = [] # one dict per played stimulus
+        self.current = None # event of the stimulus that is being played
+        self.stimulus = None # stimulus of the current event, read when it is stopped
+
+    def play(self, stimulus, channel:str='lr', delay:float=0.0):
+        """Records a stimulus with its channel and the time it was started.
+        The frames are taken from the stimulus when it is stopped.
+
+        Args:
+            stimulus (BufferSource or ToneOscillator): stimulus to be played
+            channel (str, optional): 'l', 'r' or 'lr' for only left, only right or both channels respectively. Defaults to 'lr'.
+            delay (float, optional): time in seconds from now until the onset. Defaults to 0.0.
+        """
+        self.stop()
+        request_time = self.clock.now()
+        self.stimulus = stimulus
+        self.current = {'channel': channel,
+                        'request': request_time,
+                        'start': request_time + delay,
+                        'stop': None,
+                        'num_frames': None,
+                        'frames': None}
+        self.events.append(self.current)
+        onset = time.monotonic() + delay
+        self.telemetry.record_onset(onset, onset, onset)
+
+    def write(self, event:dict, frames:np.array):
+        """Hook for subclasses that store the frames somewhere else.
+
+        Args:
+            event (dict): event of the stimulus
+            frames (np.array): frames of shape (n, channels) that were played
+        """
+        pass
+
+    def stop(self):
+        """Records the time the current stimulus was stopped and the frames a device would have played until then.
+        """
+        if self.current is None:
+            return
+        self.current['stop'] = self.clock.now()
+        if self.stimulus is not None:
+            max_frames = max(0, int(round((self.current['stop'] - self.current['start']) * self.samplerate)))
+            frames = read_all(self.stimulus, self.channels, max_frames=max_frames)
+            self.current['num_frames'] = len(frames)
+            self.current['frames'] = frames if self.record_samples else None
+            self.write(self.current, frames)
+        self.current = None
+        self.stimulus = None
+
+    def is_playing(self)->bool:
+        """Checks whether a stimulus is being played.
+
+        Returns:
+            bool: True between play() and stop()
+        """
+        return self.current is not None
+
+
+class NullBackend(MemoryBackend):
+
+    def __init__(self, samplerate:float=48000, channels:int=2, clock:RealClock=None):
+        """Discards all stimuli and only records channel and timestamps. Needs no sound card.
+
+        Args:
+            samplerate (float, optional): samplerate in Hz. Defaults to 48000.
+            channels (int, optional): number of output channels. Defaults to 2.
+            clock (RealClock, optional): Clock of the procedure, e.g. a VirtualClock. Real time is used if None. Defaults to None.
+        """
+        super().__init__(samplerate, channels, record_samples=False, clock=clock)
+
+    def play(self, stimulus, channel:str='lr', delay:float=0.0):
+        """Records channel and start time of a stimulus without generating its frames.
+
+        Args:
+            stimulus (BufferSource or ToneOscillator): stimulus to be played
+            channel (str, optional): 'l', 'r' or 'lr' for only left, only right or both channels respectively. Defaults to 'lr'.
+            delay (float, optional): time in seconds from now until the onset. Defaults to 0.0.
+        """
+        super().play(None, channel, delay)
+
+
+class WavFileBackend(MemoryBackend):
+
+    def __init__(self, filename:str, samplerate:float=48000, channels:int=2, clock:RealClock=None):
+        """Writes everything a device would have played into a 16 bit WAV file: each stimulus until it was stopped,
+        and silence from the first request on, between the stimuli and during their delays.
+        Channel and timestamps are recorded like in the MemoryBackend.
+
+        Args:
+            filename (str): name of the WAV file
+            samplerate (float, optional): samplerate in Hz. Defaults to 48000.
+            channels (int, optional): number of output channels. Defaults to 2.
+            clock (RealClock, optional): Clock of the procedure, e.g. a VirtualClock. Real time is used if None. Defaults to None.
+        """
+        super().__init__(samplerate, channels, record_samples=False, clock=clock)
+        self.filename = filename
+        self.position = None # time of the end of the written frames
+        self.file = wave.open(filename, 'wb')
+        self.file.setnchannels(channels)
+        self.file.setsampwidth(2)
+        self.file.setframerate(int(samplerate))
+
+    def write(self, event:dict, frames:np.array):
+        """Appends the silence since the last stimulus and the frames to the WAV file.
+
+        Args:
+            event (dict): event of the stimulus
+            frames (np.array): frames of shape (n, channels) that were played
+        """
+        if self.file is None:
+            return
+        if self.position is None:
+            self.position = event['request']
+        onset = min(event['start'], event['stop']) # stopped during the delay: silence until the stop only
+        silence = max(0, int(round((onset - self.position) * self.samplerate)))
+        block = np.zeros((int(self.samplerate), self.channels), dtype='<i2') # one second
+        for offset in range(0, silence, len(block)):
+            self.file.writeframes(block[:silence - offset].tobytes())
+        self.file.writeframes((np.clip(frames, -1, 1) * 32767).astype('<i2').tobytes())
+        self.position = max(self.position, onset) + len(frames) / self.samplerate
+
+    def close(self):
+        """Stops the current playback and finishes the WAV file.
+        """
+        super().close()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -1,24 +1,304 @@
 import numpy as np
-import sounddevice as sd
 import argparse
+import threading
+from collections import OrderedDict
+from .audio_backends import AudioBackend, SoundDeviceBackend, import_sounddevice
+
+
+class WaveformCache:
+
+    def __init__(self, max_bytes:int=64 * 1024 * 1024):
+        """Creates a bounded least-recently-used cache for unit-amplitude waveforms.
+        The least recently used waveforms are dropped as soon as the cached arrays exceed max_bytes.
+
+        Args:
+            max_bytes (int, optional): maximum size of all cached arrays in bytes. Defaults to 64 MiB.
+        """
+        self.max_bytes = max_bytes
+        self.waveforms = OrderedDict()
+        self.size = 0 # current size of all cached arrays in bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key:tuple)->np.array:
+        """Gets a waveform from the cache and marks it as most recently used.
+
+        Args:
+            key (tuple): (samplerate, frequency, duration, channel layout)
+
+        Returns:
+            np.array or None: cached waveform (read-only) or None if it is not cached
+        """
+        with self.lock:
+            waveform = self.waveforms.get(key)
+            if waveform is None:
+                self.misses += 1
+                return None
+            self.waveforms.move_to_end(key)
+            self.hits += 1
+            return waveform
+
+    def put(self, key:tuple, waveform:np.array):
+        """Adds a waveform to the cache and drops least recently used waveforms if the cache is full.
+        Waveforms larger than the whole cache are not stored.
+
+        Args:
+            key (tuple): (samplerate, frequency, duration, channel layout)
+            waveform (np.array): unit-amplitude waveform, will be made read-only
+        """
+        if waveform.nbytes > self.max_bytes:
+            return
+        waveform.flags.writeable = False
+
+        with self.lock:
+            if key in self.waveforms:
+                self.size -= self.waveforms.pop(key).nbytes
+            self.waveforms[key] = waveform
+            self.size += waveform.nbytes
+
+            while self.size > self.max_bytes:
+                _, dropped = self.waveforms.popitem(last=False)
+                self.size -= dropped.nbytes
+
+    def clear(self):
+        """Removes all waveforms and resets the counters.
+        """
+        with self.lock:
+            self.waveforms.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self)->dict:
+        """Gets usage statistics of the cache.
+
+        Returns:
+            dict: number of hits, misses, cached waveforms and their size in bytes
+        """
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'entries': len(self.waveforms),
+                    'bytes': self.size}
+
+
+class FrameBuilder:
+
+    def __init__(self, channels:int=2, num_buffers:int=2):
+        """Builds C-contiguous float32 stereo frames in preallocated buffers.
+        The tone is written directly into the column of the target channel, so no zero arrays
+        or transposed copies are created. Buffers are used in turns, so the frames of the previous
+        beep stay intact while the next beep is being built.
+
+        Args:
+            channels (int, optional): number of output channels. Defaults to 2.
+            num_buffers (int, optional): number of buffers used in turns. Defaults to 2.
+        """
+        self.channels = channels
+        self.buffers = [np.zeros((0, channels), dtype=np.float32) for _ in range(num_buffers)]
+        self.current = 0 # index of buffer that was used last
+
+    def build(self, tone:np.array, volume:float, channel:str='lr')->np.array:
+        """Writes a scaled mono tone into the target channel(s) of the next buffer.
+
+        Args:
+            tone (np.array): unit-amplitude mono tone
+            volume (float): volume multiplier (between 0 and 1)
+            channel (str, optional): 'l', 'r' or 'lr' for only left, only right or both channels respectively. Defaults to 'lr'.
+
+        Returns:
+            np.array: view of shape (len(tone), channels) on the buffer
+        """
+        self.current = (self.current + 1) % len(self.buffers)
+        n = len(tone)
+        if len(self.buffers[self.current]) < n:
+            self.buffers[self.current] = np.zeros((n, self.channels), dtype=np.float32)
+        frames = self.buffers[self.current][:n]
+
+        if channel == 'l':
+            np.multiply(tone, volume, out=frames[:, 0])
+            frames[:, 1:] = 0
+        elif channel == 'r':
+            frames[:, 0] = 0
+            np.multiply(tone, volume, out=frames[:, 1])
+        else:
+            np.multiply(tone, volume, out=frames[:, 0])
+            frames[:, 1] = frames[:, 0]
+        return frames
+
+
+class BufferSource:
+
+    def __init__(self, frames:np.array):
+        """Stimulus for the persistent stream that plays frames which were generated in advance.
+
+        Args:
+            frames (np.array): frames of shape (n, channels)
+        """
+        self.frames = frames
+        self.position = 0 # index of next frame to be played
+        self.done = False
+
+    def read_into(self, outdata:np.array)->int:
+        """Copies the next block of frames into outdata.
+
+        Args:
+            outdata (np.array): output buffer of shape (frames, channels)
+
+        Returns:
+            int: number of frames written (smaller than len(outdata) at the end of the stimulus)
+        """
+        block = self.frames[self.position:self.position + len(outdata)]
+        n = len(block)
+        outdata[:n] = block
+        self.position += n
+        if self.position >= len(self.frames):
+            self.done = True
+        return n
+
+    def request_stop(self):
+        """Ends the stimulus immediately.
+        """
+        self.done = True
+
+
+class ToneOscillator:
+
+    def __init__(self, frequency:float, volume:float, duration:float, fs:float, channel:str='lr', fade_duration:float=0.003):
+        """Stimulus for the persistent stream that generates a sine tone block by block on demand.
+        Memory use does not depend on the duration of the tone.
+        The samples are computed from the sample index, so the phase stays continuous across blocks
+        and the output is identical to the frames built by AudioPlayer.build_frames.
+
+        Args:
+            frequency (float): frequency in Hz
+            volume (float): volume multiplier (between 0 and 1)
+            duration (float): duration of the tone in seconds
+            fs (float): samplerate in Hz
+            channel (str, optional): 'l', 'r' or 'lr' for only left, only right or both channels respectively. Defaults to 'lr'.
+            fade_duration (float, optional): duration of the fade-out in seconds. Defaults to 0.003.
+        """
+        self.omega = 2 * np.pi * frequency
+        self.volume = volume
+        self.num_samples = int(fs * duration)
+        self.step = duration / self.num_samples # same time axis as np.linspace(0, duration, num_samples, endpoint=False)
+        self.channel = channel
+        self.fade_out = np.linspace(1, 0, int(fs * fade_duration))
+        self.fade_start = self.num_samples - len(self.fade_out) # index where the fade-out starts
+        self.end = self.num_samples # index after the last sample
+        self.index = 0 # index of next sample to be generated
+        self.done = False
+
+    def read_into(self, outdata:np.array)->int:
+        """Generates the next block of the tone into outdata.
+
+        Args:
+            outdata (np.array): output buffer of shape (frames, channels)
+
+        Returns:
+            int: number of frames written (smaller than len(outdata) at the end of the tone)
+        """
+        n = min(len(outdata), self.end - self.index)
+        indices = np.arange(self.index, self.index + n)
+        tone = np.sin(self.omega * (indices * self.step))
+
+        # apply the part of the fade-out that falls into this block
+        faded = indices >= self.fade_start
+        if faded.any():
+            tone[faded] *= self.fade_out[indices[faded] - self.fade_start]
+
+        if self.channel == 'l':
+            outdata[:n, 0] = tone
+            outdata[:n, 1:] = 0
+        elif self.channel == 'r':
+            outdata[:n, 0] = 0
+            outdata[:n, 1] = tone
+        else:
+            outdata[:n, 0] = tone
+            outdata[:n, 1] = tone
+        outdata[:n] *= self.volume
+
+        self.index += n
+        if self.index >= self.end:
+            self.done = True
+        return n
+
+    def request_stop(self):
+        """Starts the fade-out at the next sample, so the tone ends without a click.
+        """
+        if self.index < self.fade_start:
+            self.fade_start = self.index
+            self.end = self.index + len(self.fade_out)
 
 
 class AudioPlayer:
 
-    def __init__(self):
+    def __init__(self, persistent_stream:bool=False, waveform_cache:WaveformCache=None, oscillator:bool=False, device=None, samplerate:float=None, backend:AudioBackend=None):
         """Creates an audio player that can play sine beeps at various frequencies, volumes and with various durations.
         Automatically detects current samplerate of selected sound device.
+        Use device_registry.get_player() to get a player that is shared between procedures.
+
+        Args:
+            persistent_stream (bool, optional): Keep one output stream open for the whole session and mix the beeps into it
+                through a callback instead of opening a new stream for every beep. Defaults to False.
+            waveform_cache (WaveformCache, optional): cache for unit-amplitude waveforms. A new one is created if None. Defaults to None.
+            oscillator (bool, optional): Generate the beeps block by block with a ToneOscillator instead of generating
+                the whole tone in advance. Defaults to False.
+            device (int or str, optional): output device (numeric ID or substring). Defaults to the device from the command line.
+            samplerate (float, optional): samplerate of the device. It is detected if None. Defaults to None.
+            backend (AudioBackend, optional): output for the beeps, e.g. a MemoryBackend for runs without sound card.
+                A SoundDeviceBackend is created if None. Defaults to None.
         """
-        self.fs = self.get_device_samplerate()
+        self.device = device
+        if backend is None:
+            self.fs = samplerate if samplerate is not None else self.get_device_samplerate()
+            backend = SoundDeviceBackend(self.fs, device=device, persistent_stream=persistent_stream)
+        else:
+            self.fs = backend.samplerate
+        self.backend = backend
+        self.channels = backend.channels
         self.beep_duration = 10
         self.volume = 0
         self.frequency = 440
-        self.stream = None
-        self.is_playing = False
+        self.oscillator = oscillator
+
+        # unit-amplitude waveforms, the volume is applied as a scale on the cached buffer
+        self.waveform_cache = waveform_cache if waveform_cache is not None else WaveformCache()
+        self.frame_builder = FrameBuilder(self.channels)
+
+    @property
+    def is_playing(self)->bool:
+        """Whether a beep is being played.
+        """
+        return self.backend.is_playing()
 
     def generate_tone(self)->np.array:
         """Generates a sine tone with current audio player settings.
 
+        Returns:
+            array: sine wave as numpy array
+        """
+        return self.get_waveform() * self.volume
+
+    def get_waveform(self)->np.array:
+        """Gets the unit-amplitude mono waveform for the current frequency and beep duration from the cache.
+        The waveform is generated and cached if it is not cached yet.
+        Routing to the output channels is done by the frame builder.
+
+        Returns:
+            np.array: read-only unit-amplitude waveform as float32
+        """
+        key = (self.fs, self.frequency, self.beep_duration, 'mono')
+        waveform = self.waveform_cache.get(key)
+        if waveform is None:
+            waveform = self.generate_unit_tone().astype(np.float32)
+            self.waveform_cache.put(key, waveform)
+        return waveform
+
+    def generate_unit_tone(self)->np.array:
+        """Generates a sine tone with amplitude 1 and a short fade-out at the current frequency and beep duration.
+
         Returns:
             array: sine wave as numpy array
         """
@@ -26,7 +306,7 @@ class AudioPlayer:
                         stop=self.beep_duration, 
                         num=int(self.fs * self.beep_duration), 
                         endpoint=False)
-        tone = np.sin(2 * np.pi * self.frequency * t) * self.volume
+        tone = np.sin(2 * np.pi * self.frequency * t)
 
         # Create fade-out envelope
         fade_duration = 0.003  # 3 ms fade-out
@@ -40,30 +320,92 @@ class AudioPlayer:
 
         return tone
     
-    def play_beep(self, frequency:int, volume:float, duration:int, channel:str='lr'):
+    def play_beep(self, frequency:int, volume:float, duration:int, channel:str='lr', delay:float=0.0):
         """Sets the frequency, volume and beep duration of the audio player and then plays a beep with those parameters.
+        With a delay the beep is prepared now and starts after the delay, timed by the clock of the output.
 
         Args:
             frequency (int): frequency in Hz
             volume (float): volume multiplier (between 0 and 1)
             duration (int): duration of the beep in seconds
             channel (string): 'l', 'r' or 'lr' for only left, only right or both channels respectively
+            delay (float, optional): time in seconds from now until the onset. Defaults to 0.0.
         """
         self.frequency = frequency
         self.volume = volume
         self.beep_duration = duration
-        tone = self.generate_tone()
-        if channel == 'l':
-            sd.play(np.array([tone, np.zeros(len(tone))]).T, self.fs)
-        elif channel == 'r':
-            sd.play(np.array([np.zeros(len(tone)), tone]).T, self.fs)
+
+        if self.oscillator:
+            stimulus = ToneOscillator(frequency, volume, duration, self.fs, channel)
         else:
-            sd.play(tone, self.fs)
+            stimulus = BufferSource(self.build_frames(channel))
+        self.backend.play(stimulus, channel, delay)
+
+    def build_frames(self, channel:str='lr')->np.array:
+        """Builds float32 stereo frames of the current tone in a preallocated buffer of the frame builder.
+
+        Args:
+            channel (str, optional): 'l', 'r' or 'lr' for only left, only right or both channels respectively. Defaults to 'lr'.
+
+        Returns:
+            np.array: C-contiguous frames of shape (n, 2)
+        """
+        return self.frame_builder.build(self.get_waveform(), self.volume, channel)
 
     def stop(self):
         """Stops the current playback.
         """
-        sd.stop()
+        self.backend.stop()
+
+    def close(self):
+        """Stops the current playback and closes the output stream, if one is open.
+        """
+        self.backend.close()
+
+    def get_last_onset(self)->dict:
+        """Gets the onset of the last beep. With a persistent stream the onset is the time the first sample reaches the DAC.
+
+        Returns:
+            dict or None: dac_time, delay (between play_beep and onset) and onset converted to time.monotonic()
+        """
+        return self.backend.telemetry.get_last_onset()
+
+    def get_statistics(self)->dict:
+        """Gets the playback statistics of the current session.
+
+        Returns:
+            dict: number of onsets, mean and max onset delay, output latency of the device,
+                number of audio blocks, underflows and overflows
+        """
+        return self.backend.telemetry.get_statistics()
+
+    def reset_statistics(self):
+        """Resets the playback statistics, e.g. at the start of a new session.
+        """
+        self.backend.telemetry.reset()
+
+    def get_device_samplerate(self)->float:
+        """Gets current samplerate from the selected audio output device.
+        The device is probed only once per process by the device registry.
+
+        Returns:
+            float: samplerate of current sound device
+        """
+        return device_registry.get_device_info(self.device)['samplerate']
+
+
+class DeviceRegistry:
+
+    def __init__(self):
+        """Process-wide registry of audio output devices.
+        Each device is probed only once and all procedures share one audio player per device.
+        Use refresh() after plugging in a new audio interface.
+        """
+        self.lock = threading.RLock()
+        self.command_line_parsed = False
+        self.command_line_device = None # output device given on the command line
+        self.devices = {} # device argument -> device info
+        self.players = {} # device index -> shared audio player
 
     def int_or_str(self, text: str)->int:
         """Helper function for argument parsing.
@@ -73,32 +415,119 @@ class AudioPlayer:
         except ValueError:
             return text
 
-    def get_device_samplerate(self):
-        """Gets current samplerate from the selected audio output device.
+    def get_command_line_device(self):
+        """Gets the output device selected on the command line. The command line is parsed only once.
 
         Returns:
-            float: samplerate of current sound device
+            int or str or None: numeric ID or substring of device name, None for default device
+        """
+        with self.lock:
+            if self.command_line_parsed:
+                return self.command_line_device
+
+            parser = argparse.ArgumentParser(add_help=False)
+            parser.add_argument(
+                '-l', '--list-devices', action='store_true',
+                help='show list of audio devices and exit')
+            args, remaining = parser.parse_known_args()
+            if args.list_devices:
+                print(import_sounddevice().query_devices())
+                parser.exit(0)
+            parser = argparse.ArgumentParser(
+                description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter,
+                parents=[parser])
+            parser.add_argument(
+                'frequency', nargs='?', metavar='FREQUENCY', type=float, default=500,
+                help='frequency in Hz (default: %(default)s)')
+            parser.add_argument(
+                '-d', '--device', type=self.int_or_str,
+                help='output device (numeric ID or substring)')
+            parser.add_argument(
+                '-a', '--amplitude', type=float, default=0.2,
+                help='amplitude (default: %(default)s)')
+            args = parser.parse_args(remaining)
+
+            self.command_line_device = args.device
+            self.command_line_parsed = True
+            return self.command_line_device
+
+    def get_device_info(self, device=None)->dict:
+        """Gets information about an output device. The device is probed on first use only.
+
+        Args:
+            device (int or str, optional): numeric ID or substring of device name. Defaults to the device from the command line.
+
+        Returns:
+            dict: index, name, samplerate, channels, low_latency and high_latency (in seconds) of the device
+        """
+        if device is None:
+            device = self.get_command_line_device()
+
+        with self.lock:
+            if device not in self.devices:
+                info = import_sounddevice().query_devices(device, 'output')
+                self.devices[device] = {'index': info['index'],
+                                        'name': info['name'],
+                                        'samplerate': info['default_samplerate'],
+                                        'channels': info['max_output_channels'],
+                                        'low_latency': info['default_low_output_latency'],
+                                        'high_latency': info['default_high_output_latency']}
+            return self.devices[device]
+
+    def get_player(self, device=None)->AudioPlayer:
+        """Gets the shared audio player of a device. The player keeps one output stream open.
+
+        Args:
+            device (int or str, optional): numeric ID or substring of device name. Defaults to the device from the command line.
+
+        Returns:
+            AudioPlayer: shared audio player
         """
-        parser = argparse.ArgumentParser(add_help=False)
-        parser.add_argument(
-            '-l', '--list-devices', action='store_true',
-            help='show list of audio devices and exit')
-        args, remaining = parser.parse_known_args()
-        if args.list_devices:
-            print(sd.query_devices())
-            parser.exit(0)
-        parser = argparse.ArgumentParser(
-            description=__doc__,
-            formatter_class=argparse.RawDescriptionHelpFormatter,
-            parents=[parser])
-        parser.add_argument(
-            'frequency', nargs='?', metavar='FREQUENCY', type=float, default=500,
-            help='frequency in Hz (default: %(default)s)')
-        parser.add_argument(
-            '-d', '--device', type=self.int_or_str,
-            help='output device (numeric ID or substring)')
-        parser.add_argument(
-            '-a', '--amplitude', type=float, default=0.2,
-            help='amplitude (default: %(default)s)')
-        args = parser.parse_args(remaining)
-        return sd.query_devices(args.device, 'output')['default_samplerate']
\ No newline at end of file
+        info = self.get_device_info(device)
+
+        with self.lock:
+            if info['index'] not in self.players:
+                self.players[info['index']] = AudioPlayer(persistent_stream=True,
+                                                          device=info['index'],
+                                                          samplerate=info['samplerate'])
+            return self.players[info['index']]
+
+    def close(self):
+        """Closes the streams of all shared players. They are reopened on next use.
+        """
+        with self.lock:
+            for player in self.players.values():
+                player.close()
+
+    def is_registered(self, player:AudioPlayer)->bool:
+        """Checks whether a player is still one of the shared players, i.e. it was not dropped by refresh().
+
+        Args:
+            player (AudioPlayer): player from get_player()
+
+        Returns:
+            bool: True if the player can still be used
+        """
+        with self.lock:
+            return any(p is player for p in self.players.values())
+
+    def refresh(self):
+        """Closes all shared players and probes the devices again, e.g. after an audio interface was plugged in.
+        Players that were handed out before are dropped and must not be used anymore, get new ones with get_player().
+        """
+        with self.lock:
+            # all streams must be closed before PortAudio is terminated, the players keep device indices that may change
+            self.close()
+            self.players.clear()
+            self.devices.clear()
+
+            # PortAudio only scans for devices when it is initialized. sounddevice has no public function for this,
+            # so its private sd._terminate() and sd._initialize() are used. They invalidate all open streams,
+            # which is why the players were closed and dropped above.
+            sd = import_sounddevice()
+            sd._terminate()
+            sd._initialize()
+
+
+device_registry = DeviceRegistry()
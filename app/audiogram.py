@@ -1,20 +1,23 @@
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import numpy as np
 from .config import *
+from .audiogram_data import Audiogram
 
 
 # Maybe add option of date as subtitle. Subtitle is already implemented, but not used.
 
 freq_levels = {125: 20, 250: 20, 500: 20, 1000: 20, 2000: 20, 4000: 20, 8000: 20}
 
-def split_values(x_vals:list, values:list, target_values:np.array)->tuple:
-    """Helper function. Splits values into "heard" and "not heard" arrays.
+def split_values(audiogram:Audiogram, i:int, target_values:np.array)->tuple:
+    """Helper function. Splits the values of one ear into "heard" and "not heard" arrays.
 
     Args:
-        x_vals (list of int): indices of values
-        values (list of float and str): list of hearing levels and 'NH' if a sound was not heard
+        audiogram (Audiogram): levels of both ears
+        i (int): index of the ear in Audiogram.sides
         target_values (np.array): target value for "not heard" array
 
     Returns:
@@ -23,58 +26,48 @@ def split_values(x_vals:list, values:list, target_values:np.array)->tuple:
         np.array: indices of "not heard" array
         np.array: values of "not heard" array
     """
-    heard = np.array([[i, int(v)] for i, v in zip(x_vals, values) if v != 'NH' and v != None]).T
-    if len(heard) == 0:
-        heard_i, heard_level = [], []
-    else:
-        heard_i, heard_level = heard
-
-    not_heard = np.array([[i, t] for i, v, t in zip(x_vals, values, target_values) if v == 'NH' and v != None]).T
-    if len(not_heard) == 0:
-        not_heard_i, not_heard_level = [], []
-    else:
-        not_heard_i, not_heard_level = not_heard
-
-    return np.array(heard_i, dtype=int), np.array(heard_level, dtype=int), np.array(not_heard_i, dtype=int), np.array(not_heard_level, dtype=int)
-  
-def filter_none(x_vals:list, values:list)->tuple:
-    """Helper function. Removes None or NaN values from list.
-
-    Args:
-        x_vals (list of int): indices of values
-        values (list of float): list of hearing levels
-
-    Returns:
-        np.array: indices of values
-        np.array: array of hearing levels
-    """
-    filtered = np.array([[i, v] for i, v in zip(x_vals, values) if v not in (None, "NaN")]).T
-    if len(filtered) == 0:
-        return np.array([], dtype=int), np.array([], dtype=int)
-    i_vals, v_vals = filtered
-    
-    return np.array(i_vals, dtype=int), np.array(v_vals, dtype=int)
+    heard_i = np.flatnonzero(audiogram.heard()[i])
+    not_heard_i = np.flatnonzero(audiogram.not_heard()[i])
+    return heard_i, audiogram.levels[i, heard_i].astype(int), not_heard_i, target_values[not_heard_i].astype(int)
 
 def create_audiogram(freqs:list, left_values:list=None, right_values:list=None, binaural:bool=False, name:str="audiogram.png", freq_levels:dict=freq_levels, subtitle:str=None):
     """
     Creates an audiogram based on the given frequencies and hearing threshold values with custom x-axis labels.
 
     Args:
-        freqs (list of int): A list of frequencies in Hz.
-        left_values (list of int, optional): A list of hearing thresholds in dB HL for the left ear. Defaults to None.
-        right_values (list of int, optional): A list of hearing thresholds in dB HL for the right ear. Defaults to None.
+        freqs (Audiogram or list of int): The hearing thresholds of both ears, or a list of frequencies in Hz.
+        left_values (list of int, optional): A list of hearing thresholds in dB HL for the left ear, if freqs is a list. Defaults to None.
+        right_values (list of int, optional): A list of hearing thresholds in dB HL for the right ear, if freqs is a list. Defaults to None.
         binaural (bool, optional): Whether the audiogram is made from binaural test values. Defaults to False.
         name (str, optional): The name of the saved audiogram file. Defaults to "audiogram.png".
         freq_levels (dict, optional): A dictionary mapping frequencies to their target values. Defaults to freq_levels.
         subtitle (str, optional): A subtitle for the audiogram. Defaults to None.
     """
 
+    audiogram = freqs if isinstance(freqs, Audiogram) else Audiogram.from_values(freqs, left_values, right_values)
+    freqs = audiogram.freqs.tolist()
+
     print("Creating audiogram with frequencies:", freqs)
-    print("Left ear values:", left_values)
-    print("Right ear values:", right_values)
+    print("Left ear values:", audiogram.get_values('l'))
+    print("Right ear values:", audiogram.get_values('r'))
 
     fig, ax = plt.subplots(figsize=(10, 6))
+    band_texts = draw_background(ax)
+    nan_t = draw_values(ax, audiogram, binaural, freq_levels)
+    title = draw_axes(fig, ax, freqs, subtitle)
+    lgd = draw_legend(ax)
+    save_audiogram(fig, name, (title, lgd) + band_texts + ((nan_t,) if nan_t else ()))
+    plt.close(fig)
+
+def draw_background(ax)->tuple:
+    """Draws the colored bands of the degrees of hearing loss with their labels.
+
+    Args:
+        ax (matplotlib.axes.Axes): axes of the audiogram
 
+    Returns:
+        tuple of matplotlib.text.Text: labels of the bands
+    """
     ax.axhspan(-10, 20, facecolor='lightgreen', alpha=0.2)
     ax.axhspan(20, 40, facecolor='lightskyblue', alpha=0.2)
     ax.axhspan(40, 70, facecolor='yellow', alpha=0.2)
@@ -86,19 +79,32 @@ def create_audiogram(freqs:list, left_values:list=None, right_values:list=None,
     t3 = ax.text(6.4, 55, 'Mittlere\nSchwerhörigkeit', ha='left', va='center', fontsize=TEXT_FONT_SIZE)
     t4 = ax.text(6.4, 80, 'Schwere\nSchwerhörigkeit', ha='left', va='center', fontsize=TEXT_FONT_SIZE)
     t5 = ax.text(6.4, 105, 'Hochgradige\nSchwerhörigkeit', ha='left', va='center', fontsize=TEXT_FONT_SIZE)
+    return t1, t2, t3, t4, t5
+
+def draw_values(ax, audiogram:Audiogram, binaural:bool=False, freq_levels:dict=freq_levels):
+    """Draws the levels of both ears and the note about frequencies without a threshold.
+
+    Args:
+        ax (matplotlib.axes.Axes): axes of the audiogram
+        audiogram (Audiogram): levels of both ears
+        binaural (bool, optional): Whether the audiogram is made from binaural test values. Defaults to False.
+        freq_levels (dict, optional): A dictionary mapping frequencies to their target values. Defaults to freq_levels.
 
-    x_vals = range(len(freqs))
+    Returns:
+        matplotlib.text.Text: the note, False if there is none
+    """
+    x_vals = range(len(audiogram.freqs))
     target_values = np.array(list(freq_levels.values()))
 
-    nan_freqs_left = [freq for i, freq in zip(left_values, freqs) if i == 'NaN']
-    nan_freqs_right = [freq for i, freq in zip(right_values, freqs) if i == 'NaN']
+    nan_freqs_left = audiogram.freqs[audiogram.missing()[0]].tolist()
+    nan_freqs_right = audiogram.freqs[audiogram.missing()[1]].tolist()
 
     nan_text = ""
     nan_t = False
 
-    if 'NH' in left_values or 'NH' in right_values:
-        heard_i_left, heard_level_left, not_heard_i_left, not_heard_level_left = split_values(x_vals, left_values, target_values)
-        heard_i_right, heard_level_right, not_heard_i_right, not_heard_level_right = split_values(x_vals, right_values, target_values)
+    if audiogram.not_heard().any():
+        heard_i_left, heard_level_left, not_heard_i_left, not_heard_level_left = split_values(audiogram, 0, target_values)
+        heard_i_right, heard_level_right, not_heard_i_right, not_heard_level_right = split_values(audiogram, 1, target_values)
 
         if binaural:
             ax.plot(x_vals, target_values, linestyle='-', color=COLOR_BINAURAL)
@@ -113,8 +119,8 @@ def create_audiogram(freqs:list, left_values:list=None, right_values:list=None,
             ax.plot(not_heard_i_left, not_heard_level_left+SHIFT, marker=NOT_HEARD_LEFT_MARKER, markersize=NOT_HEARD_MARKER_SIZE, linestyle='None', linewidth=LINE_WIDTH, color=COLOR_LEFT, markeredgewidth=MARKER_EDGE_WIDTH, label='links nicht gehört')
 
     else:
-        x_vals_left, left_values = filter_none(x_vals, left_values)
-        x_vals_right, right_values = filter_none(x_vals, right_values)
+        x_vals_left, left_values, _, _ = split_values(audiogram, 0, target_values)
+        x_vals_right, right_values, _, _ = split_values(audiogram, 1, target_values)
 
         if binaural:
             ax.plot(x_vals_left, left_values, marker=MARKER_BINAURAL, markersize=MARKER_SIZE, linestyle='-', color=COLOR_BINAURAL, label='binaural')
@@ -125,7 +131,6 @@ def create_audiogram(freqs:list, left_values:list=None, right_values:list=None,
         if nan_freqs_left or nan_freqs_right:
             and_str = ""
             nan_text = "Bei folgenden Frequenzen konnte kein Wert ermittelt werden:\n"
-            print(nan_freqs_left, nan_freqs_right)
             if nan_freqs_left:
                 nan_text += f"links: {', '.join(map(str, nan_freqs_left))} "
                 and_str = "und "
@@ -133,6 +138,20 @@ def create_audiogram(freqs:list, left_values:list=None, right_values:list=None,
                 nan_text += f"{and_str}rechts: {', '.join(map(str, nan_freqs_right))}"
             nan_t = ax.text(0.05, -0.2, nan_text, transform=ax.transAxes, fontsize=TEXT_FONT_SIZE, ha='left', va='top', bbox=dict(facecolor='None', edgecolor='None'))
 
+    return nan_t
+
+def draw_axes(fig, ax, freqs:list, subtitle:str=None):
+    """Inverts the y-axis and draws title, axis labels, ticks and grid.
+
+    Args:
+        fig (matplotlib.figure.Figure): figure of the audiogram
+        ax (matplotlib.axes.Axes): axes of the audiogram
+        freqs (list of int): A list of frequencies in Hz.
+        subtitle (str, optional): A subtitle for the audiogram. Defaults to None.
+
+    Returns:
+        matplotlib.text.Text: the title
+    """
     ax.invert_yaxis()
     
     if subtitle:
@@ -149,12 +168,107 @@ def create_audiogram(freqs:list, left_values:list=None, right_values:list=None,
     ax.set_yticks(np.arange(0, 121, 10))
     ax.set_yticklabels(np.arange(0, 121, 10), fontsize=TICK_FONT_SIZE)
     ax.grid(True, which='both', linestyle='--', linewidth=0.5)
-    lgd = ax.legend(loc='upper left', bbox_to_anchor=(1.15, 0.205), fontsize=LEGEND_FONT_SIZE, frameon=False, labelspacing=1)
-    
-    if nan_t:
-        fig.savefig(name, bbox_extra_artists=(title, lgd, t1, t2, t3, t4, t5, nan_t), bbox_inches='tight')
-    else:
-        fig.savefig(name, bbox_extra_artists=(title, lgd, t1, t2, t3, t4, t5), bbox_inches='tight')
-    
-    plt.close(fig)
+    return title
+
+def draw_legend(ax):
+    """Draws the legend of the levels.
+
+    Args:
+        ax (matplotlib.axes.Axes): axes of the audiogram
+
+    Returns:
+        matplotlib.legend.Legend: the legend
+    """
+    return ax.legend(loc='upper left', bbox_to_anchor=(1.15, 0.205), fontsize=LEGEND_FONT_SIZE, frameon=False, labelspacing=1)
+
+def save_audiogram(fig, name:str, extra_artists:tuple):
+    """Saves the audiogram with a tight bounding box around the figure and the artists next to the axes.
+
+    Args:
+        fig (matplotlib.figure.Figure): figure of the audiogram
+        name (str): The name of the saved audiogram file.
+        extra_artists (tuple): title, legend and texts outside of the axes
+    """
+    fig.savefig(name, bbox_extra_artists=extra_artists, bbox_inches='tight')
+
+
+class AudiogramRenderer:
+
+    def __init__(self, figsize:tuple=(10, 6), dpi:float=None):
+        """Renders audiograms into one cached figure per frequency list and subtitle, instead of a new figure each time.
+        Bands, band labels, title, axis labels, ticks and grid are drawn once; only the lines, markers,
+        legend and note of each audiogram are swapped. The output is the same as with create_audiogram().
+
+        Args:
+            figsize (tuple, optional): size of the figure in inches. Defaults to (10, 6).
+            dpi (float, optional): resolution of the figure. rcParams['figure.dpi'] if None. Defaults to None.
+        """
+        self.figsize = figsize
+        self.dpi = dpi
+        self.canvases = {} # cached figure for each key of get_canvas()
+
+    def get_canvas(self, freqs:list, subtitle:str=None)->dict:
+        """Gets the cached figure and creates it on first use.
+
+        Args:
+            freqs (list of int): A list of frequencies in Hz.
+            subtitle (str, optional): A subtitle for the audiogram. Defaults to None.
+
+        Returns:
+            dict: 'fig', 'ax', 'title', 'band_texts', 'xlim' (limits of the empty axes), 'data' (artists of the last audiogram)
+                and 'bboxes' (tight bounding box for each layout)
+        """
+        key = (tuple(freqs), subtitle, matplotlib.rcParams['figure.dpi'] if self.dpi is None else self.dpi)
+        if key not in self.canvases:
+            fig = Figure(figsize=self.figsize, dpi=key[2])
+            FigureCanvasAgg(fig)
+            ax = fig.subplots()
+            xlim = ax.get_xlim() # limits of an empty axes, used if an audiogram has no values
+            band_texts = draw_background(ax)
+            title = draw_axes(fig, ax, freqs, subtitle)
+            self.canvases[key] = {'fig': fig, 'ax': ax, 'title': title, 'band_texts': band_texts, 'xlim': xlim, 'data': [], 'bboxes': {}}
+        return self.canvases[key]
+
+    def render(self, audiogram:Audiogram, binaural:bool=False, name:str="audiogram.png", freq_levels:dict=freq_levels, subtitle:str=None):
+        """Renders an audiogram and saves it.
+
+        Args:
+            audiogram (Audiogram): levels of both ears
+            binaural (bool, optional): Whether the audiogram is made from binaural test values. Defaults to False.
+            name (str, optional): The name of the saved audiogram file. Defaults to "audiogram.png".
+            freq_levels (dict, optional): A dictionary mapping frequencies to their target values. Defaults to freq_levels.
+            subtitle (str, optional): A subtitle for the audiogram. Defaults to None.
+        """
+        freqs = audiogram.freqs.tolist()
+        canvas = self.get_canvas(freqs, subtitle)
+        ax = canvas['ax']
+        for artist in canvas['data']:
+            artist.remove()
+
+        nan_t = draw_values(ax, audiogram, binaural, freq_levels)
+        canvas['data'] = list(ax.lines) + ([nan_t] if nan_t else [])
+
+        # same x-limits as a new figure: data with margins, widened to the ticks
+        ax.set_xlim(canvas['xlim'])
+        ax.set_autoscalex_on(True)
+        ax.relim()
+        ax.autoscale_view(scaley=False)
+        ax.xaxis.set_view_interval(0, len(freqs) - 1)
+
+        lgd = draw_legend(ax)
+        extra_artists = (canvas['title'], lgd) + canvas['band_texts'] + ((nan_t,) if nan_t else ())
+
+        # the tight bounding box only depends on the x-limits, the legend entries and the note,
+        # so it is computed once per layout instead of by an extra draw on every save
+        layout = (ax.get_xlim(), tuple(line.get_label() for line in ax.lines), nan_t.get_text() if nan_t else None)
+        if layout not in canvas['bboxes']:
+            fig = canvas['fig']
+            fig.draw_without_rendering()
+            pad = matplotlib.rcParams['savefig.pad_inches']
+            canvas['bboxes'][layout] = fig.get_tightbbox(fig.canvas.get_renderer(), bbox_extra_artists=extra_artists).padded(pad, pad)
+        canvas['fig'].savefig(name, bbox_inches=canvas['bboxes'][layout])
 
+    def close(self):
+        """Releases all cached figures.
+        """
+        self.canvases = {}
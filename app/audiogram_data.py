@@ -0,0 +1,197 @@
+"""Typed data model for the thresholds of both ears, shared by the procedures, the export, the plots and the analytics."""
+import csv
+import numpy as np
+
+
+HEARD = 0 # status of a level in an Audiogram
+NOT_HEARD = 1 # 'NH': no response at the highest level
+MISSING = 2 # 'NaN': no threshold was found
+
+def parse_value(value)->tuple:
+    """Converts a value of the results into a level and a status.
+
+    Args:
+        value (int or str): level in dB HL, 'NH', 'NaN', '' or None
+
+    Returns:
+        tuple: (level, status), the level in dB HL is NaN unless the status is HEARD
+
+    Raises:
+        ValueError: the value is no level, 'NH', 'NaN' or empty
+    """
+    if value is None or value in ("", "NaN"):
+        return np.nan, MISSING
+    if value == 'NH':
+        return np.nan, NOT_HEARD
+    level = float(value)
+    if np.isnan(level):
+        return np.nan, MISSING
+    return level, HEARD
+
+
+class Audiogram:
+
+    sides = ['l', 'r']
+
+    def __init__(self, freqs:list, levels:np.ndarray=None, status:np.ndarray=None):
+        """Thresholds of both ears in fixed-size arrays: levels in dB HL as int16
+        and a uint8 status (HEARD, NOT_HEARD or MISSING) per ear and frequency.
+        The model, the export and the plots use it instead of lists of numbers, 'NH', 'NaN' and None.
+
+        Args:
+            freqs (list of int): frequencies in Hz
+            levels (np.ndarray, optional): levels with the shape ear x frequency, ears in the order of Audiogram.sides.
+                Zeros if None. Defaults to None.
+            status (np.ndarray, optional): status with the same shape. MISSING if None. Defaults to None.
+        """
+        self.freqs = np.array(freqs, dtype=np.int32)
+        shape = (len(self.sides), len(self.freqs))
+        self.levels = np.zeros(shape, dtype=np.int16) if levels is None else np.array(levels, dtype=np.int16).reshape(shape)
+        self.status = np.full(shape, MISSING, dtype=np.uint8) if status is None else np.array(status, dtype=np.uint8).reshape(shape)
+
+    @classmethod
+    def from_values(cls, freqs:list, left_values:list, right_values:list)->'Audiogram':
+        """Creates an audiogram from values as they appear in the CSV file.
+
+        Args:
+            freqs (list of int): frequencies in Hz
+            left_values (list): levels in dB HL, 'NH', 'NaN' or None for each frequency of the left ear
+            right_values (list): same for the right ear
+
+        Returns:
+            Audiogram: the parsed values
+
+        Raises:
+            ValueError: a value is no level, 'NH', 'NaN' or empty
+        """
+        audiogram = cls(freqs)
+        for i, values in enumerate([left_values, right_values]):
+            for j, value in enumerate(values):
+                audiogram.set(i, j, value)
+        return audiogram
+
+    @classmethod
+    def from_rows(cls, rows:list, freq_bands:list)->'Audiogram':
+        """Creates an audiogram from the first two rows of the CSV layout.
+
+        Args:
+            rows (list of dict): rows of the left and the right ear with the frequency bands as keys
+            freq_bands (list of str): frequency bands in Hz
+
+        Returns:
+            Audiogram: the parsed values
+        """
+        return cls.from_values([int(f) for f in freq_bands], [rows[0][f] for f in freq_bands], [rows[1][f] for f in freq_bands])
+
+    @classmethod
+    def read_csv(cls, filename:str)->'Audiogram':
+        """Reads the levels of both ears from a CSV file of the results.
+
+        Args:
+            filename (str): name of the CSV file
+
+        Returns:
+            Audiogram: the parsed values
+
+        Raises:
+            ValueError: the file has no rows for both ears or a value is no level, 'NH', 'NaN' or empty
+        """
+        with open(filename, mode='r', newline='') as csv_file:
+            reader = csv.DictReader(csv_file)
+            rows = [row for row, _ in zip(reader, range(2))]
+        if len(rows) < 2:
+            raise ValueError(f"{filename} has no rows for both ears")
+        return cls.from_rows(rows, reader.fieldnames)
+
+    def set(self, i:int, j:int, value):
+        """Sets a value.
+
+        Args:
+            i (int): index of the ear in Audiogram.sides
+            j (int): index of the frequency
+            value (int or str): level in dB HL, 'NH', 'NaN' or None
+
+        Raises:
+            ValueError: the value is no level, 'NH', 'NaN' or empty
+        """
+        level, status = parse_value(value)
+        self.levels[i, j] = round(level) if status == HEARD else 0
+        self.status[i, j] = status
+
+    def set_value(self, value, frequency:int, side:str):
+        """Sets the level at a specific frequency.
+
+        Args:
+            value (int or str): level in dB HL, 'NH', 'NaN' or None
+            frequency (int): frequency in Hz
+            side (str): 'l', 'r' or 'lr' for both
+        """
+        j = int(np.flatnonzero(self.freqs == int(frequency))[0])
+        for s in (self.sides if side == 'lr' else [side]):
+            self.set(self.sides.index(s), j, value)
+
+    def heard(self)->np.ndarray:
+        """Gets a mask of the values where a level was found.
+
+        Returns:
+            np.ndarray: boolean mask with the shape ear x frequency
+        """
+        return self.status == HEARD
+
+    def not_heard(self)->np.ndarray:
+        """Gets a mask of the values where the tone was not heard ('NH').
+
+        Returns:
+            np.ndarray: boolean mask with the shape ear x frequency
+        """
+        return self.status == NOT_HEARD
+
+    def missing(self)->np.ndarray:
+        """Gets a mask of the values where no threshold was found ('NaN').
+
+        Returns:
+            np.ndarray: boolean mask with the shape ear x frequency
+        """
+        return self.status == MISSING
+
+    def get_values(self, side:str='l')->list:
+        """Gets the values of one ear as they appear in the CSV file.
+
+        Args:
+            side (str, optional): 'l' or 'r'. Defaults to 'l'.
+
+        Returns:
+            list of str: level in dB HL, 'NH' or 'NaN' for each frequency
+        """
+        i = self.sides.index(side)
+        names = {NOT_HEARD: 'NH', MISSING: 'NaN'}
+        return [names.get(status, str(level)) for level, status in zip(self.levels[i].tolist(), self.status[i].tolist())]
+
+    def get_rows(self)->list:
+        """Gets the levels in the layout of the CSV file.
+
+        Returns:
+            list of dict: rows of the left and the right ear with the frequency bands as keys
+        """
+        freq_bands = [str(f) for f in self.freqs.tolist()]
+        return [dict(zip(freq_bands, self.get_values(side))) for side in self.sides]
+
+    def write_csv(self, filename:str, metadata:dict=None, mode:str='x'):
+        """Writes the levels into a CSV file in the layout of SessionResults.write_csv().
+
+        Args:
+            filename (str): name of the CSV file
+            metadata (dict, optional): key/value pairs in the lines after the ears. Defaults to None.
+            mode (str, optional): 'x' to create a new file or 'w' to overwrite an existing one. Defaults to 'x'.
+        """
+        freq_bands = [str(f) for f in self.freqs.tolist()]
+        rows = self.get_rows()
+        for key, value in (metadata or {}).items():
+            row = {f: None for f in freq_bands}
+            row[freq_bands[0]] = key
+            row[freq_bands[1]] = value
+            rows.append(row)
+        with open(filename, mode=mode, newline='') as final_file:
+            dict_writer = csv.DictWriter(final_file, fieldnames=freq_bands)
+            dict_writer.writeheader()
+            dict_writer.writerows(rows)
@@ -0,0 +1,82 @@
+import time
+
+
+class RealClock:
+
+    def __init__(self):
+        """Clock for sessions with a person. Waits take place in real time.
+        """
+
+    def now(self)->float:
+        """Gets the current time.
+
+        Returns:
+            float: time in seconds from time.monotonic()
+        """
+        return time.monotonic()
+
+    def sleep(self, seconds:float):
+        """Waits for the given time.
+
+        Args:
+            seconds (float): waiting time in seconds
+        """
+        time.sleep(seconds)
+
+    def wait_for_response(self, responder, timeout:float)->bool:
+        """Waits until the subject responds or the timeout expires.
+
+        Args:
+            responder (KeyboardResponder): detects the responses of the subject
+            timeout (float): maximum waiting time in seconds
+
+        Returns:
+            bool: True if the tone was heard
+        """
+        return responder.wait(timeout)
+
+
+class VirtualClock(RealClock):
+
+    def __init__(self, start:float=0.0):
+        """Clock for simulated sessions. Waits return immediately and only advance the time of the clock,
+        so now() reports the time a real session would have taken.
+
+        Args:
+            start (float, optional): start time in seconds. Defaults to 0.0.
+        """
+        self.time = start
+
+    def now(self)->float:
+        """Gets the current virtual time.
+
+        Returns:
+            float: time in seconds
+        """
+        return self.time
+
+    def sleep(self, seconds:float):
+        """Advances the time without waiting.
+
+        Args:
+            seconds (float): waiting time in seconds
+        """
+        self.time += max(seconds, 0)
+
+    def wait_for_response(self, responder, timeout:float)->bool:
+        """Gets the response without waiting. The time advances by the reaction time of the
+        responder (attribute reaction_time, 0 if missing) if the tone was heard, otherwise by the timeout.
+
+        Args:
+            responder (SimulatedSubject): answers the presentations
+            timeout (float): maximum waiting time in seconds
+
+        Returns:
+            bool: True if the tone was heard
+        """
+        heard = responder.wait(timeout)
+        self.sleep(min(getattr(responder, 'reaction_time', 0), timeout) if heard else timeout)
+        return heard
+
+
+real_clock = RealClock()
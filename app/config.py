@@ -32,4 +32,7 @@ NOT_HEARD_RIGHT_MARKER = '4'
 LABEL_FONT_SIZE = 12
 LEGEND_FONT_SIZE = 12
 TICK_FONT_SIZE = 10
-TEXT_FONT_SIZE = 9
\ No newline at end of file
+TEXT_FONT_SIZE = 9
+# Session store settings
+SESSION_STORE = False # additionally store every session in an SQLite database in the save path
+SESSION_STORE_FILENAME = "sessions.sqlite"
@@ -0,0 +1,181 @@
+"""Monte-Carlo evaluation of the threshold procedures with simulated subjects.
+
+Run from the repository root:
+    python -m app.evaluation --sessions 1000 --workers 4
+"""
+import os
+import csv
+import argparse
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from .simulation import SimulatedSubject, run_session
+
+
+frequencies = [125, 250, 500, 1000, 2000, 4000, 8000]
+sides = ['l', 'r']
+programs = ["standard", "interleaved", "bayesian"] # procedures that measure thresholds
+
+def draw_thresholds(rng:np.random.Generator, population:dict)->dict:
+    """Draws the true thresholds of one subject.
+
+    Args:
+        rng (np.random.Generator): random generator of the worker
+        population (dict): 'threshold_mean' and 'threshold_sd' in dB HL, 'threshold_min' and 'threshold_max' for clipping
+
+    Returns:
+        dict of str:dict : thresholds in dB HL for the sides 'l' and 'r'
+    """
+    values = rng.normal(population['threshold_mean'], population['threshold_sd'], size=(len(sides), len(frequencies)))
+    values = np.clip(values, population['threshold_min'], population['threshold_max'])
+    return {side: dict(zip(frequencies, values[i].tolist())) for i, side in enumerate(sides)}
+
+def run_batch(program:str, num_sessions:int, seed:int, population:dict)->dict:
+    """Runs a batch of simulated sessions in one worker process.
+
+    Args:
+        program (str): procedure to be evaluated
+        num_sessions (int): number of sessions
+        seed (int): seed of the worker
+        population (dict): parameters of the simulated subjects, see evaluate()
+
+    Returns:
+        dict of str:np.array : 'error', 'presentations' and 'failed' with the shape session x side x frequency
+            and 'minutes' with one value per session
+    """
+    rng = np.random.default_rng(seed)
+    shape = (num_sessions, len(sides), len(frequencies))
+    batch = {'error': np.full(shape, np.nan),
+             'presentations': np.zeros(shape, dtype=np.int32),
+             'failed': np.ones(shape, dtype=bool),
+             'minutes': np.zeros(num_sessions)}
+
+    for n in range(num_sessions):
+        thresholds = draw_thresholds(rng, population)
+        subject = SimulatedSubject(thresholds, slope=population['slope'], false_alarm_rate=population['false_alarm_rate'],
+                                   lapse_rate=population['lapse_rate'], seed=int(rng.integers(2**32)))
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull): # procedures print every tone
+            session = run_session(subject, program=program)
+
+        for frequency, level, side, heard in subject.presentations:
+            if side in sides:
+                batch['presentations'][n, sides.index(side), frequencies.index(frequency)] += 1
+        if session['familiarization']:
+            audiogram = session['audiogram']
+            columns = [audiogram.freqs.tolist().index(frequency) for frequency in frequencies]
+            rows = [audiogram.sides.index(side) for side in sides]
+            heard = audiogram.heard()[np.ix_(rows, columns)]
+            true_thresholds = np.array([[thresholds[side][frequency] for frequency in frequencies] for side in sides])
+            batch['error'][n][heard] = (audiogram.levels[np.ix_(rows, columns)] - true_thresholds)[heard]
+            batch['failed'][n] = ~heard
+        batch['minutes'][n] = session['duration'] / 60
+    return batch
+
+def evaluate(program:str="standard", num_sessions:int=1000, workers:int=None, seed:int=0, threshold_mean:float=20, threshold_sd:float=15,
+             threshold_min:float=-10, threshold_max:float=90, slope:float=0.5, false_alarm_rate:float=0.02, lapse_rate:float=0.02)->dict:
+    """Runs simulated sessions on a process pool and collects the results.
+    Every worker gets its own seed from the given seed, so the same arguments give the same results.
+
+    Args:
+        program (str, optional): procedure to be evaluated. Defaults to "standard".
+        num_sessions (int, optional): number of sessions. Defaults to 1000.
+        workers (int, optional): number of worker processes. Number of CPUs if None. Defaults to None.
+        seed (int, optional): seed of the evaluation. Defaults to 0.
+        threshold_mean (float, optional): mean of the true thresholds in dB HL. Defaults to 20.
+        threshold_sd (float, optional): standard deviation of the true thresholds in dB. Defaults to 15.
+        threshold_min (float, optional): lowest true threshold in dB HL. Defaults to -10.
+        threshold_max (float, optional): highest true threshold in dB HL. Defaults to 90.
+        slope (float, optional): slope of the psychometric function in 1/dB. Defaults to 0.5.
+        false_alarm_rate (float, optional): probability of a response to an inaudible tone. Defaults to 0.02.
+        lapse_rate (float, optional): probability of missing a clearly audible tone. Defaults to 0.02.
+
+    Returns:
+        dict of str:np.array : see run_batch(), with the sessions of all workers
+    """
+    if program not in programs:
+        raise ValueError(f"Unknown program '{program}', choose from {programs}.")
+    population = {'threshold_mean': threshold_mean, 'threshold_sd': threshold_sd, 'threshold_min': threshold_min,
+                  'threshold_max': threshold_max, 'slope': slope, 'false_alarm_rate': false_alarm_rate, 'lapse_rate': lapse_rate}
+    workers = workers or os.cpu_count() or 1
+    workers = max(1, min(workers, num_sessions))
+    sizes = [num_sessions // workers + (1 if i < num_sessions % workers else 0) for i in range(workers)]
+    seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(workers)]
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        batches = list(executor.map(run_batch, [program] * workers, sizes, seeds, [population] * workers))
+
+    return {key: np.concatenate([batch[key] for batch in batches]) for key in batches[0]}
+
+def summarize(program:str, evaluation:dict)->list:
+    """Summarizes the evaluation for each frequency.
+
+    Args:
+        program (str): evaluated procedure
+        evaluation (dict): result of evaluate()
+
+    Returns:
+        list of dict: one row per frequency with bias, standard deviation and mean absolute error in dB,
+            presentations, failure rate, and one row 'all' with the simulated minutes per session
+    """
+    rows = []
+    for j, frequency in enumerate(frequencies):
+        error = evaluation['error'][:, :, j]
+        valid = error[~np.isnan(error)]
+        rows.append({'program': program,
+                     'frequency': frequency,
+                     'bias_db': round(float(valid.mean()), 2) if len(valid) else np.nan,
+                     'sd_db': round(float(valid.std()), 2) if len(valid) else np.nan,
+                     'mae_db': round(float(np.abs(valid).mean()), 2) if len(valid) else np.nan,
+                     'presentations': round(float(evaluation['presentations'][:, :, j].mean()), 2),
+                     'failure_rate': round(float(evaluation['failed'][:, :, j].mean()), 4),
+                     'minutes': ''})
+    rows.append({'program': program, 'frequency': 'all',
+                 'bias_db': round(float(np.nanmean(evaluation['error'])), 2),
+                 'sd_db': round(float(np.nanstd(evaluation['error'])), 2),
+                 'mae_db': round(float(np.nanmean(np.abs(evaluation['error']))), 2),
+                 'presentations': round(float(evaluation['presentations'].sum(axis=(1, 2)).mean()), 2),
+                 'failure_rate': round(float(evaluation['failed'].mean()), 4),
+                 'minutes': round(float(evaluation['minutes'].mean()), 2)})
+    return rows
+
+def write_summary(rows:list, filename:str):
+    """Writes the summary table into a CSV file.
+
+    Args:
+        rows (list of dict): rows from summarize()
+        filename (str): name of the CSV file
+    """
+    with open(filename, mode='w', newline='') as file:
+        dict_writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        dict_writer.writeheader()
+        dict_writer.writerows(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--programs', nargs='+', default=programs, choices=programs, help='procedures to be evaluated')
+    parser.add_argument('--sessions', type=int, default=1000, help='number of sessions per procedure (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the evaluation (default: %(default)s)')
+    parser.add_argument('--slope', type=float, default=0.5, help='slope of the psychometric function in 1/dB (default: %(default)s)')
+    parser.add_argument('--false-alarm-rate', type=float, default=0.02, help='(default: %(default)s)')
+    parser.add_argument('--lapse-rate', type=float, default=0.02, help='(default: %(default)s)')
+    parser.add_argument('--output', default='evaluation_summary.csv', help='CSV file for the summary table (default: %(default)s)')
+    args = parser.parse_args()
+
+    rows = []
+    for program in args.programs:
+        evaluation = evaluate(program, args.sessions, args.workers, args.seed, slope=args.slope,
+                              false_alarm_rate=args.false_alarm_rate, lapse_rate=args.lapse_rate)
+        rows.extend(summarize(program, evaluation))
+
+    print(f"{'program':>11} {'freq':>5} {'bias':>6} {'sd':>6} {'mae':>6} {'pres.':>7} {'failed':>7} {'min':>6}")
+    for row in rows:
+        print(f"{row['program']:>11} {row['frequency']:>5} {row['bias_db']:>6} {row['sd_db']:>6} {row['mae_db']:>6} "
+              f"{row['presentations']:>7} {row['failure_rate']:>7} {row['minutes']:>6}")
+    write_summary(rows, args.output)
+    print("Datei gespeichert als " + args.output)
+
+
+if __name__ == "__main__":
+    main()
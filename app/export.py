@@ -0,0 +1,102 @@
+import csv
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from .audiogram import AudiogramRenderer
+
+
+renderers = threading.local() # one renderer with cached figures per worker thread or process
+
+def get_renderer()->AudiogramRenderer:
+    """Gets the audiogram renderer of the current worker.
+
+    Returns:
+        AudiogramRenderer: renderer of this thread
+    """
+    if not hasattr(renderers, 'renderer'):
+        renderers.renderer = AudiogramRenderer()
+    return renderers.renderer
+
+def export_session(job:dict)->dict:
+    """Writes the final CSV file and renders the audiogram of one session. Runs in a worker process,
+    which keeps its figure for the next sessions.
+
+    Args:
+        job (dict): 'csv_filename', 'freq_bands' and 'rows' for the CSV file, 'audiogram_filename', 'audiogram',
+            'binaural' and 'freq_levels' for the audiogram
+
+    Returns:
+        dict: the job with the written files
+    """
+    with open(job['csv_filename'], mode='x', newline='') as final_file:
+        dict_writer = csv.DictWriter(final_file, fieldnames=job['freq_bands'])
+        dict_writer.writeheader()
+        dict_writer.writerows(job['rows'])
+
+    get_renderer().render(job['audiogram'], binaural=job['binaural'], name=job['audiogram_filename'], freq_levels=job['freq_levels'])
+    return job
+
+
+class ExportWorker:
+
+    def __init__(self, max_workers:int=2, use_processes:bool=True):
+        """Exports finished sessions in the background, so rendering the audiogram neither blocks
+        the procedure nor holds the GIL next to the user interface.
+        Jobs wait in the queue of the executor, up to max_workers sessions are exported at the same time.
+
+        Args:
+            max_workers (int, optional): number of sessions exported at the same time. Defaults to 2.
+            use_processes (bool, optional): Export in worker processes. Threads are used if False
+                or if no process can be started. Defaults to True.
+        """
+        self.max_workers = max_workers
+        self.use_processes = use_processes
+        self.lock = threading.Lock()
+        self.executor = None # created on first use
+
+    def get_executor(self):
+        """Gets the executor and creates it on first use.
+
+        Returns:
+            concurrent.futures.Executor: process or thread pool
+        """
+        with self.lock:
+            if self.executor is None:
+                if self.use_processes:
+                    try:
+                        self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+                    except (OSError, NotImplementedError) as e:
+                        print(f"Export in threads, no worker process available: {e}")
+                        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+                else:
+                    self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            return self.executor
+
+    def submit(self, job:dict, callback:callable=None)->Future:
+        """Adds a session to the export queue.
+
+        Args:
+            job (dict): see export_session()
+            callback (callable, optional): called with the future when the export is done. Defaults to None.
+
+        Returns:
+            Future: result is the job with the written files, or the exception of the export
+        """
+        future = self.get_executor().submit(export_session, job)
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
+
+    def shutdown(self, wait:bool=True):
+        """Finishes all queued exports and stops the workers.
+
+        Args:
+            wait (bool, optional): wait until all exports are done. Defaults to True.
+        """
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=wait)
+                self.executor = None
+
+
+export_worker = ExportWorker()
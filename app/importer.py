@@ -0,0 +1,166 @@
+"""Imports existing result folders into the session database.
+
+The CSV files are parsed in a process pool and stored in batched transactions.
+Files whose path, modification time and size have already been imported are skipped.
+
+Run from the repository root:
+    python -m app.importer results --workers 4
+"""
+import os
+import csv
+import time
+import argparse
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from .config import SESSION_STORE_FILENAME
+from .audiogram_data import Audiogram
+from .session_store import SessionStore
+
+
+freq_bands = ['125', '250', '500', '1000', '2000', '4000', '8000']
+
+def find_result_files(save_path:str)->list:
+    """Finds all final CSV files in the save path and its subfolders.
+
+    Args:
+        save_path (str): folder of the results
+
+    Returns:
+        list of tuple: (path, mtime_ns, size) for each file
+    """
+    files = []
+    folders = [save_path]
+    while folders:
+        with os.scandir(folders.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                elif "_audiogramm_" in entry.name and entry.name.endswith(".csv"):
+                    stat = entry.stat()
+                    files.append((os.path.abspath(entry.path), stat.st_mtime_ns, stat.st_size))
+    return sorted(files)
+
+def get_binaural(audiogram:Audiogram, metadata:dict)->bool:
+    """Infers from a CSV file whether both ears were tested at the same time. The CSV files of the app do not
+    store it, but a binaural test writes the same values for both ears, so different values prove a monaural test.
+
+    Args:
+        audiogram (Audiogram): values of the file
+        metadata (dict): metadata rows of the file, 'binaural' is removed if it is there
+
+    Returns:
+        bool: True if binaural, False if monaural, None if unknown
+    """
+    value = (metadata.pop('binaural', None) or "").strip().lower()
+    if value in ("1", "true", "ja", "yes"):
+        return True
+    if value in ("0", "false", "nein", "no"):
+        return False
+    if audiogram.get_values('l') != audiogram.get_values('r'):
+        return False
+    return None
+
+def parse_result_file(file:tuple)->dict:
+    """Parses a final CSV file. Runs in a worker process.
+
+    Args:
+        file (tuple): (path, mtime_ns, size) of the file
+
+    Returns:
+        dict: keyword arguments of SessionStore.add_session() and 'file',
+            or 'file' and 'error' if the file is malformed
+    """
+    path = file[0]
+    name = os.path.basename(path)
+    try:
+        with open(path, newline='') as csv_file:
+            reader = csv.DictReader(csv_file)
+            if reader.fieldnames is None or any(f not in reader.fieldnames for f in freq_bands):
+                raise ValueError("header without frequency bands")
+            rows = list(reader)
+        if len(rows) < 2:
+            raise ValueError("no rows for both ears")
+
+        audiogram = Audiogram.from_rows(rows, freq_bands)
+        thresholds = {side: dict(zip(audiogram.freqs.tolist(), audiogram.get_values(side))) for side in audiogram.sides}
+        metadata = {row[freq_bands[0]]: row[freq_bands[1]] for row in rows[2:] if row[freq_bands[0]]}
+        binaural = get_binaural(audiogram, metadata)
+        program = metadata.pop('program', None) or None
+
+        subject_id, date_str = name[:-len(".csv")].split("_audiogramm_", 1)
+        subject_id = metadata.get("id") or subject_id
+        date = datetime.strptime(date_str, "%Y%m%d_%H%M%S")
+    except (OSError, UnicodeDecodeError, csv.Error, KeyError, ValueError, OverflowError) as e:
+        return {'file': file, 'error': f"{type(e).__name__}: {e}"}
+
+    audiogram_filename = os.path.join(os.path.dirname(path), f"{subject_id}_audiogram_{date_str}.png")
+    return {'file': file,
+            'subject_id': subject_id,
+            'date': date.strftime("%Y-%m-%d %H:%M:%S"),
+            'thresholds': thresholds,
+            'metadata': metadata,
+            'program': program,
+            'binaural': binaural,
+            'csv_filename': path,
+            'audiogram_filename': audiogram_filename if os.path.exists(audiogram_filename) else None}
+
+def import_results(save_path:str, database:str=None, workers:int=None, batch_size:int=500)->dict:
+    """Imports all new or changed CSV files of a save path into the session database.
+
+    Args:
+        save_path (str): folder of the results
+        database (str, optional): name of the database file. SESSION_STORE_FILENAME in the save path if None. Defaults to None.
+        workers (int, optional): number of worker processes. Number of CPUs if None. Defaults to None.
+        batch_size (int, optional): number of sessions per transaction. Defaults to 500.
+
+    Returns:
+        dict: 'imported' and 'skipped' (number of files) and 'malformed' (list of (path, error))
+    """
+    store = SessionStore(database or os.path.join(save_path, SESSION_STORE_FILENAME))
+    try:
+        imported_files = store.get_imported_files()
+        files = find_result_files(save_path)
+        new_files = [f for f in files if imported_files.get(f[0]) != f[1:]]
+        report = {'imported': 0, 'skipped': len(files) - len(new_files), 'malformed': []}
+        if not new_files:
+            return report
+
+        workers = max(1, min(workers or os.cpu_count() or 1, len(new_files)))
+        chunksize = max(1, min(64, len(new_files) // (workers * 4)))
+        batch = []
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            for session in executor.map(parse_result_file, new_files, chunksize=chunksize):
+                if 'error' in session:
+                    report['malformed'].append((session['file'][0], session['error']))
+                    continue
+                batch.append(session)
+                if len(batch) >= batch_size:
+                    store.import_sessions(batch)
+                    report['imported'] += len(batch)
+                    batch = []
+        if batch:
+            store.import_sessions(batch)
+            report['imported'] += len(batch)
+        return report
+    finally:
+        store.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('save_path', help='folder of the results')
+    parser.add_argument('--database', default=None, help=f'database file (default: {SESSION_STORE_FILENAME} in the save path)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--batch-size', type=int, default=500, help='number of sessions per transaction (default: %(default)s)')
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    report = import_results(args.save_path, args.database, args.workers, args.batch_size)
+    for path, error in report['malformed']:
+        print(f"Fehlerhafte Datei {path}: {error}")
+    print(f"{report['imported']} Sitzungen importiert, {report['skipped']} unverändert übersprungen, "
+          f"{len(report['malformed'])} fehlerhaft ({time.monotonic() - start:.1f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import numpy as np
+
+
+class LevelTable:
+
+    sides = ('l', 'r', 'lr')
+
+    def __init__(self, retspl:dict, calibration:dict=None, zero_dbhl:float=0.000005, min_level:int=-10, max_level:int=120):
+        """Precomputes the amplitude of every level in 1 dB steps for each side and frequency,
+        so converting a level during a procedure is a single array lookup.
+
+        Args:
+            retspl (dict of int:float): RETSPL values for each frequency band
+            calibration (dict, optional): calibration values for the sides 'l' and 'r', each a dict of int:float.
+                No calibration is applied if None. Defaults to None.
+            zero_dbhl (float, optional): amplitude of 0 dB SPL in absolute numbers. Defaults to 0.000005.
+            min_level (int, optional): lowest level in the table in dB HL. Defaults to -10.
+            max_level (int, optional): highest level in the table in dB HL. Defaults to 120.
+        """
+        self.frequencies = sorted(retspl)
+        self.freq_index = {f: i for i, f in enumerate(self.frequencies)}
+        self.side_index = {s: i for i, s in enumerate(self.sides)}
+        self.zero_dbhl = zero_dbhl
+        self.min_level = min_level
+        self.max_level = max_level
+        self.levels = np.arange(min_level, max_level + 1, dtype=np.float64)
+
+        # offset from dB HL to dB re zero_dbhl for each side and frequency
+        retspl_values = np.array([retspl[f] for f in self.frequencies], dtype=np.float64)
+        if calibration:
+            cal_l = np.array([calibration['l'][f] for f in self.frequencies], dtype=np.float64)
+            cal_r = np.array([calibration['r'][f] for f in self.frequencies], dtype=np.float64)
+            cal_lr = 10 * np.log10((10 ** (cal_l / 10) + 10 ** (cal_r / 10)) / 2) # average if both sides are used
+        else:
+            cal_l = cal_r = cal_lr = np.zeros(len(self.frequencies))
+        self.offsets = retspl_values - np.array([cal_l, cal_r, cal_lr])
+
+        # shape: side x frequency x level
+        self.table = self.compute(self.levels[np.newaxis, np.newaxis, :], self.offsets[:, :, np.newaxis])
+        self.clipping = self.table > 1.0 # levels that would clip above full scale
+        self.table.flags.writeable = False
+        self.clipping.flags.writeable = False
+
+    def compute(self, levels:np.array, offsets:np.array)->np.array:
+        """Calculates dB HL into absolute numbers.
+
+        Args:
+            levels (np.array): levels in dB HL
+            offsets (np.array): RETSPL minus calibration value in dB
+
+        Returns:
+            np.array: values in absolute numbers
+        """
+        return self.zero_dbhl * 10 ** ((levels + offsets) / 20)
+
+    def in_table(self, levels:np.array)->bool:
+        """Checks if all levels are whole numbers within the table.
+
+        Args:
+            levels (np.array): levels in dB HL
+
+        Returns:
+            bool: all levels can be looked up
+        """
+        return bool(np.all((levels >= self.min_level) & (levels <= self.max_level) & (levels == np.floor(levels))))
+
+    def volume(self, dbhl:float, frequency:int, side:str='l')->float:
+        """Gets the amplitude of one level.
+
+        Args:
+            dbhl (float): value in dB HL
+            frequency (int): frequency in Hz
+            side (str, optional): 'l', 'r' or 'lr'. Defaults to 'l'.
+
+        Returns:
+            float: value in absolute numbers
+        """
+        s = self.side_index[side]
+        f = self.freq_index[frequency]
+        if self.min_level <= dbhl <= self.max_level and dbhl == int(dbhl):
+            return float(self.table[s, f, int(dbhl) - self.min_level])
+        return float(self.compute(dbhl, self.offsets[s, f])) # levels between or outside the steps of the table
+
+    def volumes(self, levels, frequency:int, side:str='l')->np.array:
+        """Gets the amplitudes of a whole sequence of levels at once.
+
+        Args:
+            levels (array_like): values in dB HL
+            frequency (int): frequency in Hz
+            side (str, optional): 'l', 'r' or 'lr'. Defaults to 'l'.
+
+        Returns:
+            np.array: values in absolute numbers
+        """
+        levels = np.asarray(levels, dtype=np.float64)
+        s = self.side_index[side]
+        f = self.freq_index[frequency]
+        if self.in_table(levels):
+            return self.table[s, f, levels.astype(np.intp) - self.min_level]
+        return self.compute(levels, self.offsets[s, f])
+
+    def clips(self, levels, frequency:int, side:str='l')->np.array:
+        """Checks which levels would clip above full scale before they are played.
+
+        Args:
+            levels (array_like): values in dB HL
+            frequency (int): frequency in Hz
+            side (str, optional): 'l', 'r' or 'lr'. Defaults to 'l'.
+
+        Returns:
+            np.array of bool: True for every level that would clip
+        """
+        return self.volumes(levels, frequency, side) > 1.0
+
+    def get_max_level(self, frequency:int, side:str='l')->int:
+        """Gets the highest level in the table that can be played without clipping.
+
+        Args:
+            frequency (int): frequency in Hz
+            side (str, optional): 'l', 'r' or 'lr'. Defaults to 'l'.
+
+        Returns:
+            int: level in dB HL, None if even the lowest level clips
+        """
+        playable = np.flatnonzero(~self.clipping[self.side_index[side], self.freq_index[frequency]])
+        if len(playable) == 0:
+            return None
+        return int(self.levels[playable[-1]])
+
+    def get_clipping_report(self)->dict:
+        """Gets the highest playable level of every side and frequency that clips within the table.
+
+        Returns:
+            dict of (str, int):int : highest level in dB HL without clipping for each (side, frequency)
+        """
+        report = {}
+        for s in self.sides:
+            for f in self.frequencies:
+                if self.clipping[self.side_index[s], self.freq_index[f], -1]:
+                    report[(s, f)] = self.get_max_level(f, s)
+        return report
+
+
+level_tables = {} # tables of this session, shared by all procedures with the same reference values
+
+def get_level_table(retspl:dict, calibration:dict=None, zero_dbhl:float=0.000005)->LevelTable:
+    """Gets the level table for the given reference values and builds it on first use.
+
+    Args:
+        retspl (dict of int:float): RETSPL values for each frequency band
+        calibration (dict, optional): calibration values for the sides 'l' and 'r'. Defaults to None.
+        zero_dbhl (float, optional): amplitude of 0 dB SPL in absolute numbers. Defaults to 0.000005.
+
+    Returns:
+        LevelTable: level table
+    """
+    key = (tuple(sorted(retspl.items())), zero_dbhl,
+           tuple((s, tuple(sorted(calibration[s].items()))) for s in ('l', 'r')) if calibration else None)
+    if key not in level_tables:
+        table = LevelTable(retspl, calibration, zero_dbhl)
+        report = table.get_clipping_report()
+        if report:
+            print(f"Levels above these values would clip: {report}")
+        level_tables[key] = table
+    return level_tables[key]
@@ -1,15 +1,23 @@
 from .ui import setup_ui
 from .model import *
+from .audio_backends import AudioBackend
+from .export import export_worker
 
 
 class Controller():
 
-    def __init__(self):
+    def __init__(self, audio_backend:AudioBackend=None):
         """Controller class (MVC architecture) that combines model and view of the Audiometer.
+
+        Args:
+            audio_backend (AudioBackend, optional): output for all procedures, e.g. a MemoryBackend for runs without sound card.
+                The shared player of the selected sound device is used if None. Defaults to None.
         """
         self.selected_program = ""
         program_functions = {"Klassisches Audiogramm" : self.start_standard_procedure,
                              "Kurzes Screening" : self.start_screen_procedure,
+                             "Gemischtes Audiogramm" : self.start_interleaved_procedure,
+                             "Adaptives Audiogramm" : self.start_bayesian_procedure,
                              "Kalibrierung" : self.start_calibration}
         
         self.calibration_funcs = [self.start_calibration, self.calibration_next_freq, self.calibration_repeat_freq, self.stop_sound, self.calibration_set_level]
@@ -18,11 +26,40 @@ class Controller():
 
         # helper variable for calibration
         self.button_changed = False
+
+        # audio player shared by all procedures of a session (created on first use)
+        self.audio_backend = audio_backend
+        self.audio_player = None
     
     def run_app(self):
         """Starts the app by running the tkinter mainloop of the view.
+        Closes the audio streams when the window is closed.
         """
         self.view.mainloop()
+        if self.audio_player is not None:
+            self.audio_player.close()
+        device_registry.close()
+        export_worker.shutdown(wait=True) # finish exports of the last sessions
+
+    def get_audio_player(self)->AudioPlayer:
+        """Gets the audio player shared by all procedures. It keeps one output stream open for the whole session.
+
+        Returns:
+            AudioPlayer: shared audio player
+        """
+        if self.audio_player is None and self.audio_backend is not None:
+            self.audio_player = AudioPlayer(backend=self.audio_backend)
+        elif self.audio_backend is None and (self.audio_player is None or not device_registry.is_registered(self.audio_player)):
+            self.audio_player = device_registry.get_player() # the old player was dropped by device_registry.refresh()
+        return self.audio_player
+
+    def refresh_audio_devices(self):
+        """Probes the audio devices again, e.g. after an audio interface was plugged in.
+        The next procedure gets a new player from the device registry.
+        """
+        if self.audio_backend is None:
+            device_registry.refresh()
+            self.audio_player = None
 
     def start_familiarization(self, id:str="", headphone:str="Sennheiser_HDA200", calibrate:bool=True, **additional_data)->bool:
         """Creates a Familiarization object and uses it to start the familiarization process.
@@ -37,7 +74,8 @@ class Controller():
             bool: Whether familiarization was successful
         """
         self.selected_program = "familiarization"
-        self.familiarization = Familiarization(id=id, headphone_name=headphone, calibrate=calibrate, **additional_data)
+        self.get_audio_player().reset_statistics() # a new session starts with the familiarization
+        self.familiarization = Familiarization(id=id, headphone_name=headphone, calibrate=calibrate, audio_player=self.get_audio_player(), **additional_data)
         return self.familiarization.familiarize()
 
     def start_standard_procedure(self, binaural:bool=False, headphone:str="Sennheiser_HDA200", calibrate:bool=True, **additional_data):
@@ -50,8 +88,23 @@ class Controller():
             **additional_data: additional key/value pairs to be stored in CSV file after procedure is done
         """
         self.selected_program = "standard"
-        self.standard_procedure = StandardProcedure(self.familiarization.get_temp_csv_filename(), headphone_name=headphone, calibrate=calibrate, **additional_data)
+        self.standard_procedure = StandardProcedure(self.familiarization.get_results(), headphone_name=headphone, calibrate=calibrate, audio_player=self.get_audio_player(), **additional_data)
         self.standard_procedure.standard_test(binaural)
+        self.watch_export(self.standard_procedure)
+
+    def start_interleaved_procedure(self, binaural:bool=False, headphone:str="Sennheiser_HDA200", calibrate:bool=True, **additional_data):
+        """Creates a StandardProcedure object and uses it to start the standard procedure with all frequencies tested at once.
+
+        Args:
+            binaural (bool, optional): Whether to test both ears at the same time. Defaults to False.
+            headphone (str, optional): Name of headphone model being used. Defaults to "Sennheiser_HDA200".
+            calibrate (bool, optional): Whether to use calibration file. Defaults to True.
+            **additional_data: additional key/value pairs to be stored in CSV file after procedure is done
+        """
+        self.selected_program = "interleaved"
+        self.standard_procedure = StandardProcedure(self.familiarization.get_results(), headphone_name=headphone, calibrate=calibrate, audio_player=self.get_audio_player(), **additional_data)
+        self.standard_procedure.standard_test_interleaved(binaural)
+        self.watch_export(self.standard_procedure)
 
     def start_screen_procedure(self, binaural:bool=False, headphone:str="Sennheiser_HDA200", calibrate:bool=True, **additional_data):
         """Creates a ScreeningProcedure object and uses it to start the screening procedure.
@@ -63,8 +116,32 @@ class Controller():
             **additional_data: additional key/value pairs to be stored in CSV file after procedure is done
         """
         self.selected_program = "screening"
-        self.screen_procedure = ScreeningProcedure(self.familiarization.get_temp_csv_filename(), headphone_name=headphone, calibrate=calibrate, **additional_data)
+        self.screen_procedure = ScreeningProcedure(self.familiarization.get_results(), headphone_name=headphone, calibrate=calibrate, audio_player=self.get_audio_player(), **additional_data)
         self.screen_procedure.screen_test(binaural)
+        self.watch_export(self.screen_procedure)
+
+    def start_bayesian_procedure(self, binaural:bool=False, headphone:str="Sennheiser_HDA200", calibrate:bool=True, **additional_data):
+        """Creates a BayesianProcedure object and uses it to start the adaptive procedure.
+
+        Args:
+            binaural (bool, optional): Whether to test both ears at the same time. Defaults to False.
+            headphone (str, optional): Name of headphone model being used. Defaults to "Sennheiser_HDA200".
+            calibrate (bool, optional): Whether to use calibration file. Defaults to True.
+            **additional_data: additional key/value pairs to be stored in CSV file after procedure is done
+        """
+        self.selected_program = "bayesian"
+        self.bayesian_procedure = BayesianProcedure(self.familiarization.get_results(), headphone_name=headphone, calibrate=calibrate, audio_player=self.get_audio_player(), **additional_data)
+        self.bayesian_procedure.bayesian_test(binaural)
+        self.watch_export(self.bayesian_procedure)
+
+    def watch_export(self, procedure:Procedure):
+        """Shows the results again when the audiogram of the procedure has been exported in the background.
+
+        Args:
+            procedure (Procedure): finished procedure
+        """
+        if procedure.export_future is not None:
+            procedure.export_future.add_done_callback(lambda future: self.view.refresh_results())
 
     def start_calibration(self, level:int, headphone:str="Sennheiser_HDA200")->tuple:
         """Creates a Calibration object and uses it to start calibration.
@@ -74,7 +151,7 @@ class Controller():
             headphone (str, optional): Name of headphone model being used. Defaults to "Sennheiser_HDA200".
         """
         self.selected_program = "calibration"
-        self.calibration = Calibration(startlevel=level, headphone_name=headphone)
+        self.calibration = Calibration(startlevel=level, headphone_name=headphone, audio_player=self.get_audio_player())
         _, current_freq, current_spl = self.calibration_next_freq()
         return current_freq, current_spl
 
@@ -122,10 +199,12 @@ class Controller():
         """
         if self.selected_program == "familiarization":
             return self.familiarization.get_progress()
-        elif self.selected_program == "standard":
+        elif self.selected_program in ("standard", "interleaved"):
             return self.standard_procedure.get_progress()
         elif self.selected_program == "screening":
             return self.screen_procedure.get_progress()
+        elif self.selected_program == "bayesian":
+            return self.bayesian_procedure.get_progress()
         elif self.selected_program == "calibration":
             return 0.0
         else:
@@ -3,16 +3,20 @@ from datetime import datetime
 import csv
 import random
 import time
-from pynput import keyboard
-import tempfile as tfile
 import numpy as np
-from .audio_player import AudioPlayer
-from .audiogram import create_audiogram
+from .audio_player import AudioPlayer, device_registry
+from .responses import KeyboardResponder, keyboard_responder
+from .results import SessionResults
+from .levels import LevelTable, get_level_table
+from .reference_data import get_retspl, get_calibration
+from .clock import RealClock, real_clock
+from .export import export_worker
+from .session_store import get_session_store
 
 
 class Procedure:
 
-    def __init__(self, startlevel:float, signal_length:float, headphone_name:str="Sennheiser_HDA200", calibrate:bool=True):
+    def __init__(self, startlevel:float, signal_length:float, headphone_name:str="Sennheiser_HDA200", calibrate:bool=True, audio_player:AudioPlayer=None, responder:KeyboardResponder=None, clock:RealClock=None, rng:random.Random=None):
         """Creates the parent class for the familiarization, the main procedure, and the screening.
 
         Args:
@@ -20,14 +24,26 @@ class Procedure:
             signal_length (float): length of played signals in seconds
             headphone_name (str, optional): Name of headphone model being used. Defaults to Sennheiser_HDA200.
             calibrate (bool, optional): Use calibration file. Defaults to True.
+            audio_player (AudioPlayer, optional): Audio player shared between procedures. The shared player of the selected
+                device is used if None. Defaults to None.
+            responder (KeyboardResponder, optional): Detects the responses of the subject. The keyboard listener shared by
+                all procedures is used if None. Defaults to None.
+            clock (RealClock, optional): Clock for all waits of the procedure. A VirtualClock runs simulated sessions
+                without waiting. Real time is used if None. Defaults to None.
+            rng (random.Random, optional): Random generator for pauses and track order. A seeded generator makes
+                simulated sessions reproducible. A new unseeded generator is used if None. Defaults to None.
         """
-        self.ap = AudioPlayer()
+        self.ap = audio_player if audio_player is not None else device_registry.get_player()
+        self.responder = responder if responder is not None else keyboard_responder
+        self.clock = clock if clock is not None else real_clock
+        self.rng = rng if rng is not None else random.Random()
         self.startlevel = startlevel
         self.level = startlevel
         self.signal_length = signal_length
         self.frequency = 1000
         self.zero_dbhl = 0.000005 # zero_dbhl in absolute numbers. This is a rough guess for uncalibrated systems and will be adjusted through the calibration file
         self.tone_heard = False
+        self.reaction_times = [] # seconds between onset and key press of each heard tone
         self.freq_bands = ['125', '250', '500', '1000', '2000', '4000', '8000']
         self.freq_levels = {125: 20, 250: 20, 500: 20, 1000: 20, 2000: 20, 4000: 20, 8000: 20} # screening levels
         self.side = 'l'
@@ -35,8 +51,15 @@ class Procedure:
         self.jump_to_end = False
         self.use_calibration = calibrate
         self.progress = 0 # value for progressbar
+        self.pause_range = (1, 2.5) # random wait time in s after a heard tone
+        self.pause = 0 # wait time in s before the next tone
+        self.export = True # write CSV file and audiogram when the procedure is done
+        self.exporter = export_worker # writes CSV file and audiogram in the background
+        self.export_future = None # done when CSV file and audiogram are written
+        self.headphone_name = headphone_name
         self.retspl = self.get_retspl_values(headphone_name)
         self.calibration = self.get_calibration_values()
+        self.level_table = self.get_level_table()
         self.save_path = self.get_save_path()  # Initialize save_path
 
     def get_retspl_values(self, headphone_name:str):
@@ -55,14 +78,8 @@ class Procedure:
             print(f"File '{file_name}' not found.")
             return
         
-        retspl_values = {}
-        
         try:
-            with open(file_name, mode='r') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    if row['headphone_model'] == headphone_name:
-                        retspl_values[int(row['frequency'])] = float(row['retspl'])
+            retspl_values = get_retspl(headphone_name) # parsed once and shared until the file changes
         except Exception as e:
             print(f"Error reading the file: {e}")
             return
@@ -79,7 +96,8 @@ class Procedure:
         """Read the correct calibration values from the calibration.csv file.
 
         Returns:
-            dict of int:float : calibration values for each frequency band from 125 Hz to 8000 Hz
+            dict of str:dict : calibration values for each frequency band from 125 Hz to 8000 Hz for the sides 'l' and 'r'
+                (the average for 'lr' is part of the level table)
         """
         file_name = 'calibration.csv'
         
@@ -89,21 +107,7 @@ class Procedure:
             return
         
         try:
-            with open(file_name, mode='r') as file:
-                reader = csv.DictReader(file)
-                calibration_str_values_l = next(reader)
-                calibration_str_values_r = next(reader)
-                
-                # convert dictionary to int:float and put into extra dictionary for left and right side
-                calibration_values = {}
-                calibration_values['l'] = {int(k): float(v) for k, v in calibration_str_values_l.items()}
-                calibration_values['r'] = {int(k): float(v) for k, v in calibration_str_values_r.items()}
-                
-                # if both sides are used, calculate average between both sides
-                calibration_values['lr'] = {}
-                for k, v in calibration_values['l'].items():
-                    calibration_values['lr'][k] = (10 * np.log10((10 ** (v / 10) + 10 ** (calibration_values['r'][k] / 10)) / 2))
-        
+            calibration_values = get_calibration() # parsed once and shared until the file changes
         except Exception as e:
             print(f"Error reading the file: {e}")
             return
@@ -111,6 +115,18 @@ class Procedure:
         print(calibration_values)
         return calibration_values
 
+    def get_level_table(self)->LevelTable:
+        """Gets the precomputed amplitudes for all levels from the RETSPL and calibration values.
+        The table is built once and shared by all procedures with the same values.
+
+        Returns:
+            LevelTable: level table, None if no RETSPL values were found
+        """
+        if not self.retspl:
+            return
+        calibration = self.calibration if self.use_calibration else None # only add RETSPL without calibration
+        return get_level_table(self.retspl, calibration, self.zero_dbhl)
+
     def dbhl_to_volume(self, dbhl:float)->float:
         """Calculate dB HL into absolute numbers.
 
@@ -120,157 +136,53 @@ class Procedure:
         Returns:
             float: value in absolute numbers
         """
-        if self.use_calibration:
-            # add RETSPL and values from calibration file at that frequency
-            dbspl = dbhl + self.retspl[self.frequency] - self.calibration[self.side][self.frequency] 
-        else:
-            # only add RETSPL
-            dbspl = dbhl + self.retspl[self.frequency] 
-
-        return self.zero_dbhl * 10 ** (dbspl / 20) # calculate from dB to absolute numbers using the reference point self.zero_dbhl
+        return self.level_table.volume(dbhl, self.frequency, self.side)
     
-    def key_press(self, key:keyboard.Key):
-        """Function for pynputto be called on key press
-
-        Args:
-            key (keyboard.Key): key that was pressed
-        """
-        if key == keyboard.Key.space:
-            self.tone_heard = True
-            print("Tone heard!")
-        elif self.test_mode and key == keyboard.Key.right:
-            self.jump_to_end = True
-        
     def play_tone(self):
         """Sets tone_heard to False, play beep, then waits 4 s (max) for keypress.
-        Sets tone_heard to True if key is pressed.
-        Then waits for around 1 s to 2.5 s (randomized).
+        Sets tone_heard to True if key is pressed and stores the reaction time.
+        After a heard tone the next tone starts around 1 s to 2.5 s (randomized) later: it is prepared and handed to
+        the audio player at the start of the pause, so the onset is timed by the clock of the output.
         """
         self.tone_heard = False
         print(self.frequency, "Hz - playing tone at", self.level, "dBHL.")
-        self.ap.play_beep(self.frequency, self.dbhl_to_volume(self.level), self.signal_length, self.side)
-        listener = keyboard.Listener(on_press=self.key_press, on_release=None)
-        listener.start()
-        current_wait_time = 0
-        max_wait_time = 4000 # in ms 
-        step_size = 50 # in ms
-        
-        while current_wait_time < max_wait_time and not self.tone_heard: # wait for keypress
-            time.sleep(step_size / 1000)
-            current_wait_time += step_size
-        listener.stop()
+        request_time = time.monotonic()
+        pause, self.pause = self.pause, 0
+        self.ap.play_beep(self.frequency, self.dbhl_to_volume(self.level), self.signal_length, self.side, delay=pause)
+        self.clock.sleep(pause) # key presses during the pause are not counted
+        self.responder.arm(self.frequency, self.level, self.side)
+        max_wait_time = 4 # in s
+
+        self.tone_heard = self.clock.wait_for_response(self.responder, max_wait_time) # returns as soon as the key is pressed
         self.ap.stop()
-        
-        if not self.tone_heard:
-            print("Tone not heard :(")
-        else:
-            sleep_time = random.uniform(1, 2.5) # random wait time between 1 and 2.5
-            time.sleep(sleep_time) # wait before next tone is played. #TODO test times
-    
-    def create_temp_csv(self, id:str="", **additional_data)->str:
-        """Creates a temporary CSV file with the relevant frequency bands as a header
-        and NaN in the second and third line as starting value for each band.
-        (second line: left ear, third line: right ear)
-        ID and additional data will be stored in subsequent lines in the format: key, value.
 
-        Args:
-            id (str, optional): id to be stored, that will later be used for naming exported csv file
-            **additional_data: additional key/value pairs to be stored in CSV file after procedure is done
-
-        Returns:
-            str: name of temporary file
-        """
-        with tfile.NamedTemporaryFile(mode='w+', delete=False, newline='', suffix='.csv') as temp_file:
-            # Define the CSV writer
-            csv_writer = csv.writer(temp_file)
-
-            # Write header
-            csv_writer.writerow(self.freq_bands)
-
-            # Write value NaN for each frequency in second and third row
-            csv_writer.writerow(['NaN' for _ in range(len(self.freq_bands))])
-            csv_writer.writerow(['NaN' for _ in range(len(self.freq_bands))])
-
-            # Write id and additional data
-            if id:
-                csv_writer.writerow(["id", id])
-            if additional_data:
-                for key, value in additional_data.items():
-                    csv_writer.writerow([key, value])
-
-            return temp_file.name
-        
-    def add_to_temp_csv(self, value:str, frequency:str, side:str, temp_filename:str):
-        """Add a value in for a specific frequency to the temporary CSV file
+        if self.test_mode and self.responder.skip_requested:
+            self.jump_to_end = True
 
-        Args:
-            value (str): level in dB HL at specific frequency
-            frequency (str): frequency where value should be added
-            side (str): specify which ear ('l' or 'r')
-            temp_filename (str): name of temporary CSV file
-        """
-        # Read all rows from the CSV file
-        with open(temp_filename, mode='r', newline='') as temp_file:
-            dict_reader = csv.DictReader(temp_file)
-            rows = list(dict_reader)
-
-        # Update the relevant row based on the side parameter
-        if side == 'l':
-            rows[0][frequency] = value
-        elif side == 'r':
-            rows[1][frequency] = value
+        if not self.tone_heard:
+            print("Tone not heard :(")
         else:
-            rows[0][frequency] = value
-            rows[1][frequency] = value
-
-        # Write all rows back to the CSV file
-        with open(temp_filename, mode='w', newline='') as temp_file:
-            dict_writer = csv.DictWriter(temp_file, fieldnames=self.freq_bands)
-            dict_writer.writeheader()
-            dict_writer.writerows(rows)
-
-        print(rows[0], rows[1])
-        
-        for row in rows[2:]:
-            print(row['125'], row['250'])
+            onset = self.ap.get_last_onset()
+            if onset is not None and onset['monotonic'] >= request_time and self.responder.press_time is not None:
+                self.reaction_times.append(self.responder.press_time - onset['monotonic'])
+                print(f"Tone heard! Reaction time: {self.reaction_times[-1] * 1000:.0f} ms")
 
-    def get_value_from_csv(self, frequency:str, temp_filename:str, side:str='l')->str:
-        """Get the value at a specific frequency from the temporary CSV file.
-
-        Args:
-            frequency (str): frequency where value is stored
-            temp_filename (str): name of temporary CSV file
-            side (str, optional): specify which ear ('l' or 'r'). Defaults to 'l'.
-
-        Returns:
-            str: dB HL value at specified frequency
-        """
-        with open(temp_filename, mode='r', newline='') as temp_file:
-            dict_reader = csv.DictReader(temp_file)
-            freq_dict = next(dict_reader) # left ear
-            if side == 'r': # go to next line if right side
-                freq_dict = next(dict_reader)    
-            return freq_dict[frequency]
-        
-    def create_final_csv_and_audiogram(self, temp_filename:str, binaural:bool=False):
-        """Creates a permanent CSV file and audiogram from the temporary file.
+            self.pause = self.rng.uniform(*self.pause_range) # random wait time between 1 and 2.5 before next tone is played. #TODO test times
+    
+    def create_final_csv_and_audiogram(self, binaural:bool=False):
+        """Creates a permanent CSV file and audiogram from the results of the session.
+        Both are written by the export worker in the background, self.export_future is done when the files exist.
 
         Args:
-            temp_filename (str): Name of the temporary CSV file.
             binaural (bool): If the test is binaural.
         """
-        # Read the temporary file
-        with open(temp_filename, mode='r', newline='') as temp_file:
-            dict_reader = csv.DictReader(temp_file)
-            rows = list(dict_reader)
+        if not self.export: # e.g. simulated sessions, results stay in memory
+            return
 
         # Get date and time
         now = datetime.now()
         date_str = now.strftime("%Y%m%d_%H%M%S")
-        try:
-            id = rows[2]['250']
-        except:
-            id = "missingID"
+        id = self.results.get_metadata("id") or "missingID"
 
         # Create folder for the subject
         folder_name = os.path.join(self.save_path, f"{id}")
@@ -278,39 +190,44 @@ class Procedure:
             os.makedirs(folder_name)
 
         final_csv_filename = os.path.join(folder_name, f"{id}_audiogramm_{date_str}.csv")
+        rows = self.results.get_rows()
 
-        # Write the permanent CSV file
-        with open(final_csv_filename, mode='x', newline='') as final_file:
-            dict_writer = csv.DictWriter(final_file, fieldnames=self.freq_bands)
-            dict_writer.writeheader()
-            dict_writer.writerows(rows)
-
-        freqs = [int(x) for x in self.freq_bands]
-
-        left_levels = [self.parse_dbhl_value(rows[0][freq]) for freq in self.freq_bands]
-        right_levels = [self.parse_dbhl_value(rows[1][freq]) for freq in self.freq_bands]
+        audiogram = self.results.get_audiogram()
 
         # Generate the audiogram filename
         audiogram_filename = os.path.join(folder_name, f"{id}_audiogram_{date_str}.png")
-        print(left_levels, right_levels)
-        create_audiogram(freqs, left_levels, right_levels, binaural=binaural, name=audiogram_filename, freq_levels=self.freq_levels)
+        print(audiogram.get_values('l'), audiogram.get_values('r'))
 
-    def parse_dbhl_value(self, value:str)->int:
-        """Parses the dBHL value from the CSV file.
+        # Write the permanent CSV file and the audiogram in the background
+        job = {'csv_filename': final_csv_filename, 'freq_bands': self.freq_bands, 'rows': rows,
+               'audiogram_filename': audiogram_filename, 'audiogram': audiogram,
+               'binaural': binaural, 'freq_levels': self.freq_levels}
+        self.results.close()
+        self.export_future = self.exporter.submit(job, self.export_done)
 
-        Args:
-            value (str): the value from the CSV file
+        # Store the session in the database, if enabled
+        try:
+            store = get_session_store(self.save_path)
+            if store is not None:
+                store.add_session(id, now.strftime("%Y-%m-%d %H:%M:%S"), {'l': rows[0], 'r': rows[1]}, self.results.metadata,
+                                  program=type(self).__name__, binaural=binaural, headphone=self.headphone_name,
+                                  csv_filename=final_csv_filename, audiogram_filename=audiogram_filename)
+        except Exception as e: # the store is optional and must not stop the procedure
+            print(f"Error storing the session in the database: {e}")
+
+    def export_done(self, future):
+        """Called by the export worker when the files of the session are written.
+        Removes the journal of the results, which is kept until then in case the export fails.
 
-        Returns:
-            int or None: the parsed value or None if 'NH'
+        Args:
+            future (Future): future of the export
         """
-        if value == 'NH':
-            return 'NH'
-        try:
-            return int(value)
-        except ValueError:
-            return None
-        
+        if future.exception() is not None:
+            print(f"Export failed, results are kept in {self.results.journal_filename}: {future.exception()}")
+            return
+        self.results.close(remove=True) # journal is not needed anymore
+        print("Exported " + future.result()['audiogram_filename'])
+
     def get_progress(self)->float:
         """Gets the current progress.
 
@@ -352,7 +269,7 @@ class Procedure:
 
 class Familiarization(Procedure):
 
-    def __init__(self, startlevel:int=40, signal_length:int=1, headphone_name:str="Sennheiser_HDA200",calibrate:bool=True, id:str="", **additional_data):
+    def __init__(self, startlevel:int=40, signal_length:int=1, headphone_name:str="Sennheiser_HDA200",calibrate:bool=True, id:str="", audio_player:AudioPlayer=None, responder:KeyboardResponder=None, clock:RealClock=None, rng:random.Random=None, **additional_data):
         """Creates the Familiarization process.
 
         Args:
@@ -361,19 +278,23 @@ class Familiarization(Procedure):
             headphone_name (str, optional): Name of headphone model being used. Defaults to Sennheiser_HDA200.
             calibrate (bool, optional): Use calibration file. Defaults to True.
             id (str, optional): id to be stored, that will later be used for naming exported CSV file
+            audio_player (AudioPlayer, optional): Audio player shared between procedures. Defaults to None.
+            responder (KeyboardResponder, optional): Detects the responses of the subject. Defaults to None.
+            clock (RealClock, optional): Clock for all waits of the procedure. Defaults to None.
+            rng (random.Random, optional): Random generator for pauses and track order. Defaults to None.
             **additional_data: additional key/value pairs to be stored in CSV file after procedure is done
         """
-        super().__init__(startlevel, signal_length, headphone_name=headphone_name, calibrate=calibrate)      
+        super().__init__(startlevel, signal_length, headphone_name=headphone_name, calibrate=calibrate, audio_player=audio_player, responder=responder, clock=clock, rng=rng)      
         self.fails = 0 # number of times familiarization failed
-        self.tempfile = self.create_temp_csv(id=id, **additional_data) # create a temporary file to store level at frequencies
+        self.results = SessionResults(self.freq_bands, id=id, **additional_data) # stores level at frequencies
 
-    def get_temp_csv_filename(self)->str:
-        """Gets name of temp CSV file.
+    def get_results(self)->SessionResults:
+        """Gets the results of the session.
 
         Returns:
-            str: name of CSV file
+            SessionResults: results with the level from the familiarization at 1000 Hz
         """
-        return self.tempfile
+        return self.results
 
     def familiarize(self)->bool:
         """Main function.
@@ -391,7 +312,7 @@ class Familiarization(Procedure):
 
                 if self.jump_to_end == True:
                     for f in self.freq_bands:
-                        self.add_to_temp_csv(20, f, 'lr', self.get_temp_csv_filename())
+                        self.results.set_value(20, f, 'lr')
                     return True
                 
                 if self.tone_heard:
@@ -429,24 +350,31 @@ class Familiarization(Procedure):
             else:
                 print("Familiarization successful!")
                 self.progress = 1
-                self.add_to_temp_csv(self.level, '1000', 'l', self.tempfile)
+                self.results.set_value(self.level, '1000', 'l')
                 return True
             
             
 class StandardProcedure(Procedure):
 
-    def __init__(self, temp_filename:str, signal_length:int=1, headphone_name:float="Sennheiser_HDA200", calibrate:bool=True):
+    def __init__(self, results:SessionResults, signal_length:int=1, headphone_name:float="Sennheiser_HDA200", calibrate:bool=True, audio_player:AudioPlayer=None, responder:KeyboardResponder=None, clock:RealClock=None, rng:random.Random=None, **additional_data):
         """Standard audiometer process (rising level).
 
         Args:
-            temp_filename (str): name of temporary CSV file where starting level is stored and future values will be stored
+            results (SessionResults): results of the session where starting level is stored and future values will be stored
             signal_length (int, optional): length of played signal in seconds. Defaults to 1.
             headphone_name (str, optional): Name of headphone model being used. Defaults to Sennheiser_HDA200.
             calibrate (bool, optional): Use calibration file. Defaults to True.
+            audio_player (AudioPlayer, optional): Audio player shared between procedures. Defaults to None.
+            responder (KeyboardResponder, optional): Detects the responses of the subject. Defaults to None.
+            clock (RealClock, optional): Clock for all waits of the procedure. Defaults to None.
+            rng (random.Random, optional): Random generator for pauses and track order. Defaults to None.
+            **additional_data: additional key/value pairs to be stored in CSV file after procedure is done
         """
-        startlevel = int(self.get_value_from_csv('1000', temp_filename)) - 10 # 10 dB under level from familiarization
-        super().__init__(startlevel, signal_length, headphone_name=headphone_name, calibrate=calibrate)
-        self.temp_filename = temp_filename
+        startlevel = int(results.get_value('1000')) - 10 # 10 dB under level from familiarization
+        super().__init__(startlevel, signal_length, headphone_name=headphone_name, calibrate=calibrate, audio_player=audio_player, responder=responder, clock=clock, rng=rng)
+        self.results = results
+        for key, value in additional_data.items():
+            self.results.set_metadata(key, value)
         self.freq_order = [1000, 2000, 4000, 8000, 500, 250, 125] # order in which frequencies are tested
         
         self.progress_step = 0.95 / 14
@@ -466,7 +394,7 @@ class StandardProcedure(Procedure):
             success_l = self.standard_test_one_ear()
 
             if self.test_mode == True and self.jump_to_end == True:
-                self.create_final_csv_and_audiogram(self.temp_filename, binaural)
+                self.create_final_csv_and_audiogram(binaural)
                 self.progress = 1
                 return True
             
@@ -474,7 +402,7 @@ class StandardProcedure(Procedure):
             success_r = self.standard_test_one_ear()
 
             if success_l and success_r:
-                self.create_final_csv_and_audiogram(self.temp_filename, binaural)
+                self.create_final_csv_and_audiogram(binaural)
                 self.progress = 1
                 return True
         
@@ -484,12 +412,12 @@ class StandardProcedure(Procedure):
             success_lr = self.standard_test_one_ear()
 
             if self.test_mode == True and self.jump_to_end == True:
-                self.create_final_csv_and_audiogram(self.temp_filename, binaural)
+                self.create_final_csv_and_audiogram(binaural)
                 self.progress = 1
                 return True
             
             if success_lr:
-                self.create_final_csv_and_audiogram(self.temp_filename, binaural)
+                self.create_final_csv_and_audiogram(binaural)
                 self.progress = 1
                 return True
 
@@ -503,22 +431,9 @@ class StandardProcedure(Procedure):
         """
         success = []
 
-        self.tone_heard = False
-        self.frequency = 1000
-        self.level = self.startlevel
-
-        # Step 1 (raise tone in 5 dB steps until it is heard)
-        while not self.tone_heard:
-            self.play_tone()
-
-            if self.test_mode == True and self.jump_to_end == True:
-                return True
-
-            if not self.tone_heard:
-                self.level += 5
-        
-        self.startlevel = self.level
-        print(f"Starting level: {self.startlevel} dBHL")
+        self.find_startlevel()
+        if self.test_mode == True and self.jump_to_end == True:
+            return True
 
         # test every frequency
         for f in self.freq_order:
@@ -543,6 +458,27 @@ class StandardProcedure(Procedure):
         else:
             return False
 
+    def find_startlevel(self):
+        """Step 1: raises the tone at 1000 Hz in 5 dB steps from the starting level until it is heard
+        and uses that level as new starting level for the current side.
+        """
+        self.tone_heard = False
+        self.frequency = 1000
+        self.level = self.startlevel
+
+        # Step 1 (raise tone in 5 dB steps until it is heard)
+        while not self.tone_heard:
+            self.play_tone()
+
+            if self.test_mode == True and self.jump_to_end == True:
+                return
+
+            if not self.tone_heard:
+                self.level += 5
+        
+        self.startlevel = self.level
+        print(f"Starting level: {self.startlevel} dBHL")
+
     def standard_test_one_freq(self, freq:int, retest:bool=False)->bool:
         """Test for one frequency.
 
@@ -553,9 +489,44 @@ class StandardProcedure(Procedure):
         Returns:
             bool: test successful
         """
-        self.tone_heard = True
         self.frequency = freq
-        self.level = self.startlevel
+        return self.run_track(self.standard_track(freq, self.side, self.startlevel, retest))
+
+    def run_track(self, track)->bool:
+        """Plays all tones of one track in sequence.
+
+        Args:
+            track (generator): track from standard_track()
+
+        Returns:
+            bool: test successful
+        """
+        try:
+            self.level = next(track)
+            while True:
+                self.play_tone()
+                self.level = track.send(self.tone_heard)
+        except StopIteration as stop:
+            return stop.value
+
+    def standard_track(self, freq:int, side:str, startlevel:int, retest:bool=False):
+        """Rules of the test for one frequency and side as a generator, so several tracks can be interleaved.
+        Yields the level of the next tone and receives whether it was heard.
+
+        Args:
+            freq (int): frequency at which hearing is tested
+            side (str): 'l', 'r' or 'lr'
+            startlevel (int): level in dB HL from which the first descent starts
+            retest (bool, optional): this is the retest at the end of step 3 according to DIN. Defaults to False
+
+        Yields:
+            int: level in dB HL of the next tone
+
+        Returns:
+            bool: test successful
+        """
+        tone_heard = True
+        level = startlevel
 
         # Step 2
         answers = []
@@ -563,56 +534,144 @@ class StandardProcedure(Procedure):
 
         while tries < 6:
             # reduce in 10dB steps until no answer
-            while self.tone_heard:
-                self.level -= 10
-                self.play_tone()
+            while tone_heard:
+                level -= 10
+                tone_heard = yield level
 
             # raise in 5 dB steps until answer
-            while not self.tone_heard:
-                self.level += 5
-                self.play_tone()
+            while not tone_heard:
+                level += 5
+                tone_heard = yield level
 
             tries += 1
-            answers.append(self.level)
-            print(f"Try nr {tries}: level: {self.level}")
+            answers.append(level)
+            print(f"{freq} Hz ({side}) - try nr {tries}: level: {level}")
 
-            if answers.count(self.level) >= 2:
+            if answers.count(level) >= 2:
                 if retest:
-                    if abs(self.level - int(self.get_value_from_csv(str(self.frequency), self.temp_filename, self.side))) > 5:
-                        self.add_to_temp_csv(str(self.level), str(self.frequency), self.side, self.temp_filename)
+                    first_value = self.results.get_value(str(freq), side)
+                    if first_value == 'NaN' or abs(level - int(first_value)) > 5: # no value if first test failed
+                        self.results.set_value(str(level), str(freq), side)
                         return False
                     else:
-                        self.add_to_temp_csv(str(self.level), str(self.frequency), self.side, self.temp_filename)
+                        self.results.set_value(str(level), str(freq), side)
                         return True
 
-                self.add_to_temp_csv(str(self.level), str(self.frequency), self.side, self.temp_filename)
+                self.results.set_value(str(level), str(freq), side)
                 if self.progress < 0.95 - self.progress_step:
                     self.progress += self.progress_step
                 return True
             
             # no two same answers in three tries
             if tries == 3:
-                self.level += 10
-                self.play_tone()
+                level += 10
+                tone_heard = yield level
                 answers = []
 
         print("Something went wrong, please try from the beginning again.")
         return False
 
+    def standard_test_interleaved(self, binaural:bool=False)->bool:
+        """Standard procedure with all frequencies (and both ears) tested at once.
+        Every frequency and side keeps its own track with the rules of standard_test_one_freq(),
+        and each tone is taken from a randomly chosen track, so the subject cannot predict frequency, ear
+        and level of the next tone. The random pause after a heard tone applies to its track only,
+        the other tracks fill it and the procedure only waits if no track is ready.
+
+        Args:
+            binaural (bool, optional): Test both ears at the same time. Defaults to False.
+
+        Returns:
+            bool: test successful
+        """
+        self.progress = 0.01
+        sides = ['lr'] if binaural else ['l', 'r']
+        if binaural:
+            self.progress_step = 0.95 / 7
+
+        # Step 1 for each side
+        startlevels = {}
+        for side in sides:
+            self.side = side
+            self.find_startlevel()
+            if self.test_mode == True and self.jump_to_end == True:
+                self.create_final_csv_and_audiogram(binaural)
+                self.progress = 1
+                return True
+            startlevels[side] = self.startlevel
+
+        # Step 2 for all tracks at once
+        tracks = {(side, f): self.standard_track(f, side, startlevels[side]) for side in sides for f in self.freq_order}
+        next_levels = {key: next(track) for key, track in tracks.items()}
+        ready_times = {key: self.clock.now() for key in tracks} # end of the pause of each track
+        success = []
+        last_key = None
+
+        while next_levels:
+            now = self.clock.now()
+            ready = [key for key in next_levels if ready_times[key] <= now]
+            keys = [key for key in ready if key != last_key] or ready # avoid the same track twice in a row
+            if keys:
+                key = self.rng.choice(keys)
+                self.pause = 0
+            else: # all tracks are in their pause, wait for the first one
+                key = min(next_levels, key=ready_times.get)
+                self.pause = ready_times[key] - now
+            self.side, self.frequency = key
+            self.level = next_levels[key]
+            self.play_tone()
+            ready_times[key] = self.clock.now() + self.pause # pause after a heard tone, 0 otherwise
+            self.pause = 0
+            last_key = key
+
+            if self.test_mode == True and self.jump_to_end == True:
+                self.create_final_csv_and_audiogram(binaural)
+                self.progress = 1
+                return True
+
+            try:
+                next_levels[key] = tracks[key].send(self.tone_heard)
+            except StopIteration as stop:
+                success.append(stop.value)
+                del next_levels[key]
+
+        # retest 1000 Hz (and more frequencies if discrepancy is too high)
+        for side in sides:
+            self.side = side
+            self.startlevel = startlevels[side]
+            for f in self.freq_order:
+                print(f"Retest at frequency {f} Hz")
+                if self.standard_test_one_freq(f, retest=True):
+                    break
+
+        if all(success):
+            self.create_final_csv_and_audiogram(binaural)
+            self.progress = 1
+            return True
+
+        return False
+
 
 class ScreeningProcedure(Procedure):
 
-    def __init__(self, temp_filename:str, signal_length:int=1, headphone_name:str="Sennheiser_HDA200", calibrate:bool=True):
+    def __init__(self, results:SessionResults, signal_length:int=1, headphone_name:str="Sennheiser_HDA200", calibrate:bool=True, audio_player:AudioPlayer=None, responder:KeyboardResponder=None, clock:RealClock=None, rng:random.Random=None, **additional_data):
         """Short screening process to check if subject can hear specific frequencies at certain levels.
 
         Args:
-            temp_filename (str): name of temporary CSV file where starting level is stored and future values will be stored.
+            results (SessionResults): results of the session where future values will be stored.
             signal_length (int, optional): length of played signals in seconds. Defaults to 1.
             headphone_name (str, optional): Name of headphone model being used. Defaults to Sennheiser_HDA200.
             calibrate (bool, optional): Use calibration file. Defaults to True.
+            audio_player (AudioPlayer, optional): Audio player shared between procedures. Defaults to None.
+            responder (KeyboardResponder, optional): Detects the responses of the subject. Defaults to None.
+            clock (RealClock, optional): Clock for all waits of the procedure. Defaults to None.
+            rng (random.Random, optional): Random generator for pauses and track order. Defaults to None.
+            **additional_data: additional key/value pairs to be stored in CSV file after procedure is done
         """
-        super().__init__(startlevel=0, signal_length=signal_length, headphone_name=headphone_name, calibrate=calibrate)
-        self.temp_filename = temp_filename
+        super().__init__(startlevel=0, signal_length=signal_length, headphone_name=headphone_name, calibrate=calibrate, audio_player=audio_player, responder=responder, clock=clock, rng=rng)
+        self.results = results
+        for key, value in additional_data.items():
+            self.results.set_metadata(key, value)
         self.freq_order = [1000, 2000, 4000, 8000, 500, 250, 125]
         self.freq_levels = {125: 20, 250: 20, 500: 20, 1000: 20, 2000: 20, 4000: 20, 8000: 20}
         self.progress_step = 1 / 14
@@ -634,7 +693,7 @@ class ScreeningProcedure(Procedure):
 
             self.progress = 1
 
-            self.create_final_csv_and_audiogram(self.temp_filename, binaural)
+            self.create_final_csv_and_audiogram(binaural)
             return True
         
         if binaural:
@@ -643,7 +702,7 @@ class ScreeningProcedure(Procedure):
             self.screen_one_ear()
             self.progress = 1
 
-        self.create_final_csv_and_audiogram(self.temp_filename, binaural)
+        self.create_final_csv_and_audiogram(binaural)
 
     def screen_one_ear(self):
         """Screening for one ear.
@@ -682,27 +741,194 @@ class ScreeningProcedure(Procedure):
                 self.num_heard += 1
         
         if self.num_heard >= 2:
-            self.add_to_temp_csv(str(self.level), str(self.frequency), self.side, self.temp_filename)
+            self.results.set_value(str(self.level), str(self.frequency), self.side)
             self.progress += self.progress_step
             return
  
-        self.add_to_temp_csv('NH', str(self.frequency), self.side, self.temp_filename)
+        self.results.set_value('NH', str(self.frequency), self.side)
         self.progress += self.progress_step
 
 
+class BayesianProcedure(Procedure):
+
+    def __init__(self, results:SessionResults, signal_length:int=1, headphone_name:str="Sennheiser_HDA200", calibrate:bool=True, audio_player:AudioPlayer=None, responder:KeyboardResponder=None, clock:RealClock=None, rng:random.Random=None,
+                 slope:float=0.5, false_alarm_rate:float=0.02, lapse_rate:float=0.02, max_width:float=3.0, max_presentations:int=20, level_step:int=5, **additional_data):
+        """Adaptive audiometer process that keeps a posterior distribution of the threshold on a 1 dB grid.
+        Each tone is played at the level with the highest expected information, and a frequency is done
+        as soon as the standard deviation of the posterior falls below max_width.
+
+        Args:
+            results (SessionResults): results of the session where starting level is stored and future values will be stored
+            signal_length (int, optional): length of played signal in seconds. Defaults to 1.
+            headphone_name (str, optional): Name of headphone model being used. Defaults to Sennheiser_HDA200.
+            calibrate (bool, optional): Use calibration file. Defaults to True.
+            audio_player (AudioPlayer, optional): Audio player shared between procedures. Defaults to None.
+            responder (KeyboardResponder, optional): Detects the responses of the subject. Defaults to None.
+            clock (RealClock, optional): Clock for all waits of the procedure. Defaults to None.
+            rng (random.Random, optional): Random generator for pauses and track order. Defaults to None.
+            slope (float, optional): assumed slope of the psychometric function in 1/dB. Defaults to 0.5.
+            false_alarm_rate (float, optional): assumed probability of a response to an inaudible tone. Defaults to 0.02.
+            lapse_rate (float, optional): assumed probability of missing a clearly audible tone. Defaults to 0.02.
+            max_width (float, optional): standard deviation of the posterior in dB at which a frequency is done. Defaults to 3.0.
+            max_presentations (int, optional): maximum number of tones per frequency. Defaults to 20.
+            level_step (int, optional): step size of the played levels in dB. Defaults to 5.
+            **additional_data: additional key/value pairs to be stored in CSV file after procedure is done
+        """
+        startlevel = int(results.get_value('1000')) - 10 # 10 dB under level from familiarization
+        super().__init__(startlevel, signal_length, headphone_name=headphone_name, calibrate=calibrate, audio_player=audio_player, responder=responder, clock=clock, rng=rng)
+        self.results = results
+        for key, value in additional_data.items():
+            self.results.set_metadata(key, value)
+        self.freq_order = [1000, 2000, 4000, 8000, 500, 250, 125] # order in which frequencies are tested
+        self.max_width = max_width
+        self.max_presentations = max_presentations
+        self.progress_step = 0.95 / 14
+
+        self.thresholds = np.arange(-10, 121, dtype=np.float64) # grid of possible thresholds in dB HL
+        self.candidates = np.arange(-10, 121, level_step, dtype=np.float64) # levels that can be played
+        # probability of a response for each candidate level (rows) and threshold (columns)
+        detection = 1 / (1 + np.exp(-slope * (self.candidates[:, np.newaxis] - self.thresholds[np.newaxis, :])))
+        self.p_yes = false_alarm_rate + (1 - false_alarm_rate - lapse_rate) * detection
+
+    def get_prior(self)->np.array:
+        """Gets the prior distribution of the threshold: a broad normal distribution around the starting level.
+
+        Returns:
+            np.array: probability of each threshold of the grid
+        """
+        prior = np.exp(-0.5 * ((self.thresholds - self.startlevel) / 20) ** 2)
+        return prior / prior.sum()
+
+    def get_playable_levels(self)->np.array:
+        """Gets the indices of the candidate levels that do not clip at the current frequency and side.
+
+        Returns:
+            np.array: indices into self.candidates
+        """
+        playable = np.flatnonzero(~self.level_table.clips(self.candidates, self.frequency, self.side))
+        return playable if len(playable) else np.arange(1) # lowest level if everything clips
+
+    def next_level_index(self, posterior:np.array, playable:np.array)->int:
+        """Chooses the level with the lowest expected entropy of the posterior after the response.
+
+        Args:
+            posterior (np.array): current probability of each threshold
+            playable (np.array): indices of the candidate levels that can be played
+
+        Returns:
+            int: index into self.candidates
+        """
+        p_yes = self.p_yes[playable]
+        joint_yes = p_yes * posterior # unnormalized posterior after a response
+        joint_no = (1 - p_yes) * posterior # unnormalized posterior without response
+        prob_yes = joint_yes.sum(axis=1)
+        prob_no = 1 - prob_yes
+        expected_entropy = prob_yes * self.entropy(joint_yes / prob_yes[:, np.newaxis]) + prob_no * self.entropy(joint_no / prob_no[:, np.newaxis])
+        return int(playable[np.argmin(expected_entropy)])
+
+    def entropy(self, distributions:np.array)->np.array:
+        """Calculates the entropy of each row.
+
+        Args:
+            distributions (np.array): probability distributions in rows
+
+        Returns:
+            np.array: entropy of each row in nats
+        """
+        return -np.sum(distributions * np.log(np.clip(distributions, 1e-300, None)), axis=1)
+
+    def get_width(self, posterior:np.array)->float:
+        """Calculates the standard deviation of the posterior.
+
+        Args:
+            posterior (np.array): probability of each threshold
+
+        Returns:
+            float: standard deviation in dB
+        """
+        mean = np.dot(posterior, self.thresholds)
+        return float(np.sqrt(np.dot(posterior, (self.thresholds - mean) ** 2)))
+
+    def bayesian_test(self, binaural:bool=False)->bool:
+        """Main function.
+
+        Args:
+            binaural (bool, optional): Test both ears at the same time. Defaults to False.
+
+        Returns:
+            bool: test successful
+        """
+        self.progress = 0.01
+        sides = ['lr'] if binaural else ['l', 'r']
+        if binaural:
+            self.progress_step = 0.95 / 7
+
+        for side in sides:
+            self.side = side
+            for f in self.freq_order:
+                print(f"Testing frequency {f} Hz")
+                self.bayesian_test_one_freq(f)
+
+                if self.test_mode == True and self.jump_to_end == True:
+                    self.create_final_csv_and_audiogram(binaural)
+                    self.progress = 1
+                    return True
+
+        self.create_final_csv_and_audiogram(binaural)
+        self.progress = 1
+        return True
+
+    def bayesian_test_one_freq(self, freq:int)->int:
+        """Test for one frequency.
+
+        Args:
+            freq (int): frequency at which hearing is tested
+
+        Returns:
+            int: estimated threshold in dB HL
+        """
+        self.frequency = freq
+        posterior = self.get_prior()
+        playable = self.get_playable_levels()
+
+        for _ in range(self.max_presentations):
+            i = self.next_level_index(posterior, playable)
+            self.level = int(self.candidates[i])
+            self.play_tone()
+
+            if self.test_mode == True and self.jump_to_end == True:
+                return self.level
+
+            posterior = posterior * (self.p_yes[i] if self.tone_heard else 1 - self.p_yes[i])
+            posterior /= posterior.sum()
+            if self.get_width(posterior) < self.max_width:
+                break
+
+        threshold = int(round(float(np.dot(posterior, self.thresholds)))) # posterior mean
+        print(f"Threshold at {freq} Hz: {threshold} dBHL (width {self.get_width(posterior):.1f} dB)")
+        self.results.set_value(str(threshold), str(freq), self.side)
+        if self.progress < 0.95 - self.progress_step:
+            self.progress += self.progress_step
+        return threshold
+
+
 class Calibration(Procedure):
 
-    def __init__(self, startlevel:int=60, signal_length:int=10, headphone_name:str="Sennheiser_HDA200", **additional_data):
+    def __init__(self, startlevel:int=60, signal_length:int=10, headphone_name:str="Sennheiser_HDA200", audio_player:AudioPlayer=None, responder:KeyboardResponder=None, clock:RealClock=None, rng:random.Random=None, **additional_data):
         """Process for calibrating system.
 
         Args:
             startlevel (int, optional): starting level of procedure in dB HL. Defaults to 60.
             signal_length (int, optional): length of played signals in seconds. Defaults to 10.
             headphone_name (str, optional): Name of headphone model being used. Defaults to Sennheiser_HDA200.
+            audio_player (AudioPlayer, optional): Audio player shared between procedures. Defaults to None.
+            responder (KeyboardResponder, optional): Detects the responses of the subject. Defaults to None.
+            clock (RealClock, optional): Clock for all waits of the procedure. Defaults to None.
+            rng (random.Random, optional): Random generator for pauses and track order. Defaults to None.
             **additional_data: additional key/value pairs to be stored in CSV file after procedure is done
         """
-        super().__init__(startlevel, signal_length, headphone_name=headphone_name, calibrate=False)      
-        self.tempfile = self.create_temp_csv(id="", **additional_data) # create a temporary file to store level at frequencies
+        super().__init__(startlevel, signal_length, headphone_name=headphone_name, calibrate=False, audio_player=audio_player, responder=responder, clock=clock, rng=rng)      
+        self.results = SessionResults(self.freq_bands, **additional_data) # stores calibration values at frequencies
         self.generator = self.get_next_freq()
         self.dbspl = self.level + self.retspl[self.frequency]
 
@@ -756,32 +982,21 @@ class Calibration(Procedure):
         self.ap.play_beep(self.frequency, self.dbhl_to_volume(self.level), self.signal_length, self.side)
 
     def set_calibration_value(self, measured_value:float):
-        """Rights the given calibration value into temporary CSV file
+        """Stores the given calibration value in the results
 
         Args:
             measured_value (float): measured SPL value in dB
         """
         value = measured_value - self.dbspl
-        self.add_to_temp_csv(str(value), str(self.frequency), self.side, self.tempfile)
+        self.results.set_value(str(value), str(self.frequency), self.side)
 
     def finish_calibration(self):
-        """Makes a permanent CSV file from the temporary file that overwrites calibration.csv.
-
-        Args:
-            temp_filename (str): name of temporary CSV file
+        """Makes a permanent CSV file from the results that overwrites calibration.csv.
         """
         self.ap.stop()
-        # read temp file
-        with open(self.tempfile, mode='r', newline='') as temp_file:
-            dict_reader = csv.DictReader(temp_file)
-            rows = list(dict_reader)
-
         filename = "calibration.csv"
-
-        with open(filename, mode='w', newline='') as final_file:
-            dict_writer = csv.DictWriter(final_file, fieldnames=self.freq_bands)
-            dict_writer.writeheader()
-            dict_writer.writerows(rows)
+        self.results.write_csv(filename, mode='w')
+        self.results.close(remove=True)
         
         print("Datei gespeicher als " + filename)
 
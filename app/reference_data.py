@@ -0,0 +1,114 @@
+import os
+import csv
+import threading
+
+
+def parse_retspl(file)->dict:
+    """Parses the RETSPL values of all headphone models.
+
+    Args:
+        file (file object): opened retspl.csv file
+
+    Returns:
+        dict of str:dict : RETSPL values (dict of int:float) for each headphone model in the order of the file
+    """
+    retspl_values = {}
+    for row in csv.DictReader(file):
+        retspl_values.setdefault(row['headphone_model'], {})[int(row['frequency'])] = float(row['retspl'])
+    return retspl_values
+
+def parse_calibration(file)->dict:
+    """Parses the calibration values of both sides.
+
+    Args:
+        file (file object): opened calibration.csv file
+
+    Returns:
+        dict of str:dict : calibration values (dict of int:float) for the sides 'l' and 'r'
+    """
+    reader = csv.DictReader(file)
+    calibration_str_values_l = next(reader)
+    calibration_str_values_r = next(reader)
+
+    # convert dictionary to int:float and put into extra dictionary for left and right side
+    calibration_values = {}
+    calibration_values['l'] = {int(k): float(v) for k, v in calibration_str_values_l.items()}
+    calibration_values['r'] = {int(k): float(v) for k, v in calibration_str_values_r.items()}
+    return calibration_values
+
+
+class ReferenceFile:
+
+    def __init__(self, file_name:str, parse:callable):
+        """Parses a CSV file with reference data once and keeps the result until the file changes.
+        A change is detected by the modification time and size of the file.
+
+        Args:
+            file_name (str): name of the CSV file
+            parse (callable): function that gets the opened file and returns the parsed data
+        """
+        self.file_name = file_name
+        self.parse = parse
+        self.lock = threading.Lock()
+        self.signature = None # (mtime, size) of the parsed file
+        self.data = None
+
+    def get(self):
+        """Gets the parsed data and parses the file again if it has changed.
+
+        Raises:
+            FileNotFoundError: if the file does not exist
+
+        Returns:
+            parsed data of the file
+        """
+        stat = os.stat(self.file_name)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if signature != self.signature:
+                with open(self.file_name, mode='r', newline='') as file:
+                    self.data = self.parse(file)
+                self.signature = signature
+            return self.data
+
+    def invalidate(self):
+        """Parses the file again on the next call of get().
+        """
+        with self.lock:
+            self.signature = None
+            self.data = None
+
+
+retspl_file = ReferenceFile('retspl.csv', parse_retspl)
+calibration_file = ReferenceFile('calibration.csv', parse_calibration)
+
+def get_headphone_models()->list:
+    """Gets all headphone models listed in retspl.csv.
+
+    Returns:
+        list of str: headphone models in the order of the file
+    """
+    return list(retspl_file.get())
+
+def get_retspl(headphone_name:str)->dict:
+    """Gets the RETSPL values of one headphone model.
+
+    Args:
+        headphone_name (str): exact name of headphone as it appears in retspl.csv
+
+    Returns:
+        dict of int:float : RETSPL values for each frequency band, None if the headphone model is not listed
+    """
+    retspl_values = retspl_file.get().get(headphone_name)
+    if retspl_values is None:
+        return
+    return dict(retspl_values)
+
+def get_calibration()->dict:
+    """Gets the calibration values from calibration.csv.
+
+    Returns:
+        dict of str:dict : calibration values (dict of int:float) for the sides 'l' and 'r'
+    """
+    calibration_values = calibration_file.get()
+    return {side: dict(values) for side, values in calibration_values.items()}
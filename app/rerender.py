@@ -0,0 +1,187 @@
+"""Renders the audiograms of all sessions in a result folder again, e.g. after colors or markers were changed in config.py.
+
+The CSV files are rendered in a process pool, every worker keeps its own figure for all its audiograms.
+A manifest in the save path stores the CSV files and the hash of config.py of the last render,
+so sessions whose CSV file and configuration have not changed are skipped.
+
+Run from the repository root:
+    python -m app.rerender results --workers 4
+"""
+import os
+import csv
+import time
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from . import config
+from .config import SESSION_STORE_FILENAME
+from .export import get_renderer
+from .importer import find_result_files
+from .audiogram_data import Audiogram
+from .session_store import SessionStore
+
+
+manifest_filename = "audiogram_renders.csv"
+manifest_fields = ['path', 'mtime_ns', 'size', 'config_hash']
+# settings of config.py that are read by the audiogram module, changes of other settings keep the audiograms
+audiogram_settings = ['COLOR_LEFT', 'COLOR_RIGHT', 'COLOR_BINAURAL', 'LINE_WIDTH', 'MARKER_SIZE', 'NOT_HEARD_MARKER_SIZE',
+                      'MARKER_EDGE_WIDTH', 'SHIFT', 'MARKER_LEFT', 'MARKER_RIGHT', 'MARKER_BINAURAL', 'NOT_HEARD_MARKER',
+                      'NOT_HEARD_LEFT_MARKER', 'NOT_HEARD_RIGHT_MARKER', 'HEADER_SIZE', 'LABEL_FONT_SIZE', 'LEGEND_FONT_SIZE',
+                      'TICK_FONT_SIZE', 'TEXT_FONT_SIZE']
+
+def get_config_hash()->str:
+    """Calculates a hash of the settings in config.py that change the audiograms.
+
+    Returns:
+        str: hex digest of the settings
+    """
+    settings = [(key, repr(getattr(config, key))) for key in audiogram_settings]
+    return hashlib.sha256(repr(settings).encode()).hexdigest()[:16]
+
+def get_audiogram_filename(csv_filename:str)->str:
+    """Gets the name of the audiogram of a final CSV file.
+
+    Args:
+        csv_filename (str): name of the CSV file, <id>_audiogramm_<date>.csv
+
+    Returns:
+        str: name of the audiogram, <id>_audiogram_<date>.png
+    """
+    folder, name = os.path.split(csv_filename)
+    return os.path.join(folder, name[:-len(".csv")].replace("_audiogramm_", "_audiogram_", 1) + ".png")
+
+def read_manifest(filename:str)->dict:
+    """Reads the CSV files of the last render.
+
+    Args:
+        filename (str): name of the manifest
+
+    Returns:
+        dict of str:tuple : (mtime_ns, size, config_hash) for each absolute path
+    """
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, mode='r', newline='') as manifest:
+        return {row['path']: (int(row['mtime_ns']), int(row['size']), row['config_hash']) for row in csv.DictReader(manifest)}
+
+def write_manifest(filename:str, entries:dict):
+    """Writes the manifest. The file is replaced at once, so it is never left half written.
+
+    Args:
+        filename (str): name of the manifest
+        entries (dict of str:tuple): (mtime_ns, size, config_hash) for each absolute path
+    """
+    with open(filename + ".tmp", mode='w', newline='') as manifest:
+        writer = csv.writer(manifest)
+        writer.writerow(manifest_fields)
+        writer.writerows([path, *entry] for path, entry in sorted(entries.items()))
+    os.replace(filename + ".tmp", filename)
+
+def get_binaural_flags(save_path:str)->dict:
+    """Gets from the session database which sessions were binaural, as the CSV files do not contain it.
+
+    Args:
+        save_path (str): folder of the results
+
+    Returns:
+        dict of str:bool : binaural for the absolute path of each stored CSV file, None if unknown, empty without database
+    """
+    database = os.path.join(save_path, SESSION_STORE_FILENAME)
+    if not os.path.exists(database):
+        return {}
+    store = SessionStore(database)
+    try:
+        with store.lock:
+            rows = store.connection.execute("SELECT csv_filename, binaural FROM sessions WHERE csv_filename IS NOT NULL").fetchall()
+    finally:
+        store.close()
+    return {row[0]: None if row[1] is None else bool(row[1]) for row in rows}
+
+def render_file(job:tuple)->tuple:
+    """Renders the audiogram of one CSV file. Runs in a worker process.
+    If it is unknown whether the session was binaural, the file is only read to find malformed files.
+
+    Args:
+        job (tuple): (path, binaural) of the CSV file, binaural is None if unknown
+
+    Returns:
+        tuple: (path, rendered, error), error is None if the file could be read
+    """
+    path, binaural = job
+    try:
+        audiogram = Audiogram.read_csv(path)
+        if binaural is None:
+            return path, False, None
+        get_renderer().render(audiogram, binaural=binaural, name=get_audiogram_filename(path))
+    except Exception as e: # one broken file must not stop the batch
+        return path, False, f"{type(e).__name__}: {e}"
+    return path, True, None
+
+def rerender(save_path:str, workers:int=None, force:bool=False, assume_monaural:bool=False)->dict:
+    """Renders the audiograms of all new or changed CSV files and of all files after config.py was changed.
+    Sessions that are not in the session database or whose binaural flag is unknown are skipped,
+    as a binaural audiogram must not be overwritten by a monaural one.
+
+    Args:
+        save_path (str): folder of the results
+        workers (int, optional): number of worker processes. Number of CPUs if None. Defaults to None.
+        force (bool, optional): Render all audiograms. Defaults to False.
+        assume_monaural (bool, optional): Render sessions with unknown binaural flag as monaural. Defaults to False.
+
+    Returns:
+        dict: 'rendered' and 'skipped' (number of files), 'unknown' (list of paths skipped without binaural flag)
+            and 'failed' (list of (path, error))
+    """
+    config_hash = get_config_hash()
+    manifest_file = os.path.join(save_path, manifest_filename)
+    manifest = {} if force else read_manifest(manifest_file)
+    files = find_result_files(save_path)
+    todo = [f for f in files if manifest.get(f[0]) != (f[1], f[2], config_hash)
+            or not os.path.exists(get_audiogram_filename(f[0]))]
+    report = {'rendered': 0, 'skipped': len(files) - len(todo), 'unknown': [], 'failed': []}
+    if not todo:
+        return report
+
+    binaural_flags = get_binaural_flags(save_path)
+    signatures = {path: (mtime_ns, size, config_hash) for path, mtime_ns, size in todo}
+    workers = max(1, min(workers or os.cpu_count() or 1, len(todo)))
+    chunksize = max(1, min(16, len(todo) // (workers * 4)))
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            jobs = [(path, bool(binaural_flags.get(path)) if assume_monaural else binaural_flags.get(path)) for path, _, _ in todo]
+            for path, rendered, error in executor.map(render_file, jobs, chunksize=chunksize):
+                if error is not None:
+                    report['failed'].append((path, error))
+                    continue
+                if not rendered:
+                    report['unknown'].append(path)
+                    continue
+                manifest[path] = signatures[path]
+                report['rendered'] += 1
+    finally:
+        write_manifest(manifest_file, manifest) # keep the progress if the batch is interrupted
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('save_path', help='folder of the results')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--force', action='store_true', help='render all audiograms, also unchanged ones')
+    parser.add_argument('--assume-monaural', action='store_true',
+                        help='render sessions with unknown binaural flag as monaural (may overwrite binaural audiograms)')
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    report = rerender(args.save_path, args.workers, args.force, args.assume_monaural)
+    if report['unknown']:
+        print(f"Warnung: bei {len(report['unknown'])} Sitzungen ist unbekannt, ob binaural getestet wurde, sie wurden nicht neu erstellt. "
+              f"Mit --assume-monaural werden sie als monaural erstellt.")
+    for path, error in report['failed']:
+        print(f"Fehler bei {path}: {error}")
+    print(f"{report['rendered']} Audiogramme erstellt, {report['skipped']} unverändert übersprungen, "
+          f"{len(report['failed'])} fehlerhaft ({time.monotonic() - start:.1f} s)")
+
+
+if __name__ == "__main__":
+    main()
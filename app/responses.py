@@ -0,0 +1,86 @@
+import threading
+import time
+
+
+def import_keyboard():
+    """Imports pynput.keyboard on first use, so the procedures can be imported on machines without a display.
+
+    Returns:
+        module: pynput.keyboard
+    """
+    from pynput import keyboard
+    return keyboard
+
+
+class KeyboardResponder:
+
+    def __init__(self):
+        """Detects the responses of the subject with one keyboard listener for the whole session.
+        A press of the space bar sets an event, so waiting for a response ends immediately.
+        The time of the press is taken from time.monotonic().
+        """
+        self.lock = threading.Lock()
+        self.heard = threading.Event()
+        self.press_time = None # time.monotonic() of the first press after arm()
+        self.skip_requested = False # right arrow key was pressed (skips procedures in test mode)
+        self.listener = None
+
+    def start(self):
+        """Starts the keyboard listener if it is not running yet.
+        """
+        with self.lock:
+            if self.listener is None:
+                keyboard = import_keyboard()
+                self.space = keyboard.Key.space
+                self.right = keyboard.Key.right
+                self.listener = keyboard.Listener(on_press=self.key_press, on_release=None)
+                self.listener.daemon = True
+                self.listener.start()
+
+    def stop(self):
+        """Stops the keyboard listener.
+        """
+        with self.lock:
+            if self.listener is not None:
+                self.listener.stop()
+                self.listener = None
+
+    def key_press(self, key):
+        """Function for pynput to be called on key press.
+
+        Args:
+            key (keyboard.Key): key that was pressed
+        """
+        if key == self.space:
+            if not self.heard.is_set():
+                self.press_time = time.monotonic()
+                self.heard.set()
+        elif key == self.right:
+            self.skip_requested = True
+
+    def arm(self, frequency:int=None, level:float=None, side:str=None):
+        """Prepares for the response to the next tone. Key presses before this call are ignored.
+
+        Args:
+            frequency (int, optional): frequency of the next tone in Hz. Not needed for keyboard responses.
+            level (float, optional): level of the next tone in dB HL. Not needed for keyboard responses.
+            side (str, optional): 'l', 'r' or 'lr'. Not needed for keyboard responses.
+        """
+        self.start()
+        self.press_time = None
+        self.skip_requested = False
+        self.heard.clear()
+
+    def wait(self, timeout:float)->bool:
+        """Waits until the subject responds or the timeout expires.
+
+        Args:
+            timeout (float): maximum waiting time in seconds
+
+        Returns:
+            bool: True if the tone was heard
+        """
+        return self.heard.wait(timeout)
+
+
+keyboard_responder = KeyboardResponder()
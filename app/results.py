@@ -0,0 +1,186 @@
+import os
+import csv
+import tempfile as tfile
+from .audiogram_data import Audiogram
+
+
+class SessionResults:
+
+    def __init__(self, freq_bands:list, id:str="", journal_filename:str=None, sync_every:int=8, **additional_data):
+        """Keeps the levels of one session in memory and appends every change to a journal file.
+        Each change costs one short append instead of rewriting a CSV file. The journal is flushed after every
+        record and synced to disk every sync_every records, so a crashed session can be restored with load().
+        The final CSV file is written once with write_csv().
+
+        Args:
+            freq_bands (list of str): frequency bands in Hz as they appear in the CSV header
+            id (str, optional): id to be stored, that will later be used for naming exported CSV file
+            journal_filename (str, optional): name of the journal file. A temporary file is created if None. Defaults to None.
+            sync_every (int, optional): number of records after which the journal is synced to disk. Defaults to 8.
+            **additional_data: additional key/value pairs to be stored in CSV file after procedure is done
+        """
+        self.freq_bands = list(freq_bands)
+        self.values = {'l': {f: 'NaN' for f in self.freq_bands}, # second line: left ear
+                       'r': {f: 'NaN' for f in self.freq_bands}} # third line: right ear
+        self.metadata = {}
+        self.sync_every = sync_every
+        self.unsynced = 0 # number of records since last sync
+
+        if journal_filename is None:
+            with tfile.NamedTemporaryFile(mode='w', delete=False, suffix='.journal') as temp_file:
+                journal_filename = temp_file.name
+        self.journal_filename = journal_filename
+        self.journal = open(journal_filename, mode='a', newline='')
+        self.journal_writer = csv.writer(self.journal)
+
+        if os.path.getsize(journal_filename) == 0:
+            self.append(['bands'] + self.freq_bands)
+        if id:
+            self.set_metadata("id", id)
+        for key, value in additional_data.items():
+            self.set_metadata(key, value)
+
+    @classmethod
+    def load(cls, journal_filename:str)->'SessionResults':
+        """Restores the results of a session from its journal, e.g. after a crash.
+        New changes are appended to the same journal.
+
+        Args:
+            journal_filename (str): name of the journal file
+
+        Returns:
+            SessionResults: restored results
+        """
+        with open(journal_filename, mode='r', newline='') as journal:
+            records = list(csv.reader(journal))
+
+        results = cls(records[0][1:], journal_filename=journal_filename)
+        for record in records[1:]:
+            if record[0] == 'value':
+                results.values[record[1]][record[2]] = record[3]
+            elif record[0] == 'meta':
+                results.metadata[record[1]] = record[2]
+        return results
+
+    def append(self, record:list):
+        """Appends a record to the journal and flushes it.
+
+        Args:
+            record (list of str): record to be appended
+        """
+        if self.journal is None: # closed, keep changes in memory only
+            return
+        self.journal_writer.writerow(record)
+        self.journal.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        """Writes all records of the journal to disk.
+        """
+        if self.journal is not None and self.unsynced:
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+            self.unsynced = 0
+
+    def set_metadata(self, key:str, value:str):
+        """Stores a key/value pair, e.g. the id or the age of the subject.
+
+        Args:
+            key (str): key
+            value (str): value
+        """
+        self.metadata[key] = value
+        self.append(['meta', key, value])
+
+    def get_metadata(self, key:str, default:str=None)->str:
+        """Gets a stored key/value pair.
+
+        Args:
+            key (str): key
+            default (str, optional): value if key is not stored. Defaults to None.
+
+        Returns:
+            str: value
+        """
+        return self.metadata.get(key, default)
+
+    def set_value(self, value:str, frequency:str, side:str):
+        """Sets the level at a specific frequency.
+
+        Args:
+            value (str): level in dB HL at specific frequency
+            frequency (str): frequency where value should be added
+            side (str): specify which ear ('l', 'r' or 'lr' for both)
+        """
+        value = str(value)
+        frequency = str(frequency)
+        sides = ['l', 'r'] if side == 'lr' else [side]
+        for s in sides:
+            self.values[s][frequency] = value
+            self.append(['value', s, frequency, value])
+
+    def get_value(self, frequency:str, side:str='l')->str:
+        """Gets the level at a specific frequency.
+
+        Args:
+            frequency (str): frequency where value is stored
+            side (str, optional): specify which ear ('l' or 'r'). 'lr' returns the left ear. Defaults to 'l'.
+
+        Returns:
+            str: dB HL value at specified frequency
+        """
+        if side == 'lr':
+            side = 'l'
+        return self.values[side][str(frequency)]
+
+    def get_audiogram(self)->'Audiogram':
+        """Gets the levels of both ears as an Audiogram.
+
+        Returns:
+            Audiogram: levels and status per ear and frequency
+        """
+        return Audiogram.from_rows([self.values['l'], self.values['r']], self.freq_bands)
+
+    def get_rows(self)->list:
+        """Gets the results in the layout of the CSV file: one row per ear, then one row per key/value pair
+        with the key under the first and the value under the second frequency band.
+
+        Returns:
+            list of dict: rows with the frequency bands as keys
+        """
+        rows = [dict(self.values['l']), dict(self.values['r'])]
+        for key, value in self.metadata.items():
+            row = {f: None for f in self.freq_bands}
+            row[self.freq_bands[0]] = key
+            row[self.freq_bands[1]] = value
+            rows.append(row)
+        return rows
+
+    def write_csv(self, filename:str, mode:str='x'):
+        """Writes the results into a CSV file with the frequency bands as a header,
+        the left ear in the second and the right ear in the third line,
+        and the key/value pairs in subsequent lines.
+
+        Args:
+            filename (str): name of the CSV file
+            mode (str, optional): 'x' to create a new file or 'w' to overwrite an existing one. Defaults to 'x'.
+        """
+        with open(filename, mode=mode, newline='') as final_file:
+            dict_writer = csv.DictWriter(final_file, fieldnames=self.freq_bands)
+            dict_writer.writeheader()
+            dict_writer.writerows(self.get_rows())
+
+    def close(self, remove:bool=False):
+        """Syncs and closes the journal.
+
+        Args:
+            remove (bool, optional): delete the journal file, e.g. after the final CSV file was written. Defaults to False.
+        """
+        if self.journal is not None:
+            self.sync()
+            self.journal.close()
+            self.journal = None
+        if remove and os.path.exists(self.journal_filename):
+            os.remove(self.journal_filename)
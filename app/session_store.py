@@ -0,0 +1,265 @@
+import os
+import sqlite3
+import threading
+from .config import SESSION_STORE, SESSION_STORE_FILENAME
+
+
+class SessionStore:
+
+    def __init__(self, filename:str):
+        """SQLite database with every session of all subjects: thresholds per ear and frequency and metadata.
+        Sessions are found by indexed queries on subject ID and date instead of scanning the result folders.
+        The database runs in WAL mode, so other processes can read while sessions are added.
+
+        Args:
+            filename (str): name of the database file
+        """
+        self.filename = filename
+        self.lock = threading.Lock() # the connection is shared by the procedure thread and the user interface
+        self.connection = sqlite3.connect(filename, check_same_thread=False, timeout=30)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA foreign_keys=ON")
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id INTEGER PRIMARY KEY,
+                    subject_id TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    program TEXT,
+                    binaural INTEGER,
+                    headphone TEXT,
+                    age TEXT,
+                    gender TEXT,
+                    csv_filename TEXT UNIQUE,
+                    audiogram_filename TEXT
+                );
+                CREATE INDEX IF NOT EXISTS sessions_subject_date ON sessions (subject_id, date);
+                CREATE INDEX IF NOT EXISTS sessions_date ON sessions (date);
+                CREATE TABLE IF NOT EXISTS thresholds (
+                    session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+                    side TEXT NOT NULL,
+                    frequency INTEGER NOT NULL,
+                    value TEXT NOT NULL,
+                    PRIMARY KEY (session_id, side, frequency)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS metadata (
+                    session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+                    key TEXT NOT NULL,
+                    value TEXT,
+                    PRIMARY KEY (session_id, key)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS imported_files (
+                    path TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    session_id INTEGER REFERENCES sessions (id) ON DELETE SET NULL
+                );
+            """)
+        self.migrate()
+
+    def migrate(self):
+        """Updates databases of older versions. binaural was NOT NULL DEFAULT 0, so imported sessions
+        were stored as monaural although the CSV files do not say so. Now NULL means unknown.
+        """
+        with self.lock:
+            columns = {row['name']: row for row in self.connection.execute("PRAGMA table_info(sessions)")}
+            if not columns['binaural']['notnull']:
+                return
+            # SQLite cannot drop the constraint of a column, so the table is copied without it
+            self.connection.execute("PRAGMA foreign_keys=OFF")
+            try:
+                with self.connection:
+                    sql = self.connection.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'sessions'").fetchone()[0]
+                    self.connection.execute(sql.replace("sessions", "sessions_new", 1).replace("binaural INTEGER NOT NULL DEFAULT 0", "binaural INTEGER"))
+                    self.connection.execute("INSERT INTO sessions_new SELECT * FROM sessions")
+                    self.connection.execute("DROP TABLE sessions")
+                    self.connection.execute("ALTER TABLE sessions_new RENAME TO sessions")
+                    self.connection.execute("CREATE INDEX IF NOT EXISTS sessions_subject_date ON sessions (subject_id, date)")
+                    self.connection.execute("CREATE INDEX IF NOT EXISTS sessions_date ON sessions (date)")
+                    # imported sessions without program were stored as monaural, only differing ears prove it
+                    self.connection.execute("""
+                        UPDATE sessions SET binaural = NULL
+                        WHERE program IS NULL AND id IN (SELECT session_id FROM imported_files) AND NOT EXISTS (
+                            SELECT 1 FROM thresholds l JOIN thresholds r ON r.session_id = l.session_id AND r.frequency = l.frequency
+                            WHERE l.session_id = sessions.id AND l.side = 'l' AND r.side = 'r' AND l.value != r.value)
+                    """)
+            finally:
+                self.connection.execute("PRAGMA foreign_keys=ON")
+
+    def add_session(self, subject_id:str, date:str, thresholds:dict, metadata:dict=None, program:str=None, binaural:bool=False,
+                    headphone:str=None, csv_filename:str=None, audiogram_filename:str=None)->int:
+        """Stores a finished session.
+
+        Args:
+            subject_id (str): id of the subject
+            date (str): date and time of the session in the format YYYY-MM-DD HH:MM:SS
+            thresholds (dict of str:dict): values in dB HL, 'NH' or 'NaN' for each frequency (str or int) of the sides 'l' and 'r'
+            metadata (dict, optional): key/value pairs of the session, age and gender get their own columns. Defaults to None.
+            program (str, optional): name of the procedure. Defaults to None.
+            binaural (bool, optional): both ears were tested at the same time, None if unknown. Defaults to False.
+            headphone (str, optional): name of the headphone model. Defaults to None.
+            csv_filename (str, optional): name of the exported CSV file. Defaults to None.
+            audiogram_filename (str, optional): name of the exported audiogram. Defaults to None.
+
+        Returns:
+            int: id of the session in the database
+        """
+        with self.lock, self.connection:
+            return self.insert_session(subject_id, date, thresholds, metadata, program, binaural, headphone, csv_filename, audiogram_filename)
+
+    def insert_session(self, subject_id:str, date:str, thresholds:dict, metadata:dict=None, program:str=None, binaural:bool=False,
+                       headphone:str=None, csv_filename:str=None, audiogram_filename:str=None)->int:
+        """Inserts a session within the current transaction. Arguments like add_session().
+
+        Returns:
+            int: id of the session in the database
+        """
+        metadata = dict(metadata or {})
+        metadata.pop("id", None)
+        cursor = self.connection.execute(
+            "INSERT INTO sessions (subject_id, date, program, binaural, headphone, age, gender, csv_filename, audiogram_filename) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (subject_id, date, program, None if binaural is None else int(binaural), headphone, metadata.pop("age", None), metadata.pop("gender", None),
+             os.path.abspath(csv_filename) if csv_filename else None,
+             os.path.abspath(audiogram_filename) if audiogram_filename else None))
+        session_id = cursor.lastrowid
+        self.connection.executemany(
+            "INSERT INTO thresholds (session_id, side, frequency, value) VALUES (?, ?, ?, ?)",
+            [(session_id, side, int(frequency), str(value)) for side, values in thresholds.items() for frequency, value in values.items()])
+        self.connection.executemany(
+            "INSERT INTO metadata (session_id, key, value) VALUES (?, ?, ?)",
+            [(session_id, key, None if value is None else str(value)) for key, value in metadata.items()])
+        return session_id
+
+    def get_imported_files(self)->dict:
+        """Gets the signatures of all imported CSV files.
+
+        Returns:
+            dict of str:tuple : (mtime_ns, size) for each absolute path
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT path, mtime_ns, size FROM imported_files").fetchall()
+        return {path: (mtime_ns, size) for path, mtime_ns, size in rows}
+
+    def import_sessions(self, sessions:list):
+        """Stores imported sessions in one transaction. A file that was imported before is replaced,
+        a file that was already stored when its session was finished is only marked as imported.
+
+        Args:
+            sessions (list of dict): keyword arguments of add_session() and 'file': (path, mtime_ns, size)
+        """
+        with self.lock, self.connection:
+            for session in sessions:
+                session = dict(session)
+                path, mtime_ns, size = session.pop('file')
+                path = os.path.abspath(path)
+                self.connection.execute("DELETE FROM sessions WHERE id IN (SELECT session_id FROM imported_files WHERE path = ?)", (path,))
+                row = self.connection.execute("SELECT id FROM sessions WHERE csv_filename = ?", (path,)).fetchone()
+                session_id = row[0] if row is not None else self.insert_session(**session)
+                self.connection.execute("INSERT OR REPLACE INTO imported_files (path, mtime_ns, size, session_id) VALUES (?, ?, ?, ?)",
+                                        (path, mtime_ns, size, session_id))
+
+    def has_subject(self, subject_id:str)->bool:
+        """Checks if there are sessions of a subject.
+
+        Args:
+            subject_id (str): id of the subject
+
+        Returns:
+            bool: at least one session is stored
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT 1 FROM sessions WHERE subject_id = ? LIMIT 1", (subject_id,)).fetchone()
+        return row is not None
+
+    def has_csv_file(self, csv_filename:str)->bool:
+        """Checks if a CSV file has already been stored.
+
+        Args:
+            csv_filename (str): name of the exported CSV file
+
+        Returns:
+            bool: a session with this file is stored
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT 1 FROM sessions WHERE csv_filename = ?", (os.path.abspath(csv_filename),)).fetchone()
+        return row is not None
+
+    def get_sessions(self, subject_id:str)->list:
+        """Gets all sessions of a subject, oldest first.
+
+        Args:
+            subject_id (str): id of the subject
+
+        Returns:
+            list of dict: columns of the sessions table
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT * FROM sessions WHERE subject_id = ? ORDER BY date", (subject_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_thresholds(self, session_id:int)->dict:
+        """Gets the thresholds of a session.
+
+        Args:
+            session_id (int): id of the session in the database
+
+        Returns:
+            dict of str:dict : values for each frequency (int) of the sides 'l' and 'r'
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT side, frequency, value FROM thresholds WHERE session_id = ?", (session_id,)).fetchall()
+        thresholds = {}
+        for side, frequency, value in rows:
+            thresholds.setdefault(side, {})[frequency] = value
+        return thresholds
+
+    def get_history(self, subject_id:str, frequency:int, side:str='l')->list:
+        """Gets the threshold of a subject at one frequency in all sessions, oldest first.
+
+        Args:
+            subject_id (str): id of the subject
+            frequency (int): frequency in Hz
+            side (str, optional): 'l' or 'r'. Defaults to 'l'.
+
+        Returns:
+            list of tuple: (date, value) for each session
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT s.date, t.value FROM sessions s JOIN thresholds t ON t.session_id = s.id "
+                "WHERE s.subject_id = ? AND t.frequency = ? AND t.side = ? ORDER BY s.date",
+                (subject_id, frequency, side)).fetchall()
+        return [tuple(row) for row in rows]
+
+    def close(self):
+        """Closes the database.
+        """
+        with self.lock:
+            self.connection.close()
+
+
+session_stores = {} # open databases for each save path
+session_stores_lock = threading.Lock()
+
+def get_session_store(save_path:str)->SessionStore:
+    """Gets the database in the save path if SESSION_STORE is enabled in config.py.
+
+    Args:
+        save_path (str): folder of the results
+
+    Returns:
+        SessionStore: database, None if the store is disabled or cannot be opened
+    """
+    if not SESSION_STORE or not save_path:
+        return
+    with session_stores_lock:
+        if save_path not in session_stores:
+            try:
+                os.makedirs(save_path, exist_ok=True)
+                session_stores[save_path] = SessionStore(os.path.join(save_path, SESSION_STORE_FILENAME))
+            except (OSError, sqlite3.Error) as e: # the store is optional, the CSV files and audiograms are written anyway
+                print(f"Error opening the session database in {save_path}: {e}")
+                return
+        return session_stores[save_path]
@@ -0,0 +1,150 @@
+import math
+import random
+from .audio_player import AudioPlayer
+from .audio_backends import NullBackend
+from .clock import VirtualClock
+from .model import Familiarization, StandardProcedure, ScreeningProcedure, BayesianProcedure
+
+
+class SimulatedSubject:
+
+    def __init__(self, thresholds:dict, slope:float=1.0, false_alarm_rate:float=0.0, lapse_rate:float=0.0, reaction_time:float=0.4, seed:int=None):
+        """Virtual subject that answers presentations instead of a person at the keyboard.
+        It can be passed as responder to all procedures.
+        The probability of a response follows a logistic psychometric function:
+        p = false_alarm_rate + (1 - false_alarm_rate - lapse_rate) / (1 + exp(-slope * (level - threshold)))
+
+        Args:
+            thresholds (dict): true thresholds in dB HL, either dict of int:float for both ears
+                or dict of str:dict with the sides 'l' and 'r' as keys
+            slope (float, optional): slope of the psychometric function in 1/dB. Defaults to 1.0.
+            false_alarm_rate (float, optional): probability of a response to an inaudible tone. Defaults to 0.0.
+            lapse_rate (float, optional): probability of missing a clearly audible tone. Defaults to 0.0.
+            reaction_time (float, optional): time in seconds from the onset to the response, used by VirtualClock. Defaults to 0.4.
+            seed (int, optional): seed for the answers. The same seed gives the same answers. Defaults to None.
+        """
+        if 'l' in thresholds or 'r' in thresholds:
+            self.thresholds = {'l': dict(thresholds['l']), 'r': dict(thresholds['r'])}
+        else:
+            self.thresholds = {'l': dict(thresholds), 'r': dict(thresholds)}
+        self.slope = slope
+        self.false_alarm_rate = false_alarm_rate
+        self.lapse_rate = lapse_rate
+        self.reaction_time = reaction_time
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.press_time = None # no real key press, so no reaction time is stored
+        self.skip_requested = False
+        self.response = False
+        self.presentations = [] # (frequency, level, side, heard) for each presentation
+
+    def reset(self, seed:int=None):
+        """Starts a new session with the given seed.
+
+        Args:
+            seed (int, optional): seed for the answers. The seed from the creation is used if None. Defaults to None.
+        """
+        if seed is not None:
+            self.seed = seed
+        self.random = random.Random(self.seed)
+        self.presentations = []
+
+    def get_threshold(self, frequency:int, side:str)->float:
+        """Gets the true threshold. Tones on both ears are heard with the better ear.
+
+        Args:
+            frequency (int): frequency in Hz
+            side (str): 'l', 'r' or 'lr'
+
+        Returns:
+            float: threshold in dB HL
+        """
+        if side == 'lr':
+            return min(self.thresholds['l'][frequency], self.thresholds['r'][frequency])
+        return self.thresholds[side][frequency]
+
+    def probability(self, frequency:int, level:float, side:str)->float:
+        """Calculates the probability of a response.
+
+        Args:
+            frequency (int): frequency in Hz
+            level (float): level in dB HL
+            side (str): 'l', 'r' or 'lr'
+
+        Returns:
+            float: probability of a response
+        """
+        x = self.slope * (level - self.get_threshold(frequency, side))
+        detection = 1 / (1 + math.exp(-x)) if x > -700 else 0.0 # avoid overflow far below threshold
+        return self.false_alarm_rate + (1 - self.false_alarm_rate - self.lapse_rate) * detection
+
+    def arm(self, frequency:int=None, level:float=None, side:str=None):
+        """Decides about the response to the next tone.
+
+        Args:
+            frequency (int): frequency of the next tone in Hz
+            level (float): level of the next tone in dB HL
+            side (str): 'l', 'r' or 'lr'
+        """
+        self.response = self.random.random() < self.probability(frequency, level, side)
+        self.presentations.append((frequency, level, side, self.response))
+
+    def wait(self, timeout:float)->bool:
+        """Returns the response immediately.
+
+        Args:
+            timeout (float): maximum waiting time in seconds (not used)
+
+        Returns:
+            bool: True if the tone was heard
+        """
+        return self.response
+
+
+def run_session(subject:SimulatedSubject, program:str="standard", binaural:bool=False, headphone_name:str="Sennheiser_HDA200", calibrate:bool=True, id:str="simulation")->dict:
+    """Runs the familiarization and a procedure with a simulated subject, without audio output
+    and on a VirtualClock, so no time is spent waiting. No CSV file or audiogram is exported.
+    With a seeded subject, the same seed gives the same session.
+
+    Args:
+        subject (SimulatedSubject): subject that answers the presentations
+        program (str, optional): "standard", "interleaved", "screening" or "bayesian". Defaults to "standard".
+        binaural (bool, optional): test both ears at once. Defaults to False.
+        headphone_name (str, optional): Name of headphone model being used. Defaults to Sennheiser_HDA200.
+        calibrate (bool, optional): Use calibration file. Defaults to True.
+        id (str, optional): id stored in the results. Defaults to "simulation".
+
+    Returns:
+        dict: 'familiarization' (bool), 'success' (bool), 'audiogram' (Audiogram with the results),
+            'presentations' (number of played tones) and 'duration' (time in seconds a real session would have taken)
+    """
+    clock = VirtualClock()
+    audio_player = AudioPlayer(backend=NullBackend(clock=clock))
+    # pauses and track order are drawn from the seed of the subject, separate from its answers
+    rng = random.Random(f"procedure:{subject.seed}") if subject.seed is not None else random.Random()
+    familiarization = Familiarization(headphone_name=headphone_name, calibrate=calibrate, id=id, audio_player=audio_player, responder=subject, clock=clock, rng=rng)
+    session = {'familiarization': familiarization.familiarize(), 'success': False}
+
+    if session['familiarization']:
+        if program == "screening":
+            procedure = ScreeningProcedure(familiarization.get_results(), headphone_name=headphone_name, calibrate=calibrate, audio_player=audio_player, responder=subject, clock=clock, rng=rng)
+        elif program == "bayesian":
+            procedure = BayesianProcedure(familiarization.get_results(), headphone_name=headphone_name, calibrate=calibrate, audio_player=audio_player, responder=subject, clock=clock, rng=rng)
+        else:
+            procedure = StandardProcedure(familiarization.get_results(), headphone_name=headphone_name, calibrate=calibrate, audio_player=audio_player, responder=subject, clock=clock, rng=rng)
+        procedure.export = False
+        if program == "screening":
+            session['success'] = procedure.screen_test(binaural) is not False
+        elif program == "bayesian":
+            session['success'] = procedure.bayesian_test(binaural)
+        elif program == "interleaved":
+            session['success'] = procedure.standard_test_interleaved(binaural)
+        else:
+            session['success'] = procedure.standard_test(binaural)
+
+    session['audiogram'] = familiarization.get_results().get_audiogram()
+    session['presentations'] = len(subject.presentations)
+    session['duration'] = clock.now()
+    familiarization.get_results().close(remove=True)
+    audio_player.close()
+    return session
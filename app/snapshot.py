@@ -0,0 +1,145 @@
+"""Columnar snapshot of all sessions in one NumPy archive for fast bulk loading.
+
+The thresholds are stored as int16 levels and uint8 status codes of audiogram_data (HEARD, NOT_HEARD, MISSING)
+with the shape session x ear x frequency, next to one array per column: subject ID, timestamp, headphone,
+procedure and metadata.
+Without compression, load_snapshot() maps the arrays into memory instead of reading the file.
+
+Run from the repository root:
+    python -m app.snapshot results --output sessions.npz
+"""
+import os
+import struct
+import zipfile
+import argparse
+import numpy as np
+from .audiogram_data import HEARD
+from .config import SESSION_STORE_FILENAME
+from .session_store import SessionStore
+from .analytics import load_sessions, frequencies, sides
+
+
+categorical_columns = ['program', 'headphone', 'gender'] # stored as codes into a list of categories
+header_readers = {(1, 0): np.lib.format.read_array_header_1_0, (2, 0): np.lib.format.read_array_header_2_0}
+
+def encode_levels(data:dict)->np.ndarray:
+    """Converts the levels into integers like in an Audiogram, 0 where the status is not HEARD.
+
+    Args:
+        data (dict): arrays from analytics.load_sessions()
+
+    Returns:
+        np.ndarray: int16 levels in dB HL with the shape session x ear x frequency
+    """
+    levels = np.zeros(data['levels'].shape, dtype=np.int16)
+    heard = data['status'] == HEARD
+    limits = np.iinfo(np.int16)
+    levels[heard] = np.clip(np.rint(data['levels'][heard]), limits.min, limits.max)
+    return levels
+
+def read_metadata(store:SessionStore, session_ids:np.ndarray)->dict:
+    """Reads the metadata without own column in the sessions table.
+
+    Args:
+        store (SessionStore): database of the sessions
+        session_ids (np.ndarray): ids of the sessions, ascending
+
+    Returns:
+        dict of str:np.ndarray : one string array per key, '' where a session has no value
+    """
+    with store.lock:
+        rows = store.connection.execute("SELECT session_id, key, value FROM metadata ORDER BY key").fetchall()
+    columns = {}
+    for session_id, key, value in rows:
+        index = np.searchsorted(session_ids, session_id)
+        if index < len(session_ids) and session_ids[index] == session_id:
+            columns.setdefault(key, {})[int(index)] = value or ""
+    metadata = {}
+    for key, values in columns.items():
+        column = np.full(len(session_ids), "", dtype=f"<U{max(len(v) for v in values.values()) or 1}")
+        column[list(values)] = list(values.values())
+        metadata[key] = column
+    return metadata
+
+def export_snapshot(save_path:str, filename:str, database:str=None, compress:bool=False)->int:
+    """Writes all sessions of the database into a columnar archive.
+
+    Args:
+        save_path (str): folder of the results
+        filename (str): name of the .npz file
+        database (str, optional): name of the database file. SESSION_STORE_FILENAME in the save path if None. Defaults to None.
+        compress (bool, optional): Compress the archive. Compressed arrays cannot be mapped into memory. Defaults to False.
+
+    Returns:
+        int: number of sessions
+    """
+    data = load_sessions(save_path, database)
+    store = SessionStore(database or os.path.join(save_path, SESSION_STORE_FILENAME))
+    try:
+        metadata = read_metadata(store, data['session_id'])
+    finally:
+        store.close()
+
+    snapshot = {'frequencies': np.array(frequencies, dtype=np.int16),
+                'sides': np.array(sides),
+                'session_id': data['session_id'],
+                'subject_id': data['subject_id'],
+                'timestamp': np.array(data['date'], dtype='datetime64[s]'),
+                'levels': encode_levels(data),
+                'status': data['status'],
+                'age': data['age']}
+    for column in categorical_columns:
+        categories, codes = np.unique(data[column], return_inverse=True)
+        snapshot[column + '_categories'] = categories
+        snapshot[column + '_codes'] = codes.astype(np.uint16)
+    for key, column in metadata.items():
+        snapshot['metadata_' + key] = column
+
+    (np.savez_compressed if compress else np.savez)(filename, **snapshot)
+    return len(data['session_id'])
+
+def load_snapshot(filename:str)->dict:
+    """Opens a snapshot. Uncompressed arrays are mapped into memory, so only the parts
+    that are accessed are read from the file. Compressed arrays are read completely.
+
+    Args:
+        filename (str): name of the .npz file
+
+    Returns:
+        dict of str:np.ndarray : arrays of export_snapshot()
+    """
+    arrays = {}
+    with zipfile.ZipFile(filename) as archive, open(filename, 'rb') as file:
+        for info in archive.infolist():
+            name = info.filename[:-len(".npy")]
+            header = None
+            if info.compress_type == zipfile.ZIP_STORED:
+                # the array starts after the local header of the member and the header of the .npy format
+                file.seek(info.header_offset)
+                name_length, extra_length = struct.unpack("<26xHH", file.read(30))
+                file.seek(info.header_offset + 30 + name_length + extra_length)
+                read_header = header_readers.get(np.lib.format.read_magic(file))
+                header = read_header(file) if read_header is not None else None
+            if header is None or header[2].hasobject or 0 in header[0] or header[0] == ():
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+            else:
+                shape, fortran_order, dtype = header
+                arrays[name] = np.memmap(filename, dtype=dtype, mode='r', shape=shape,
+                                         order='F' if fortran_order else 'C', offset=file.tell())
+    return arrays
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('save_path', help='folder of the results')
+    parser.add_argument('--output', default='sessions.npz', help='name of the snapshot (default: %(default)s)')
+    parser.add_argument('--database', default=None, help=f'database file (default: {SESSION_STORE_FILENAME} in the save path)')
+    parser.add_argument('--compress', action='store_true', help='compress the snapshot, it can then not be mapped into memory')
+    args = parser.parse_args()
+
+    num_sessions = export_snapshot(args.save_path, args.output, args.database, args.compress)
+    print(f"{num_sessions} Sitzungen gespeichert als " + args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,10 +6,13 @@ import ttkbootstrap as tb
 from PIL import Image, ImageTk
 import os
 import csv
-import time
+import sqlite3
 import random
 from .instructions import *
 from .config import *
+from .reference_data import get_headphone_models
+from .clock import real_clock
+from .session_store import get_session_store
 
 
 class App(tb.Window):
@@ -198,6 +201,32 @@ class App(tb.Window):
         self.process_done = True
         self.after(100, callback)
 
+    def get_subject_images(self, proband_number:str)->list:
+        """Gets the audiograms of a subject. With the session store enabled, they are found by an indexed query
+        instead of scanning the folder of the subject.
+
+        Args:
+            proband_number (str): id of the subject
+
+        Returns:
+            list: List of image file paths if any image files are found, False otherwise.
+        """
+        store = get_session_store(self.save_path)
+        if store is not None:
+            try:
+                image_files = [s['audiogram_filename'] for s in store.get_sessions(proband_number)
+                               if s['audiogram_filename'] and os.path.exists(s['audiogram_filename'])]
+                return image_files if image_files else False
+            except sqlite3.Error as e:
+                print(f"Error reading the session database, the folder of the subject is searched: {e}")
+        return self.get_images_in_path(os.path.join(self.save_path, proband_number))
+
+    def refresh_results(self):
+        """Shows the images of the current subject again, e.g. when an audiogram was exported in the background.
+        Can be called from other threads.
+        """
+        self.after(0, lambda: self.frames[ResultPage].display_images(self.frames[MainMenu].proband_number))
+
     def change_save_path(self):
         """Asks the user to select a folder to save the files. Changes settings.csv file accordingly.
         """
@@ -324,15 +353,8 @@ class MainMenu(ttk.Frame):
             messagebox.showwarning("Warnung", f'Die Datei "{file_name}" konnte nicht gefunden werden.')
             return
         
-        headphone_options = []
-
         try:
-            with open(file_name, mode='r') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    headphone_options.append(row['headphone_model'])
-                    headphone_options = list(set(headphone_options))
-            return headphone_options
+            return get_headphone_models() # parsed once and shared with the procedures
         except Exception as e:
             messagebox.showwarning("Warnung", f'Fehler beim Lesen der Datei "{file_name}": {e}')
             return
@@ -387,9 +409,16 @@ class MainMenu(ttk.Frame):
                     messagebox.showwarning("Warnung", 'Bitte geben Sie bei Alter eine gültige Zahl oder gar nichts ein.')
                     return
 
-            proband_folder = os.path.join(self.parent.save_path, self.proband_number)
-            pics = self.parent.get_images_in_path(proband_folder)
-            if pics:
+            store = get_session_store(self.parent.save_path)
+            subject_exists = None
+            if store is not None: # indexed query instead of a directory scan
+                try:
+                    subject_exists = store.has_subject(self.proband_number)
+                except sqlite3.Error as e:
+                    print(f"Error reading the session database, the folder of the subject is searched: {e}")
+            if subject_exists is None:
+                subject_exists = self.parent.get_images_in_path(os.path.join(self.parent.save_path, self.proband_number))
+            if subject_exists:
                 if messagebox.askyesno("Proband vorhanden", "Für diese Probandennummer gibt es bereits Ergebnisse. Möchten Sie diese anzeigen?"):
                     results_page = self.parent.frames[ResultPage]
                     results_page.display_images(self.proband_number)
@@ -450,19 +479,18 @@ class FamiliarizationPage(ttk.Frame):
                                                                                                    gender=gender,
                                                                                                    age=age), 
                                      lambda: self.parent.show_frame(ProgramPage))
-        time.sleep(0.001)
+        real_clock.sleep(0.001)
         self.update()
        
-        counter = 3000 # set a high value so that progress bar is updated once at the beginning
+        last_update = None # progress bar is updated once at the beginning
         sleep_time = random.uniform(0.1, 0.5) # random time in seconds between 0.1 and 0.5 to update progress bar
         
         while self.parent.frames[DuringFamiliarizationView].progress_var.get() < 100 and not self.parent.process_done:
             progress = int(self.parent.frames[DuringFamiliarizationView].get_progress() * 100)
-            if counter >= sleep_time * 1000:
+            if last_update is None or real_clock.now() - last_update >= sleep_time:
                 self.parent.frames[DuringFamiliarizationView].progress_var.set(progress)
-                counter = 0
-            time.sleep(0.001)
-            counter += 1
+                last_update = real_clock.now()
+            real_clock.sleep(0.001)
             self.update()
         
         self.parent.process_done = False
@@ -501,19 +529,18 @@ class ProgramPage(ttk.Frame):
         self.parent.wait_for_process(lambda: self.parent.frames[self.selected_option].program(self.binaural_test, calibrate=self.use_calibration),
                                      self.show_results)
         
-        time.sleep(0.001)
+        real_clock.sleep(0.001)
         self.update()
         
-        counter = 3000 # set a high value so that progress bar is updated once at the beginning
+        last_update = None # progress bar is updated once at the beginning
         sleep_time = random.uniform(1, 2.5) # random time in seconds between 1 and 2.5 to update progress bar
         
         while self.parent.frames[self.selected_option].progress_var.get() < 100 and not self.parent.process_done:
             progress = int(self.parent.frames[self.selected_option].get_progress() * 100)
-            if counter >= sleep_time * 1000:
+            if last_update is None or real_clock.now() - last_update >= sleep_time:
                 self.parent.frames[self.selected_option].progress_var.set(progress)
-                counter = 0
-            time.sleep(0.001)
-            counter += 1
+                last_update = real_clock.now()
+            real_clock.sleep(0.001)
             self.update()
         
         self.parent.process_done = False
@@ -620,11 +647,10 @@ class ResultPage(ttk.Frame):
         Args:
             folder_name (str): name of the folder containing the images
         """
-        folder_path = os.path.join(self.parent.save_path, folder_name)
         for widget in self.image_frame.winfo_children():
             widget.destroy()
         
-        pics = self.parent.get_images_in_path(folder_path)
+        pics = self.parent.get_subject_images(folder_name)
         if pics:
             for file in pics:
                 img = Image.open(file)
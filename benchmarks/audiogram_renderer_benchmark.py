@@ -0,0 +1,69 @@
+"""Benchmark for rendering audiograms into PNG files.
+
+before: create_audiogram builds a new figure with bands, labels, ticks and grid for every audiogram
+after:  AudiogramRenderer keeps one figure and only swaps lines, markers, legend and note
+
+Both variants are checked for pixel-identical output.
+
+Run from the repository root:
+    python benchmarks/audiogram_renderer_benchmark.py
+"""
+import os
+import io
+import sys
+import time
+import random
+import tempfile
+import contextlib
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.audiogram import create_audiogram, AudiogramRenderer
+from app.audiogram_data import Audiogram
+
+
+FREQS = [125, 250, 500, 1000, 2000, 4000, 8000]
+
+
+def random_audiograms(number:int, seed:int=0)->list:
+    """Draws audiograms with levels, 'NH' and 'NaN' values.
+    """
+    rng = random.Random(seed)
+    def value():
+        r = rng.random()
+        return 'NH' if r < 0.1 else 'NaN' if r < 0.15 else str(rng.randrange(-10, 121, 5))
+    return [Audiogram.from_values(FREQS, [value() for f in FREQS], [value() for f in FREQS]) for _ in range(number)]
+
+def render_before(audiogram:Audiogram, binaural:bool, name:str):
+    """Renders with a new figure like the export before.
+    """
+    with contextlib.redirect_stdout(io.StringIO()): # create_audiogram prints the values
+        create_audiogram(audiogram, binaural=binaural, name=name)
+
+def main():
+    number = 40
+    audiograms = random_audiograms(number)
+    binaural = [i % 4 == 0 for i in range(number)]
+    renderer = AudiogramRenderer()
+
+    with tempfile.TemporaryDirectory() as folder:
+        variants = {'before': lambda a, b, name: render_before(a, b, name),
+                    'after': lambda a, b, name: renderer.render(a, binaural=b, name=name)}
+        print(f"{'variant':>7} {'renders/s':>10} {'ms/render':>10}")
+        for variant, render in variants.items():
+            render(audiograms[0], False, os.path.join(folder, "warmup.png")) # fonts and cached figure
+            start = time.perf_counter()
+            for i, (audiogram, b) in enumerate(zip(audiograms, binaural)):
+                render(audiogram, b, os.path.join(folder, f"{variant}_{i}.png"))
+            seconds = (time.perf_counter() - start) / number
+            print(f"{variant:>7} {1 / seconds:>10.1f} {seconds * 1000:>10.1f}")
+
+        from PIL import Image
+        identical = all(np.array_equal(np.asarray(Image.open(os.path.join(folder, f"before_{i}.png"))),
+                                       np.asarray(Image.open(os.path.join(folder, f"after_{i}.png"))))
+                        for i in range(number))
+        print("pixel-identical:", identical)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Benchmark for building the stereo frames of one beep on a single channel,
+and for the whole play_beep() path up to the hand-off to sounddevice.
+
+before: float64 tone, a zero array and a transposed 2 x N array, which is converted
+        into a contiguous float32 buffer for the device
+after:  FrameBuilder writes the float32 tone directly into a preallocated buffer
+
+For play_beep() the sounddevice module of the backend is replaced by HandOff, which
+converts the frames into the contiguous float32 buffer PortAudio reads, so no sound card is needed.
+
+Run from the repository root:
+    python benchmarks/frame_builder_benchmark.py
+"""
+import os
+import sys
+import timeit
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.audio_player import AudioPlayer, FrameBuilder
+from app.audio_backends import SoundDeviceBackend
+
+
+FS = 48000
+VOLUME = 0.1
+FREQUENCY = 1000
+
+
+def unit_tone(duration:float)->np.array:
+    """Generates a unit-amplitude sine tone without fade-out.
+    """
+    t = np.linspace(0, duration, int(FS * duration), endpoint=False)
+    return np.sin(2 * np.pi * FREQUENCY * t)
+
+
+class HandOff:
+    """Takes the place of sounddevice: keeps the frames of the last play() like sd.play() does.
+    """
+
+    def play(self, data:np.array, samplerate:float, device=None):
+        self.data = np.ascontiguousarray(data, dtype=np.float32) # copies only if the frames are not in the device format
+
+    def stop(self):
+        pass
+
+
+def frames_before(tone:np.array)->np.array:
+    """Builds frames like the previous AudioPlayer.play_beep for channel 'l'.
+    """
+    scaled = tone * VOLUME
+    frames = np.array([scaled, np.zeros(len(scaled))]).T
+    return np.ascontiguousarray(frames, dtype=np.float32) # copy into the device format
+
+def frames_after(builder:FrameBuilder, tone:np.array)->np.array:
+    """Builds frames with the FrameBuilder for channel 'l'.
+    """
+    return builder.build(tone, VOLUME, 'l')
+
+def play_beep_before(hand_off:HandOff, waveform:np.array, channel:str):
+    """Plays a beep like the previous AudioPlayer.play_beep.
+    """
+    tone = waveform * VOLUME
+    if channel == 'l':
+        hand_off.play(np.array([tone, np.zeros(len(tone))]).T, FS)
+    else:
+        hand_off.play(tone, FS)
+
+def play_beep_after(player:AudioPlayer, duration:float, channel:str):
+    """Plays a beep through AudioPlayer.play_beep and the SoundDeviceBackend without persistent stream.
+    """
+    player.play_beep(FREQUENCY, VOLUME, duration, channel)
+
+def measure_allocations(func)->int:
+    """Measures the memory allocated during one call (including temporary arrays).
+
+    Returns:
+        int: peak of allocated memory in bytes
+    """
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak
+
+def main():
+    repetitions = 20
+    print(f"{'duration':>8} {'variant':>7} {'ms/beep':>9} {'allocated MiB':>14}")
+
+    for duration in (1, 10):
+        tone64 = unit_tone(duration)
+        tone32 = tone64.astype(np.float32)
+        builder = FrameBuilder()
+        builder.build(tone32, VOLUME, 'l') # allocate buffers before measuring
+        builder.build(tone32, VOLUME, 'l')
+
+        variants = {'before': lambda: frames_before(tone64),
+                    'after': lambda: frames_after(builder, tone32)}
+
+        for name, func in variants.items():
+            seconds = timeit.timeit(func, number=repetitions) / repetitions
+            peak = measure_allocations(func)
+            print(f"{duration:>7}s {name:>7} {seconds * 1000:>9.3f} {peak / 2**20:>14.2f}")
+
+    print()
+    print("play_beep() including the hand-off to sounddevice")
+    print(f"{'duration':>8} {'channel':>7} {'variant':>7} {'ms/beep':>9} {'allocated MiB':>14}")
+    backend = SoundDeviceBackend(FS)
+    backend.sd = HandOff()
+    player = AudioPlayer(backend=backend)
+    for duration in (1, 10):
+        player.play_beep(FREQUENCY, VOLUME, duration, 'l') # generate and cache the waveform before measuring
+        waveform = player.get_waveform().astype(np.float64)
+        for channel in ('l', 'lr'):
+            player.play_beep(FREQUENCY, VOLUME, duration, channel) # allocate buffers before measuring
+            player.play_beep(FREQUENCY, VOLUME, duration, channel)
+
+            variants = {'before': lambda: play_beep_before(backend.sd, waveform, channel),
+                        'after': lambda: play_beep_after(player, duration, channel)}
+
+            for name, func in variants.items():
+                seconds = timeit.timeit(func, number=repetitions) / repetitions
+                peak = measure_allocations(func)
+                print(f"{duration:>7}s {channel:>7} {name:>7} {seconds * 1000:>9.3f} {peak / 2**20:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
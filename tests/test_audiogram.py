@@ -0,0 +1,32 @@
+"""Run from the repository root:
+    python -m pytest tests
+"""
+import matplotlib.image as mpimg
+import numpy as np
+from app.audiogram import create_audiogram, AudiogramRenderer
+from app.audiogram_data import Audiogram
+
+
+freqs = [125, 250, 500, 1000, 2000, 4000, 8000]
+cases = {
+    'monaural': (freqs, [10, 15, 20, 25, 30, 45, 60], [5, 10, 15, 20, 35, 50, 70], False),
+    'binaural': (freqs, [20, 20, 25, 30, 30, 40, 55], [20, 20, 25, 30, 30, 40, 55], True),
+    'not_heard': (freqs, [10, 'NH', 20, 'NaN', 30, 'NH', 'NH'], ['NH', 15, 'NaN', 20, 25, 'NH', 60], False),
+    'empty': (freqs, ['NaN'] * 7, ['NH'] * 7, False),
+}
+
+def test_renderer_matches_create_audiogram(tmp_path):
+    renderer = AudiogramRenderer()
+    # render every case twice with the same renderer, so the cached figure and bounding boxes are reused
+    for run in range(2):
+        for case, (case_freqs, left_values, right_values, binaural) in cases.items():
+            expected = str(tmp_path / f"{case}_expected.png")
+            actual = str(tmp_path / f"{case}_{run}.png")
+            if run == 0:
+                create_audiogram(case_freqs, left_values, right_values, binaural=binaural, name=expected)
+            renderer.render(Audiogram.from_values(case_freqs, left_values, right_values), binaural=binaural, name=actual)
+            expected_image = mpimg.imread(expected)
+            actual_image = mpimg.imread(actual)
+            assert expected_image.shape == actual_image.shape, case
+            np.testing.assert_array_equal(expected_image, actual_image, err_msg=case)
+    renderer.close()
@@ -0,0 +1,60 @@
+"""Run from the repository root:
+    python -m pytest tests
+"""
+import numpy as np
+import pytest
+from app.audiogram_data import Audiogram, parse_value, HEARD, NOT_HEARD, MISSING
+
+
+freq_bands = ['125', '250', '500', '1000', '2000', '4000', '8000']
+
+def test_parse_value():
+    assert parse_value(30) == (30.0, HEARD)
+    assert parse_value("12.5") == (12.5, HEARD)
+    assert parse_value('NH')[1] == NOT_HEARD
+    for value in ['NaN', '', None, float('nan')]:
+        level, status = parse_value(value)
+        assert np.isnan(level) and status == MISSING
+    with pytest.raises(ValueError):
+        parse_value("x")
+
+def test_csv_round_trip(tmp_path):
+    filename = str(tmp_path / "input.csv")
+    with open(filename, mode='w', newline='') as csv_file:
+        csv_file.write(",".join(freq_bands) + "\n")
+        csv_file.write("10,NH,,NaN,12.0,-5,120\n")
+        csv_file.write("12.4,12.6,NaN,NH,0,,35\n")
+        csv_file.write("id,p01,,,,,\n")
+
+    audiogram = Audiogram.read_csv(filename)
+    assert audiogram.freqs.tolist() == [int(f) for f in freq_bands]
+    assert audiogram.levels.dtype == np.int16 and audiogram.status.dtype == np.uint8
+    assert audiogram.get_values('l') == ['10', 'NH', 'NaN', 'NaN', '12', '-5', '120']
+    assert audiogram.get_values('r') == ['12', '13', 'NaN', 'NH', '0', 'NaN', '35']
+    assert audiogram.heard().tolist() == [[True, False, False, False, True, True, True],
+                                          [True, True, False, False, True, False, True]]
+    assert audiogram.not_heard().tolist() == [[False, True, False, False, False, False, False],
+                                              [False, False, False, True, False, False, False]]
+    assert (audiogram.missing() == ~(audiogram.heard() | audiogram.not_heard())).all()
+    assert (audiogram.levels[~audiogram.heard()] == 0).all()
+
+    output = str(tmp_path / "output.csv")
+    audiogram.write_csv(output, metadata={'id': 'p01'})
+    restored = Audiogram.read_csv(output)
+    np.testing.assert_array_equal(restored.freqs, audiogram.freqs)
+    np.testing.assert_array_equal(restored.levels, audiogram.levels)
+    np.testing.assert_array_equal(restored.status, audiogram.status)
+    with open(output, mode='r', newline='') as csv_file:
+        assert csv_file.read().splitlines()[3] == "id,p01,,,,,"
+
+def test_read_csv_rejects_invalid_files(tmp_path):
+    filename = str(tmp_path / "short.csv")
+    with open(filename, mode='w', newline='') as csv_file:
+        csv_file.write(",".join(freq_bands) + "\n10,10,10,10,10,10,10\n")
+    with pytest.raises(ValueError):
+        Audiogram.read_csv(filename)
+
+    with open(filename, mode='w', newline='') as csv_file:
+        csv_file.write(",".join(freq_bands) + "\n10,10,10,10,10,10,10\n10,10,x,10,10,10,10\n")
+    with pytest.raises(ValueError):
+        Audiogram.read_csv(filename)
@@ -0,0 +1,15 @@
+"""Run from the repository root:
+    python -m pytest tests
+"""
+import numpy as np
+from app.evaluation import evaluate, summarize
+
+
+def test_evaluate_is_reproducible():
+    for program in ["standard", "interleaved"]:
+        first = evaluate(program, num_sessions=3, workers=1, seed=7)
+        second = evaluate(program, num_sessions=3, workers=1, seed=7)
+        assert first.keys() == second.keys()
+        for key in first:
+            np.testing.assert_array_equal(first[key], second[key])
+        assert summarize(program, first) == summarize(program, second)
@@ -0,0 +1,48 @@
+"""Run from the repository root:
+    python -m pytest tests
+"""
+import csv
+from app.results import SessionResults
+
+
+freq_bands = ['125', '250', '500', '1000', '2000', '4000', '8000']
+
+def test_load_restores_session_after_crash(tmp_path):
+    journal_filename = str(tmp_path / "session.journal")
+    results = SessionResults(freq_bands, id="p01", journal_filename=journal_filename, sync_every=100, age=42)
+    results.set_value(30, 1000, 'l')
+    results.set_value('NH', 8000, 'r')
+    results.set_value(15, 500, 'lr')
+    results.set_value(35, 1000, 'l') # later records win
+    results.set_metadata("headphone", "HDA200")
+    results.journal.close() # crash: journal neither synced by close() nor removed
+
+    restored = SessionResults.load(journal_filename)
+    assert restored.freq_bands == freq_bands
+    assert restored.values == results.values
+    assert restored.get_value(1000, 'l') == '35'
+    assert restored.get_value(8000, 'r') == 'NH'
+    assert restored.get_value(500, 'r') == '15'
+    assert restored.get_value(250, 'l') == 'NaN'
+    assert restored.metadata == {'id': 'p01', 'age': '42', 'headphone': 'HDA200'}
+
+    restored.set_value(20, 2000, 'r') # new changes go to the same journal
+    restored.close()
+    assert SessionResults.load(journal_filename).get_value(2000, 'r') == '20'
+
+def test_write_csv_keeps_legacy_layout(tmp_path):
+    results = SessionResults(freq_bands, id="p01", journal_filename=str(tmp_path / "session.journal"), age=42)
+    results.set_value(10, 125, 'l')
+    results.set_value('NH', 8000, 'r')
+    filename = str(tmp_path / "p01.csv")
+    results.write_csv(filename)
+    results.close(remove=True)
+
+    with open(filename, mode='r', newline='') as csv_file:
+        lines = list(csv.reader(csv_file))
+    assert lines == [freq_bands,
+                     ['10', 'NaN', 'NaN', 'NaN', 'NaN', 'NaN', 'NaN'],
+                     ['NaN', 'NaN', 'NaN', 'NaN', 'NaN', 'NaN', 'NH'],
+                     ['id', 'p01', '', '', '', '', ''],
+                     ['age', '42', '', '', '', '', '']]
+    assert not (tmp_path / "session.journal").exists()